@@ -0,0 +1,74 @@
+'''
+Open Power System Data
+
+Time series Datapackage
+
+bench_combine.py : cost per file of combining the DataFrames parsed from the
+files of a dataset, one by one with combine_first() as read_dataset() used
+to and in one step with combine_pieces()
+
+Run from the repository root with ``python -m benchmarks.bench_combine``.
+
+'''
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from timeseries_scripts.read import combine_pieces
+
+
+def combine_one_by_one(pieces):
+    '''How read_dataset() combined the files of a dataset before.'''
+    cumulated = pd.DataFrame()
+    for df in pieces:
+        if cumulated.empty:
+            cumulated = df
+        else:
+            cumulated = cumulated.combine_first(df)
+    return cumulated
+
+
+def daily_pieces(files, columns):
+    '''
+    Return the DataFrames of files daily files of hourly data, as parsed
+    from Terna, each overlapping the next by one hour.
+
+    '''
+    rng = np.random.default_rng(0)
+    names = ['col{}'.format(i) for i in range(columns)]
+    start = pd.Timestamp('2012-07-17')
+    return [pd.DataFrame(rng.random((25, columns)),
+                         index=pd.date_range(start + pd.Timedelta(days=i),
+                                             periods=25, freq='H'),
+                         columns=names)
+            for i in range(files)]
+
+
+def timed(combine, pieces):
+    t0 = perf_counter()
+    combine(pieces)
+    return perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[2])
+    parser.add_argument('--files', type=int, nargs='+',
+                        default=[250, 500, 1000, 2000])
+    parser.add_argument('--columns', type=int, default=20)
+    args = parser.parse_args()
+
+    print('{} columns, ms per file'.format(args.columns))
+    print('  files | combine_first | combine_pieces')
+    for files in args.files:
+        pieces = daily_pieces(files, args.columns)
+        print('{:7} | {:13.3f} | {:14.3f}'.format(
+            files,
+            timed(combine_one_by_one, pieces) / files * 1000,
+            timed(combine_pieces, pieces) / files * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+'''
+Open Power System Data
+
+Time series Datapackage
+
+bench_download.py : wall-clock time of download_source() against a local
+stand-in server as the number of concurrent downloads rises
+
+Run from the repository root with ``python -m benchmarks.bench_download``.
+
+'''
+
+import argparse
+import tempfile
+from datetime import date
+from time import perf_counter
+
+from timeseries_scripts.download import download_source
+from timeseries_scripts.scheduler import DownloadScheduler
+
+from .standin import standin_server
+
+
+def run(url, workers, days):
+    '''Download days daily files with workers concurrent downloads.'''
+    source_dict = {'daily': {
+        'url_template': url + '/{u_start:%Y-%m-%d}.csv',
+        'url_params_template': None,
+        'frequency': 'daily',
+        'start': date(2020, 1, 1),
+        'end': date(2020, 1, days),
+        'max_connections': workers}}
+    with tempfile.TemporaryDirectory() as data_path:
+        t0 = perf_counter()
+        scheduler = DownloadScheduler(max_workers=workers)
+        download_source('Stand-in', source_dict, data_path, None, None,
+                        scheduler=scheduler)
+        failed = scheduler.close()
+        seconds = perf_counter() - t0
+    return seconds, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[2])
+    parser.add_argument('--files', type=int, default=31)
+    parser.add_argument('--latency', type=float, default=0.1,
+                        help='seconds per request')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    with standin_server(latency=args.latency) as server:
+        print('{} files, {:.0f} ms per request'.format(
+            args.files, args.latency * 1000))
+        print('workers | seconds | speedup')
+        base = None
+        for workers in args.workers:
+            seconds, failed = run(server.url, workers, args.files)
+            base = base or seconds
+            print('{:7} | {:7.2f} | {:6.1f}x{}'.format(
+                workers, seconds, base / seconds,
+                '' if not failed else ' ({} failed)'.format(failed)))
+
+
+if __name__ == '__main__':
+    main()
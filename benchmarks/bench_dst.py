@@ -0,0 +1,85 @@
+'''
+Open Power System Data
+
+Time series Datapackage
+
+bench_dst.py : time of correcting the DST positions of multi-year synthetic
+TenneT and Elexon files, row by row as read_tennet() and read_GB() used to
+and with shift_dst_positions()
+
+Run from the repository root with ``python -m benchmarks.bench_dst``.
+
+'''
+
+import argparse
+from time import perf_counter
+
+import pandas as pd
+
+from timeseries_scripts.read import shift_dst_positions
+
+# per_hour, spring_from, autumn_from and timezone of the files of each source
+FILES = {'TenneT': (4, 9, 13, 'Europe/Berlin'),
+         'Elexon': (2, 3, 5, 'Europe/London')}
+
+
+def shift_row_by_row(df, per_hour, spring_from, autumn_from):
+    '''How read_tennet() and read_GB() corrected the positions before.'''
+    day = 24 * per_hour
+    for i, row in df.iterrows():
+        if row['pos'] > day + per_hour:
+            continue
+        elif (row['pos'] == day - per_hour and (
+                (i == len(df.index) - 1) or (df['pos'][i + 1] == 1))):
+            slicer = df[(df['date'] == row['date']) &
+                        (df['pos'] >= spring_from)].index
+            df.loc[slicer, 'pos'] = df['pos'] + per_hour
+        elif row['pos'] == day + per_hour:
+            slicer = df[(df['date'] == row['date']) &
+                        (df['pos'] >= autumn_from)].index
+            df.loc[slicer, 'pos'] = df['pos'] - per_hour
+
+
+def synthetic_file(years, per_hour, timezone):
+    '''
+    Return the date and position columns of a file covering years from
+    2015 on, with 23 and 25 hours on the days summertime begins and ends.
+
+    '''
+    days = pd.date_range('2015-01-01', periods=365 * years + 1, freq='D')
+    midnight = days.tz_localize(timezone)
+    hours = ((midnight[1:] - midnight[:-1]) / pd.Timedelta('1H')).astype(int)
+    return pd.DataFrame(
+        [(day, pos) for day, n in zip(days.strftime('%d.%m.%Y'), hours)
+         for pos in range(1, n * per_hour + 1)],
+        columns=['date', 'pos'])
+
+
+def timed(shift, df, *args):
+    df = df.copy()
+    t0 = perf_counter()
+    shift(df, *args)
+    return perf_counter() - t0, df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[2])
+    parser.add_argument('--years', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    print('source |  years |    rows | row by row | vectorized | speedup')
+    for source_name, (per_hour, spring_from, autumn_from,
+                      timezone) in FILES.items():
+        for years in args.years:
+            df = synthetic_file(years, per_hour, timezone)
+            params = (per_hour, spring_from, autumn_from)
+            loop, expected = timed(shift_row_by_row, df, *params)
+            vectorized, result = timed(shift_dst_positions, df, *params)
+            assert result.equals(expected)
+            print('{:6} | {:6} | {:7} | {:8.2f} s | {:8.3f} s | {:6.0f}x'
+                  .format(source_name, years, len(df), loop, vectorized,
+                          loop / vectorized))
+
+
+if __name__ == '__main__':
+    main()
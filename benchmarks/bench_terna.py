@@ -0,0 +1,98 @@
+'''
+Open Power System Data
+
+Time series Datapackage
+
+bench_terna.py : wall-clock time of fetching the daily Terna files listed in
+recorded_terna_urls.csv from a local stand-in server, one after another as
+download_Terna() used to and with fetch_terna_files()
+
+Run from the repository root with ``python -m benchmarks.bench_terna``.
+
+The Selenium link harvester is not part of the comparison, as it needs a
+browser and the real Terna page. Both runs start from the recorded links.
+
+'''
+
+import argparse
+import os
+import tempfile
+from datetime import date
+from time import perf_counter
+from urllib.parse import urlparse
+
+import requests
+
+from timeseries_scripts import terna
+from timeseries_scripts.download import download_file, fetch_terna_files
+
+from .standin import standin_server
+
+INPUT_PATH = os.path.join(os.path.dirname(__file__), os.pardir, 'input')
+
+
+def recorded_urls(url, files):
+    '''
+    Return the first files recorded links, pointed to the stand-in server at
+    url, as a dict {(year, month, day): url}.
+
+    '''
+    recorded, _, _ = terna.read_recorded(
+        os.path.join(INPUT_PATH, 'recorded_terna_urls.csv'),
+        date(2010, 1, 1), date.today())
+    return {k: url + urlparse(v).path
+            for k, v in sorted(recorded.items())[:files]}
+
+
+def serial(date_url_dictionary, param_dict, data_path):
+    '''Download the files one by one, as download_Terna() used to.'''
+    session = requests.session()
+    failed = 0
+    for (year, month, day), url in date_url_dictionary.items():
+        the_date = date(year, month, day)
+        downloaded, session = download_file(
+            'Terna', 'generation_by_source', data_path, param_dict,
+            the_date, the_date, url=url,
+            filename=param_dict['filename'], session=session)
+        failed += not downloaded
+    return failed
+
+
+def parallel(date_url_dictionary, param_dict, data_path):
+    '''Download the files with fetch_terna_files().'''
+    return len(fetch_terna_files('generation_by_source', data_path,
+                                 param_dict, date_url_dictionary,
+                                 param_dict['filename']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[2])
+    parser.add_argument('--files', type=int, default=300,
+                        help='number of recorded links to fetch')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds per request')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='max_connections of fetch_terna_files()')
+    args = parser.parse_args()
+
+    param_dict = {'filename': '{u_start}_terna.xls',
+                  'max_connections': args.workers}
+    with standin_server(latency=args.latency) as server:
+        urls = recorded_urls(server.url, args.files)
+        print('{} files, {:.0f} ms per request'.format(
+            len(urls), args.latency * 1000))
+        print('method   | seconds | speedup')
+        base = None
+        for name, fetch in [('serial', serial), ('parallel', parallel)]:
+            with tempfile.TemporaryDirectory() as data_path:
+                t0 = perf_counter()
+                failed = fetch(urls, param_dict, data_path)
+                seconds = perf_counter() - t0
+            base = base or seconds
+            print('{:8} | {:7.2f} | {:6.1f}x{}'.format(
+                name, seconds, base / seconds,
+                '' if not failed else ' ({} failed)'.format(failed)))
+
+
+if __name__ == '__main__':
+    main()
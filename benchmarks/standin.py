@@ -0,0 +1,75 @@
+'''
+Open Power System Data
+
+Time series Datapackage
+
+standin.py : local HTTP server standing in for the servers of the sources
+in benchmarks
+
+'''
+
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    '''
+    Answer every GET with a file named after the last part of the path,
+    after waiting for the server's latency as a remote server would.
+
+    '''
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        body = self.server.body
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Content-Disposition', 'attachment; filename={}'
+                         .format(self.path.rsplit('/', 1)[-1] or 'file'))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.requests += 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def standin_server(latency=0.05, size=20000):
+    '''
+    Run a stand-in server on localhost while in the context.
+
+    Parameters
+    ----------
+    latency : float, default 0.05
+        Seconds the server waits before answering a request
+    size : int, default 20000
+        Bytes in each file served
+
+    Returns
+    ----------
+    server : http.server.ThreadingHTTPServer
+        With ``url``, the address of the server, and ``requests``, the
+        number of files served so far
+
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandinHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.body = b'x' * size
+    server.requests = 0
+    server.lock = threading.Lock()
+    server.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
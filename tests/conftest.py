@@ -0,0 +1,196 @@
+import os
+import socket
+import threading
+import time
+
+import paramiko
+import pytest
+import yaml
+
+
+class StandinServer(paramiko.ServerInterface):
+    '''Accepts any password.'''
+
+    def __init__(self, standin):
+        self.standin = standin
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+
+class StandinHandle(paramiko.SFTPHandle):
+
+    def __init__(self, standin, f, flags=0):
+        super().__init__(flags)
+        self.standin = standin
+        self.readfile = f
+
+    def read(self, offset, length):
+        time.sleep(self.standin.latency)
+        return super().read(offset, length)
+
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(
+            os.fstat(self.readfile.fileno()))
+
+    def close(self):
+        super().close()
+        with self.standin.lock:
+            self.standin.transfers -= 1
+
+
+class StandinSFTP(paramiko.SFTPServerInterface):
+    '''Serves the files of the stand-in's root directory, read only.'''
+
+    def __init__(self, server, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.standin = server.standin
+
+    def _local(self, path):
+        return os.path.join(self.standin.root, path.lstrip('/'))
+
+    def list_folder(self, path):
+        self.standin.count('listings')
+        local = self._local(path)
+        try:
+            return [paramiko.SFTPAttributes.from_stat(
+                os.stat(os.path.join(local, name)), name)
+                for name in os.listdir(local)]
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(
+                os.stat(self._local(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        try:
+            f = open(self._local(path), 'rb')
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        self.standin.count('opened')
+        with self.standin.lock:
+            self.standin.transfers += 1
+            self.standin.most_transfers = max(self.standin.most_transfers,
+                                              self.standin.transfers)
+        return StandinHandle(self.standin, f, flags)
+
+
+class SFTPStandin():
+    '''
+    SFTP server on localhost serving the files in root, counting
+    connections, directory listings and files opened.
+
+    '''
+
+    host_key = None
+
+    def __init__(self, root, latency=0.0):
+        self.root = root
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.listings = 0
+        self.opened = 0
+        self.transfers = 0
+        self.most_transfers = 0
+        self._transports = []
+        if SFTPStandin.host_key is None:
+            SFTPStandin.host_key = paramiko.RSAKey.generate(2048)
+        self._socket = socket.socket()
+        self._socket.bind(('127.0.0.1', 0))
+        self._socket.listen(16)
+        self.host, self.port = self._socket.getsockname()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._socket.accept()
+            except OSError:
+                return
+            self.count('connections')
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer,
+                                            StandinSFTP)
+            transport.start_server(server=StandinServer(self))
+            self._transports.append(transport)
+
+    def close(self):
+        self._socket.close()
+        for transport in self._transports:
+            transport.close()
+
+
+@pytest.fixture
+def sftp_standin(tmp_path):
+    '''SFTP stand-in serving tmp_path/remote.'''
+    root = tmp_path / 'remote'
+    root.mkdir()
+    standin = SFTPStandin(str(root))
+    yield standin
+    standin.close()
+
+
+HEADERS = ['region', 'variable', 'attribute', 'source', 'web', 'unit']
+
+
+def write_ceps(data_path, dataset_name, months, scale=1):
+    '''
+    Write one file per month of 2020 in the format of the CEPS wind_pv
+    dataset, with two days of hourly data each.
+
+    '''
+    for month in months:
+        container = os.path.join(
+            data_path, 'CEPS', dataset_name,
+            '2020-{0:02d}-01_2020-{0:02d}-28'.format(month))
+        os.makedirs(container, exist_ok=True)
+        lines = ['Generation RES', 'CEPS', 'Date;WPP [MW];PVPP [MW]']
+        for hour in range(48):
+            lines.append('{:02d}.{:02d}.2020 {:02d}:00;{};{}'.format(
+                1 + hour // 24, month, hour % 24,
+                scale * (hour + 1), scale * (month * 100 + hour)))
+        with open(os.path.join(container, 'data.csv'), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+@pytest.fixture
+def ceps_dataset(tmp_path):
+    '''
+    Return keyword arguments of read_dataset() for CEPS files written to
+    tmp_path/original_data by write_ceps(), for dataset wind_pv unless
+    another is given.
+
+    '''
+    with open(os.path.join(os.path.dirname(__file__), os.pardir, 'input',
+                           'sources.yml'), encoding='UTF-8') as f:
+        param_dict = yaml.full_load(f.read())['CEPS']['wind_pv']
+    data_path = str(tmp_path / 'original_data')
+    parsed_path = str(tmp_path / 'parsed')
+    os.makedirs(parsed_path)
+
+    def dataset(dataset_name='wind_pv', months=(1, 2), scale=1):
+        write_ceps(data_path, dataset_name, months, scale)
+        return {'source_name': 'CEPS', 'dataset_name': dataset_name,
+                'param_dict': param_dict, 'data_path': data_path,
+                'parsed_path': parsed_path, 'areas': None,
+                'headers': HEADERS}
+    return dataset
@@ -0,0 +1,111 @@
+import io
+import os
+import threading
+import zipfile
+from datetime import datetime
+
+from timeseries_scripts.archive import RemoteFile, extract_archive
+from timeseries_scripts.manifest import DownloadManifest
+
+URL = 'https://example.org/original_data.zip'
+
+
+def archive_body(months=range(1, 13)):
+    members = {
+        'original_data/Source/dataset/2020-{0:02d}-01_2020-{0:02d}-28/'
+        'data.csv'.format(month): os.urandom(1000) * month
+        for month in months}
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as z:
+        for i, (name, body) in enumerate(sorted(members.items())):
+            info = zipfile.ZipInfo(name, date_time=(2020, 3, 1, 12, 0, 0))
+            z.writestr(info, body, compress_type=(
+                zipfile.ZIP_DEFLATED if i % 2 else zipfile.ZIP_STORED))
+    return buffer.getvalue(), members
+
+
+class Response():
+
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.url = URL
+
+
+class Session():
+    '''Answers range requests on body and records them with their timeouts.'''
+
+    def __init__(self, body):
+        self.body = body
+        self.ranges = []
+        self.timeouts = []
+        self.lock = threading.Lock()
+
+    def head(self, url, allow_redirects=False, timeout=None):
+        self.timeouts.append(timeout)
+        return Response(200, headers={'accept-ranges': 'bytes',
+                                      'content-length': str(len(self.body))})
+
+    def get(self, url, headers=None, timeout=None):
+        start, end = map(int, headers['Range'][6:].split('-'))
+        with self.lock:
+            self.timeouts.append(timeout)
+            self.ranges.append((start, end))
+        return Response(206, self.body[start:end + 1])
+
+
+def remote_archive(session):
+    '''Return archive() as download_archive() builds it for a server.'''
+    directory = []
+
+    def archive():
+        raw = RemoteFile(URL, len(session.body), session, chunks=directory,
+                         keep=not directory)
+        return io.BufferedReader(raw, buffer_size=1 << 12)
+    return archive
+
+
+def test_central_directory_is_fetched_once(tmp_path):
+    body, members = archive_body()
+    start_dir = zipfile.ZipFile(io.BytesIO(body)).start_dir
+    session = Session(body)
+    data_path = str(tmp_path / 'original_data')
+    count = extract_archive(remote_archive(session), data_path,
+                            max_workers=4)
+
+    assert count == 12
+    for name, body in members.items():
+        with open(os.path.join(data_path, *name.split('/')[1:]), 'rb') as f:
+            assert f.read() == body
+    directory = [r for r in session.ranges if r[1] >= start_dir]
+    assert directory and len(directory) == len(set(directory))
+
+
+def test_extracted_files_are_dated_by_the_archive(tmp_path):
+    body, members = archive_body([1, 2])
+    path = str(tmp_path / 'original_data.zip')
+    with open(path, 'wb') as f:
+        f.write(body)
+    data_path = str(tmp_path / 'original_data')
+    manifest = DownloadManifest(os.path.join(data_path, 'manifest.sqlite'))
+    container = os.path.join(data_path, 'Source', 'dataset',
+                             '2020-01-01_2020-01-28')
+
+    extract_archive(lambda: open(path, 'rb'), data_path, manifest=manifest)
+    assert manifest.downloaded(container) == datetime(2020, 3, 1, 12)
+
+    os.remove(os.path.join(container, 'data.csv'))
+    extract_archive(lambda: open(path, 'rb'), data_path, manifest=manifest,
+                    archived=datetime(2020, 4, 2))
+    assert manifest.downloaded(container) == datetime(2020, 4, 2)
+    manifest.close()
+
+
+def test_remote_file_requests_time_out():
+    session = Session(b'0123456789' * 10)
+    remote = RemoteFile.open(URL, session=session, timeout=30)
+    fp = io.BufferedReader(remote, buffer_size=16)
+    fp.seek(95)
+    assert fp.read() == session.body[95:]
+    assert session.timeouts and set(session.timeouts) == {30}
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from timeseries_scripts import download as dl
+from timeseries_scripts.sessions import LoginSession
+
+aiohttp = pytest.importorskip('aiohttp')
+web = pytest.importorskip('aiohttp.web')
+async_download = pytest.importorskip('timeseries_scripts.async_download')
+download_request_async = async_download.download_request_async
+
+BODY = b'0123456789' * 20
+
+
+def jar(value):
+    cookies = requests.cookies.RequestsCookieJar()
+    cookies.set('session', value)
+    return cookies
+
+
+async def fetch(container, login):
+    # Sends the login page unless the cookies of the second login come with
+    # the request
+    async def handle(request):
+        if request.cookies.get('session') != 'fresh':
+            return web.Response(text='<html>login</html>',
+                                content_type='text/html')
+        return web.Response(body=BODY, headers={
+            'Content-Disposition': 'attachment; filename=data.csv'})
+
+    app = web.Application()
+    app.router.add_get('/file', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        async with aiohttp.ClientSession() as session:
+            downloaded, _ = await download_request_async(
+                'Elexon', datetime(2020, 1, 1), datetime(2020, 1, 31),
+                session, None, container,
+                'http://127.0.0.1:{}/file'.format(port), cookies=login)
+    finally:
+        await runner.cleanup()
+    return downloaded
+
+
+def test_rejected_cookies_are_renewed(tmp_path):
+    container = str(tmp_path / '2020-01-01_2020-01-31')
+    logins = iter([jar('stale'), jar('fresh')])
+    login = LoginSession('Elexon', lambda: next(logins))
+
+    assert asyncio.run(fetch(container, login))
+    assert os.listdir(container) == ['data.csv']
+    with open(os.path.join(container, 'data.csv'), 'rb') as f:
+        assert f.read() == BODY
+    assert login.cookies()['session'] == 'fresh'
+
+
+async def resume(container, handle):
+    app = web.Application()
+    app.router.add_get('/file', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        async with aiohttp.ClientSession() as session:
+            downloaded, _ = await download_request_async(
+                'Elexon', datetime(2020, 1, 1), datetime(2020, 1, 31),
+                session, None, container,
+                'http://127.0.0.1:{}/file'.format(port))
+    finally:
+        await runner.cleanup()
+    return downloaded
+
+
+def test_resume_from_partial_file(tmp_path):
+    container = str(tmp_path / '2020-01-01_2020-01-31')
+    os.makedirs(container)
+    part = os.path.join(container, 'data.csv' + dl.PARTIAL_SUFFIX)
+    with open(part, 'wb') as f:
+        f.write(BODY[:50])
+    with open(os.path.join(container, 'data.csv' + dl.VALIDATORS_SUFFIX),
+              'w') as f:
+        json.dump({'etag': '"v1"'}, f)
+    ranges = []
+
+    async def handle(request):
+        ranges.append((request.headers.get('Range'),
+                       request.headers.get('If-Range')))
+        return web.Response(status=206, body=BODY[50:], headers={
+            'Content-Range': 'bytes 50-{}/{}'.format(len(BODY) - 1,
+                                                     len(BODY)),
+            'ETag': '"v1"',
+            'Content-Disposition': 'attachment; filename=data.csv'})
+
+    assert asyncio.run(resume(container, handle))
+    assert ranges == [('bytes=50-', '"v1"')]
+    assert os.listdir(container) == ['data.csv']
+    with open(os.path.join(container, 'data.csv'), 'rb') as f:
+        assert f.read() == BODY
+
+
+class Handler(BaseHTTPRequestHandler):
+    '''
+    Serves /file/<day> slowly, keeping track of the requests in flight at
+    the same time.
+
+    '''
+
+    protocol_version = 'HTTP/1.1'
+    lock = threading.Lock()
+    in_flight = 0
+    most = 0
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.most = max(cls.most, cls.in_flight)
+        time.sleep(0.2)
+        with cls.lock:
+            cls.in_flight -= 1
+        body = self.path.encode() * 10
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Content-Disposition',
+                         'attachment; filename=data.csv')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    handler = type('Handler', (Handler,), {})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def download_days(server, data_path, days, **kwargs):
+    scheduler = async_download.AsyncScheduler(**kwargs)
+    url = 'http://127.0.0.1:{}/file/{{u_start:%Y%m%d}}'.format(
+        server.server_address[1])
+    for day in days:
+        start = datetime(2020, 1, day)
+        scheduler.submit(dl.download_file, 'Elexon', 'wind', data_path,
+                         {'retry': {'attempts': 1}}, start, start, url,
+                         host='127.0.0.1')
+    return scheduler.close()
+
+
+def test_concurrent_downloads(tmp_path, server):
+    data_path = str(tmp_path)
+    t0 = time.perf_counter()
+    assert download_days(server, data_path, range(1, 9),
+                         default_host_limit=8) == 0
+
+    # Eight requests of 0.2 s each overlap
+    assert time.perf_counter() - t0 < 1.2
+    assert server.RequestHandlerClass.most > 1
+    for day in range(1, 9):
+        container = os.path.join(data_path, 'Elexon', 'wind',
+                                 '2020-01-{0:02d}_2020-01-{0:02d}'.format(day))
+        assert os.listdir(container) == ['data.csv']
+        with open(os.path.join(container, 'data.csv'), 'rb') as f:
+            assert f.read() == '/file/202001{:02d}'.format(day).encode() * 10
+
+
+def test_per_host_limit(tmp_path, server):
+    assert download_days(server, str(tmp_path), range(1, 9),
+                         default_host_limit=2) == 0
+    assert server.RequestHandlerClass.most == 2
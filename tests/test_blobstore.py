@@ -0,0 +1,124 @@
+import os
+
+import pytest
+
+from timeseries_scripts import blobstore
+from timeseries_scripts.blobstore import BlobStore, link_or_copy
+from timeseries_scripts.make_json import get_sha_hash
+
+BODY = b'0123456789' * 20
+
+
+def download(data_path, period, body=BODY):
+    container = os.path.join(data_path, 'Elia', 'wind', period)
+    os.makedirs(container)
+    filepath = os.path.join(container, 'data.xls')
+    with open(filepath, 'wb') as f:
+        f.write(body)
+    return filepath
+
+
+def blobs(store):
+    return [name for d in os.listdir(os.path.join(store.root, 'blobs'))
+            for name in os.listdir(os.path.join(store.root, 'blobs', d))]
+
+
+def test_add_and_checkout(tmp_path):
+    store = BlobStore(str(tmp_path / 'raw_store'))
+    filepath = download(str(tmp_path / 'v1'), '2020-01-01_2020-12-31')
+    sha256 = get_sha_hash(filepath)
+    store.add(filepath, sha256, etag='"v1"')
+
+    # The downloaded file stays where it is, linked to the blob
+    with open(filepath, 'rb') as f:
+        assert f.read() == BODY
+    assert os.path.samefile(filepath, store.blob_path(sha256))
+    assert blobs(store) == [sha256]
+
+    container = str(tmp_path / 'v2' / 'Elia' / 'wind' /
+                    '2020-01-01_2020-12-31')
+    assert store.checkout(container) == ('data.xls', sha256,
+                                         {'etag': '"v1"'})
+    assert os.path.samefile(os.path.join(container, 'data.xls'), filepath)
+    assert store.checkout(container.replace('2020', '2021')) is None
+    store.close()
+
+
+def test_identical_files_are_stored_once(tmp_path):
+    store = BlobStore(str(tmp_path / 'raw_store'))
+    first = download(str(tmp_path / 'v1'), '2020-01-01_2020-12-31')
+    second = download(str(tmp_path / 'v2'), '2020-01-01_2020-12-31')
+    sha256 = get_sha_hash(first)
+    store.add(first, sha256)
+    store.add(second, sha256)
+
+    assert blobs(store) == [sha256]
+    assert os.path.samefile(first, second)
+    with open(second, 'rb') as f:
+        assert f.read() == BODY
+    store.close()
+
+
+@pytest.fixture
+def no_links(monkeypatch):
+    '''Fail hardlinks and reflinks, as across filesystems without them.'''
+    import fcntl
+
+    def fail(*args):
+        raise OSError('Invalid cross-device link')
+
+    monkeypatch.setattr(os, 'link', fail)
+    monkeypatch.setattr(fcntl, 'ioctl', fail)
+
+
+def test_copy_fallback(tmp_path, no_links):
+    src = str(tmp_path / 'src')
+    dst = str(tmp_path / 'dst')
+    with open(src, 'wb') as f:
+        f.write(BODY)
+    with open(dst, 'wb') as f:
+        f.write(b'old')
+
+    assert link_or_copy(src, dst) == 'copy'
+    assert not os.path.samefile(src, dst)
+    with open(dst, 'rb') as f:
+        assert f.read() == BODY
+
+
+def test_add_without_links(tmp_path, no_links):
+    store = BlobStore(str(tmp_path / 'raw_store'))
+    filepath = download(str(tmp_path / 'v1'), '2020-01-01_2020-12-31')
+    sha256 = get_sha_hash(filepath)
+    store.add(filepath, sha256)
+
+    with open(filepath, 'rb') as f:
+        assert f.read() == BODY
+    with open(store.blob_path(sha256), 'rb') as f:
+        assert f.read() == BODY
+    assert not os.path.exists(
+        store.blob_path(sha256) + blobstore.PARTIAL_SUFFIX)
+    store.close()
+
+
+def test_reflink_when_hardlinks_fail(tmp_path, monkeypatch):
+    import fcntl
+    clones = []
+
+    def fail(*args):
+        raise OSError('Invalid cross-device link')
+
+    def ioctl(dst, request, src):
+        # Stands in for the filesystem cloning the file
+        clones.append(request)
+        os.write(dst, os.pread(src, len(BODY), 0))
+
+    monkeypatch.setattr(os, 'link', fail)
+    monkeypatch.setattr(fcntl, 'ioctl', ioctl)
+    src = str(tmp_path / 'src')
+    with open(src, 'wb') as f:
+        f.write(BODY)
+
+    assert link_or_copy(src, str(tmp_path / 'dst')) == 'reflink'
+    assert clones == [blobstore.FICLONE]
+    with open(str(tmp_path / 'dst'), 'rb') as f:
+        assert f.read() == BODY
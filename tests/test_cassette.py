@@ -0,0 +1,142 @@
+import json
+import os
+import socket
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from timeseries_scripts.cassette import Cassette
+from timeseries_scripts.download import (PARTIAL_SUFFIX, VALIDATORS_SUFFIX,
+                                         download_file)
+from timeseries_scripts.manifest import DownloadManifest
+from timeseries_scripts.sftp_sync import SFTPPool
+
+BODY = b'0123456789' * 100
+ETAG = '"v1"'
+START, END = datetime(2020, 1, 1), datetime(2020, 1, 31)
+
+
+class Handler(BaseHTTPRequestHandler):
+    '''Serves BODY as data.csv, answering conditional and range requests.'''
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests += 1
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        offset = 0
+        if self.headers.get('Range'):
+            offset = int(self.headers['Range'][6:-1])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                offset, len(BODY) - 1, len(BODY)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(BODY) - offset))
+        self.send_header('Content-Disposition',
+                         'attachment; filename=data.csv')
+        self.send_header('ETag', ETAG)
+        self.end_headers()
+        self.wfile.write(BODY[offset:])
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def http_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.requests = 0
+    server.url = 'http://127.0.0.1:{}/file'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def fetch_http(data_path, cassette, url, manifest=None, refresh=False):
+    return download_file(
+        'Example', 'load', data_path, {}, START, END, url,
+        session=cassette.session(), manifest=manifest, refresh=refresh)[0]
+
+
+def fetch_sftp(data_path, cassette, sftp):
+    param_dict = {'path': 'export/'}
+    return download_file(
+        'ENTSO-E Transparency FTP', 'generation', data_path, param_dict,
+        START, END, None, filename='{u_start.year}_{u_start.month}.csv',
+        sftp=sftp)[0]
+
+
+def read(data_path, source_name, dataset_name, filename):
+    with open(os.path.join(data_path, source_name, dataset_name,
+                           '2020-01-01_2020-01-31', filename), 'rb') as f:
+        return f.read()
+
+
+def test_record_and_replay(tmp_path, http_server, sftp_standin, monkeypatch):
+    os.makedirs(os.path.join(sftp_standin.root, 'export'))
+    with open(os.path.join(sftp_standin.root, 'export', '2020_1.csv'),
+              'wb') as f:
+        f.write(BODY)
+    path = str(tmp_path / 'cassette')
+
+    recorder = Cassette(path, 'record')
+    pool = SFTPPool(sftp_standin.host, sftp_standin.port, 'user',
+                    'password')
+    sftp = recorder.sftp(sftp_standin.host, pool)
+    assert fetch_http(str(tmp_path / 'recorded'), recorder, http_server.url)
+    assert fetch_sftp(str(tmp_path / 'recorded'), recorder, sftp)
+    sftp.close()
+    assert http_server.requests == 1
+    assert sftp_standin.opened == 1
+
+    def no_network(*args, **kwargs):
+        raise AssertionError('network access during replay')
+
+    monkeypatch.setattr(socket.socket, 'connect', no_network)
+    monkeypatch.setattr(socket, 'create_connection', no_network)
+    player = Cassette(path, 'replay')
+    data_path = str(tmp_path / 'replayed')
+    manifest = DownloadManifest(os.path.join(data_path, 'manifest.sqlite'))
+    assert fetch_http(data_path, player, http_server.url, manifest)
+    assert fetch_sftp(data_path, player, player.sftp(sftp_standin.host))
+    assert read(data_path, 'Example', 'load', 'data.csv') == BODY
+    assert read(data_path, 'ENTSO-E Transparency FTP', 'generation',
+                '2020_1.csv') == BODY
+
+    # Conditional request for the file downloaded before
+    container = os.path.join(data_path, 'Example', 'load',
+                             '2020-01-01_2020-01-31')
+    before = os.stat(os.path.join(container, 'data.csv')).st_mtime_ns
+    assert fetch_http(data_path, player, http_server.url, manifest,
+                      refresh=True)
+    assert os.stat(os.path.join(container, 'data.csv')).st_mtime_ns == before
+    assert manifest.get(container)['etag'] == ETAG
+    manifest.close()
+
+    # Range request continuing an interrupted download
+    data_path = str(tmp_path / 'resumed')
+    container = os.path.join(data_path, 'Example', 'load',
+                             '2020-01-01_2020-01-31')
+    os.makedirs(container)
+    with open(os.path.join(container, 'data.csv' + PARTIAL_SUFFIX),
+              'wb') as f:
+        f.write(b'-' * 300)
+    with open(os.path.join(container, 'data.csv' + VALIDATORS_SUFFIX),
+              'w') as f:
+        json.dump({'etag': ETAG}, f)
+    assert fetch_http(data_path, player, http_server.url)
+    assert read(data_path, 'Example', 'load', 'data.csv') == \
+        b'-' * 300 + BODY[300:]
+
+    assert http_server.requests == 1
+    assert sftp_standin.connections == 1
+    assert sftp_standin.opened == 1
@@ -0,0 +1,343 @@
+import errno
+import json
+import os
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from timeseries_scripts import download as dl
+from timeseries_scripts.download import (PARTIAL_SUFFIX, VALIDATORS_SUFFIX,
+                                         download_file, download_request,
+                                         download_sftp, submit_jobs)
+from timeseries_scripts.planner import DownloadJob
+from timeseries_scripts.metrics import DownloadMetrics
+from timeseries_scripts.retry import RetryLater, RetryPolicy
+from timeseries_scripts.sessions import LoginSession
+
+BODY = b'0123456789' * 20
+
+
+class Response():
+
+    def __init__(self, status_code, body, headers):
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.url = 'https://example.org/file'
+        self._body = body
+
+    def iter_content(self, chunk_size=1):
+        yield self._body
+
+    def close(self):
+        pass
+
+
+class Server():
+    '''
+    Answers range requests for a file now named data.csv, in the version
+    etag. With ignore_if_range, ranges are sent even if the version asked
+    for is another one.
+
+    '''
+
+    def __init__(self, encoding=None, status=None, etag='"v1"',
+                 ignore_if_range=False):
+        self.encoding = encoding
+        self.status = status
+        self.etag = etag
+        self.ignore_if_range = ignore_if_range
+        self.requests = []
+
+    def get(self, url, params=None, headers=None, **kwargs):
+        headers = headers or {}
+        self.requests.append(headers)
+        if self.status is not None:
+            return Response(self.status, b'', {})
+        name = {'content-disposition': 'attachment; filename=data.csv',
+                'etag': self.etag}
+        if 'Range' in headers and (self.ignore_if_range or
+                                   headers.get('If-Range') == self.etag):
+            offset = int(headers['Range'][6:-1])
+            extra = {'content-encoding': self.encoding} if self.encoding \
+                else {}
+            return Response(206, BODY[offset:], dict(
+                name, **extra, **{
+                    'content-range': 'bytes {}-{}/{}'.format(
+                        offset, len(BODY) - 1, len(BODY))}))
+        return Response(200, BODY, dict(
+            name, **{'content-length': str(len(BODY))}))
+
+
+def fetch(container, server):
+    return download_request(
+        'Example', datetime(2020, 1, 1), datetime(2020, 12, 31), server,
+        None, container, 'https://example.org/file')
+
+
+def partial(container, name, size=50, validators={'etag': '"v1"'}):
+    os.makedirs(container)
+    with open(os.path.join(container, name + PARTIAL_SUFFIX), 'wb') as f:
+        f.write(BODY[:size])
+    if validators is not None:
+        with open(os.path.join(container, name + VALIDATORS_SUFFIX),
+                  'w') as f:
+            json.dump(validators, f)
+
+
+def test_resume(tmp_path):
+    container = str(tmp_path / '2020-01-01_2020-12-31')
+    partial(container, 'data.csv')
+    server = Server()
+    assert fetch(container, server)[0]
+    assert server.requests == [{'Range': 'bytes=50-', 'If-Range': '"v1"',
+                                'Accept-Encoding': 'identity'}]
+    assert os.listdir(container) == ['data.csv']
+    with open(os.path.join(container, 'data.csv'), 'rb') as f:
+        assert f.read() == BODY
+
+
+def test_changed_file_is_not_resumed(tmp_path):
+    container = str(tmp_path / '2020-01-01_2020-12-31')
+    partial(container, 'data.csv', validators={'etag': '"v0"'})
+    server = Server()
+    assert fetch(container, server)[0]
+    # The server sends the whole file as it is not the version asked for
+    assert len(server.requests) == 1
+    assert os.listdir(container) == ['data.csv']
+    with open(os.path.join(container, 'data.csv'), 'rb') as f:
+        assert f.read() == BODY
+
+
+def test_range_of_changed_file_is_not_appended(tmp_path):
+    container = str(tmp_path / '2020-01-01_2020-12-31')
+    partial(container, 'data.csv', validators={'etag': '"v0"'})
+    server = Server(ignore_if_range=True)
+    assert fetch(container, server)[0]
+    assert [('Range' in h) for h in server.requests] == [True, False]
+    with open(os.path.join(container, 'data.csv'), 'rb') as f:
+        assert f.read() == BODY
+
+
+def test_partial_without_validators_is_not_resumed(tmp_path):
+    container = str(tmp_path / '2020-01-01_2020-12-31')
+    partial(container, 'data.csv', validators=None)
+    server = Server()
+    assert fetch(container, server)[0]
+    assert server.requests == [{}]
+    with open(os.path.join(container, 'data.csv'), 'rb') as f:
+        assert f.read() == BODY
+
+
+def test_range_for_renamed_file_is_not_saved(tmp_path):
+    container = str(tmp_path / '2020-01-01_2020-12-31')
+    partial(container, 'old_name.csv')
+    server = Server()
+    assert fetch(container, server)[0]
+    # The range is discarded and the whole file requested again
+    assert len(server.requests) == 2
+    assert 'Range' not in (server.requests[1] or {})
+    assert os.listdir(container) == ['data.csv']
+    with open(os.path.join(container, 'data.csv'), 'rb') as f:
+        assert f.read() == BODY
+
+
+def test_compressed_range_is_not_appended(tmp_path):
+    container = str(tmp_path / '2020-01-01_2020-12-31')
+    partial(container, 'data.csv')
+    server = Server(encoding='gzip')
+    assert fetch(container, server)[0]
+    assert [('Range' in (h or {})) for h in server.requests] == [True, False]
+    with open(os.path.join(container, 'data.csv'), 'rb') as f:
+        assert f.read() == BODY
+
+
+class LoginServer(Server):
+    '''Sends its login page unless the cookies of a fresh login come along.'''
+
+    def get(self, url, params=None, headers=None, cookies=None, **kwargs):
+        if cookies['session'] != 'fresh':
+            return Response(200, b'<html>login</html>',
+                            {'content-type': 'text/html'})
+        return super().get(url, params=params, headers=headers, **kwargs)
+
+
+def jar(value):
+    cookies = requests.cookies.RequestsCookieJar()
+    cookies.set('session', value)
+    return cookies
+
+
+@pytest.mark.parametrize('second, downloaded', [('fresh', True),
+                                                ('wrong', False)])
+def test_rejected_cookies_are_renewed_once(tmp_path, second, downloaded):
+    container = str(tmp_path / '2020-01-01_2020-12-31')
+    logins = iter([jar('stale'), jar(second), jar('fresh')])
+    login = LoginSession('Example', lambda: next(logins))
+    assert download_request(
+        'Example', datetime(2020, 1, 1), datetime(2020, 12, 31),
+        LoginServer(), None, container, 'https://example.org/file',
+        cookies=login)[0] == downloaded
+    if downloaded:
+        assert os.listdir(container) == ['data.csv']
+    else:
+        # The login page is not saved as the file
+        assert not os.path.exists(container) or not os.listdir(container)
+        # and the next download logs in again
+        assert login.cookies()['session'] == 'fresh'
+
+
+def test_metrics_of_attempt_to_retry(tmp_path):
+    metrics = DownloadMetrics()
+    param_dict = {'retry': {'attempts': 4}}
+    args = ('Example', 'Dataset', str(tmp_path), param_dict,
+            datetime(2020, 1, 1), datetime(2020, 12, 31),
+            'https://example.org/file')
+    for attempt in [1, 2, 3]:
+        with pytest.raises(RetryLater):
+            download_file(*args, session=Server(status=503), metrics=metrics,
+                          attempt=attempt)
+    assert download_file(*args, session=Server(), metrics=metrics,
+                         attempt=4)[0]
+    assert [f['outcome'] for f in metrics.files] == ['retry'] * 3 + [
+        'downloaded']
+    assert [f['status'] for f in metrics.files] == [503] * 3 + [200]
+    assert metrics.totals()['Example']['files'] == 1
+    assert metrics.totals()['Example']['retries'] == 3
+
+
+def test_metrics_summary_without_files():
+    metrics = DownloadMetrics()
+    transfer = metrics.start('data/Example/Dataset/2020-01-01_2020-12-31',
+                             'example.org')
+    metrics.finish(transfer, False, outcome='retry')
+    metrics.log_summary()
+    assert metrics.totals()['Example']['files'] == 0
+
+
+class RemoteFile():
+
+    def __init__(self, body):
+        self.body = body
+        self.offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def seek(self, offset):
+        self.start = self.offset = offset
+
+    def prefetch(self, size):
+        pass
+
+    def read(self, n):
+        chunk = self.body[self.offset:self.offset + n]
+        self.offset += len(chunk)
+        return chunk
+
+
+class BrokenFile(RemoteFile):
+
+    def read(self, n):
+        raise IOError('Socket is closed')
+
+
+class SFTPClient():
+
+    def __init__(self, body, broken=False):
+        self.body = body
+        self.broken = broken
+        self.opened = []
+
+    def open(self, path, mode):
+        self.opened.append((BrokenFile if self.broken else RemoteFile)(
+            self.body))
+        return self.opened[-1]
+
+    def stat(self, path):
+        raise IOError(errno.ENOENT, 'No such file')
+
+
+def sftp_fetch(container, sftp, mtime):
+    stat = SimpleNamespace(st_size=len(BODY), st_mtime=mtime)
+    return download_sftp(sftp, 'export/', 'data.csv', container, stat=stat)
+
+
+def test_sftp_resume(tmp_path):
+    container = str(tmp_path / '2020-01-01_2020-01-31')
+    partial(container, 'data.csv',
+            validators={'size': len(BODY), 'mtime': 1000})
+    sftp = SFTPClient(BODY)
+    assert sftp_fetch(container, sftp, 1000)
+    assert sftp.opened[0].start == 50
+    assert os.listdir(container) == ['data.csv']
+    with open(os.path.join(container, 'data.csv'), 'rb') as f:
+        assert f.read() == BODY
+
+
+def test_sftp_changed_file_is_not_resumed(tmp_path):
+    container = str(tmp_path / '2020-01-01_2020-01-31')
+    # The partial file came from an older version of the same size
+    partial(container, 'data.csv',
+            validators={'size': len(BODY), 'mtime': 1000})
+    with open(os.path.join(container, 'data.csv' + PARTIAL_SUFFIX),
+              'wb') as f:
+        f.write(b'-' * 50)
+    sftp = SFTPClient(BODY)
+    assert sftp_fetch(container, sftp, 2000)
+    assert sftp.opened[0].start == 0
+    with open(os.path.join(container, 'data.csv'), 'rb') as f:
+        assert f.read() == BODY
+
+
+def test_sftp_errors_are_retried(tmp_path):
+    container = str(tmp_path / '2020-01-01_2020-01-31')
+    stat = SimpleNamespace(st_size=len(BODY), st_mtime=1000)
+    sftp = SFTPClient(BODY, broken=True)
+    policy = RetryPolicy(attempts=2)
+    with pytest.raises(RetryLater):
+        download_sftp(sftp, 'export/', 'data.csv', container, stat=stat,
+                      retry_policy=policy)
+    assert not download_sftp(sftp, 'export/', 'data.csv', container,
+                             stat=stat, retry_policy=policy, attempt=2)
+    # A file missing on the server is not tried again
+    assert not download_sftp(sftp, 'export/', 'data.csv', container,
+                             retry_policy=policy)
+
+
+class Scheduler():
+    '''Runs each job as it is submitted.'''
+
+    def submit(self, func, *args, host=None, host_limit=None, **kwargs):
+        return func(*args, session=None, **kwargs)
+
+    def on_close(self, cleanup):
+        pass
+
+
+def test_submit_jobs_reports_done(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_download_file(source_name, *args, cookies=None, **kwargs):
+        calls.append((source_name, cookies))
+        if source_name == 'Broken':
+            raise ValueError('broken')
+        return True, None
+
+    monkeypatch.setattr(dl, 'download_file', fake_download_file)
+    jobs = [DownloadJob(name, 'dataset', {}, datetime(2020, 1, 1),
+                        datetime(2020, 1, 31), url='https://example.org/f',
+                        container=str(tmp_path / name))
+            for name in ['Elexon', 'Broken']]
+    done = []
+    with pytest.raises(ValueError):
+        submit_jobs(jobs, str(tmp_path), {}, Scheduler(), on_done=done.append)
+    assert done == jobs
+    # Elexon files are still downloaded with the login
+    assert calls[0][1] is not None
+    assert calls[1][1] is None
@@ -0,0 +1,123 @@
+import logging
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+import pytz
+
+from timeseries_scripts.dst import drop_transitions, to_utc, transitions
+from timeseries_scripts.read import check_dst
+
+TIMEZONES = ['Europe/Berlin', 'Europe/London', 'Europe/Paris', 'CET']
+YEARS = [2012, 2020, 2026]
+
+
+# The DST handling the readers had before dst.py, to compare against
+
+def pytz_transitions(timezone, month, hour, minutes=(0,)):
+    return [d.replace(hour=hour, minute=m)
+            for d in pytz.timezone(timezone)._utc_transition_times
+            if 2000 <= d.year <= datetime.today().year and d.month == month
+            for m in minutes]
+
+
+def pytz_to_utc(index, timezone, autumn):
+    if autumn == 'both':
+        index = index.tz_localize(timezone, ambiguous='infer')
+    elif autumn == 'summer':
+        dst_arr = np.ones(len(index), dtype=bool)
+        index = index.tz_localize(timezone, ambiguous=dst_arr)
+    elif autumn == 'winter':
+        dst_arr = np.zeros(len(index), dtype=bool)
+        index = index.tz_localize(timezone, ambiguous=dst_arr)
+    else:
+        index = index.tz_localize(timezone)
+    return index.tz_convert(None)
+
+
+def pytz_check_dst(index, autumn_expect=2, timezone='CET'):
+    messages = []
+    transition_hour = {'CET': 2, 'WET': 1}
+    dst_transitions_spring = pytz_transitions(timezone, 3,
+                                              transition_hour[timezone])
+    dst_transitions_autumn = pytz_transitions(timezone, 10,
+                                              transition_hour[timezone])
+    for d1, d2 in zip(dst_transitions_spring, dst_transitions_autumn):
+        if d1 in index:
+            messages.append('DST hours: spring: {} | {}'.format(
+                d1.year, sum(index == d1)))
+        if d2.replace(hour=0) in index and sum(index == d2) != autumn_expect:
+            messages.append('DST hours: autumn: {} | {}'.format(
+                d2.year, sum(index == d2)))
+    return messages
+
+
+def local_index(timezone, year, freq='15min', autumn='both'):
+    '''
+    Naive local time from March to November, with the hour repeated in
+    October as a file with the given policy has it.
+
+    '''
+    index = pd.date_range('{}-03-01'.format(year), '{}-11-30'.format(year),
+                          freq=freq, tz='UTC')
+    index = index.tz_convert(timezone).tz_localize(None)
+    keep = {'both': False, 'summer': 'first', 'winter': 'last'}
+    if autumn == 'none':
+        return index[~index.duplicated(keep=False)]
+    if autumn == 'both':
+        return index
+    return index[~index.duplicated(keep=keep[autumn])]
+
+
+@pytest.mark.parametrize('timezone', TIMEZONES)
+@pytest.mark.parametrize('year', YEARS)
+@pytest.mark.parametrize('autumn', ['both', 'summer', 'winter', 'none'])
+def test_to_utc_like_pytz(timezone, year, autumn):
+    index = local_index(timezone, year, autumn=autumn)
+    assert to_utc(index, timezone, autumn).equals(
+        pytz_to_utc(index, timezone, autumn))
+
+
+@pytest.mark.parametrize('timezone', TIMEZONES)
+def test_ambiguous_hour_raises_like_pytz(timezone):
+    index = local_index(timezone, 2020, autumn='summer')
+    with pytest.raises(pytz.AmbiguousTimeError):
+        pytz_to_utc(index, timezone, 'none')
+    with pytest.raises(pytz.AmbiguousTimeError):
+        to_utc(index, timezone, 'none')
+
+
+@pytest.mark.parametrize('timezone, month, hour, minutes', [
+    ('Europe/Paris', 3, 3, (0, 15, 30, 45)),
+    ('Europe/Paris', 3, 2, (0, 30)),
+    ('Europe/Copenhagen', 3, 2, (0,)),
+    ('Europe/Rome', 10, 2, (0,))])
+def test_drop_transitions_like_pytz(timezone, month, hour, minutes):
+    assert list(transitions(timezone, month, hour, minutes)) == \
+        pytz_transitions(timezone, month, hour, minutes)
+    index = pd.date_range('2015-01-01', '2021-12-31 23:45', freq='15min')
+    df = pd.DataFrame({'value': np.arange(len(index))}, index=index)
+    expected = df.loc[~df.index.isin(
+        pytz_transitions(timezone, month, hour, minutes))]
+    assert drop_transitions(df, timezone, month, hour, minutes).equals(
+        expected)
+
+
+@pytest.mark.parametrize('timezone, local', [('CET', 'Europe/Berlin'),
+                                             ('WET', 'Europe/Lisbon')])
+@pytest.mark.parametrize('autumn_expect', [0, 1, 2])
+def test_check_dst_like_pytz(caplog, timezone, local, autumn_expect):
+    indices = [
+        # The hour repeated in October appears twice, that of March never
+        local_index(local, 2020, freq='H'),
+        # Every hour of the clock appears once
+        pd.date_range('2019-01-01', '2021-12-31 23:00', freq='H'),
+        # The transition days are missing
+        pd.date_range('2020-11-01', '2021-02-28', freq='H')]
+    for index in indices:
+        caplog.clear()
+        with caplog.at_level(logging.INFO, 'timeseries_scripts.read'):
+            check_dst(index, autumn_expect=autumn_expect, timezone=timezone)
+        assert [r.getMessage() for r in caplog.records] == pytz_check_dst(
+            index, autumn_expect=autumn_expect, timezone=timezone)
@@ -0,0 +1,56 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from timeseries_scripts.incremental import last_parsed_dates, merge_parsed
+from timeseries_scripts.parsed_store import (load_parsed, parsed_filepath,
+                                             save_parsed)
+
+HEADERS = ['region', 'variable', 'attribute', 'source', 'web', 'unit']
+
+
+def parsed_frame(start, end, freq='H'):
+    index = pd.date_range(start, end, freq=freq, tz='UTC', name='timestamp')
+    columns = pd.MultiIndex.from_tuples(
+        [('DE', 'wind', 'generation_actual', 'TenneT', 'http://a', 'MW')],
+        names=HEADERS)
+    return pd.DataFrame(np.arange(len(index), dtype=float),
+                        index=index, columns=columns)
+
+
+def test_last_parsed_dates(tmp_path):
+    parsed_path = str(tmp_path)
+    df = parsed_frame('2020-01-01', '2020-03-31 23:00')
+    # Trailing rows without data do not count
+    df.iloc[-30:] = np.nan
+    save_parsed(df, parsed_path, '60min', 'TenneT', 'wind')
+    save_parsed(parsed_frame('2020-01-01', '2020-03-31 23:45', '15min'),
+                parsed_path, '15min', 'TenneT', 'wind')
+
+    sources = {'TenneT': {'wind': {}, 'solar': {}}}
+    assert last_parsed_dates(sources, parsed_path) == {
+        ('TenneT', 'wind'): date(2020, 3, 30)}
+
+
+def test_merge_parsed(tmp_path):
+    parsed_path = str(tmp_path)
+    delta_path = str(tmp_path / 'delta')
+    save_parsed(parsed_frame('2019-01-01', '2020-03-31 23:00'),
+                parsed_path, '60min', 'TenneT', 'wind')
+    delta = parsed_frame('2020-03-30', '2020-04-30 23:00') + 1e6
+
+    merge_parsed(parsed_path, '60min', 'TenneT', 'wind', delta,
+                 delta_path=delta_path)
+    df = load_parsed(parsed_filepath(parsed_path, '60min', 'TenneT', 'wind'))
+    assert df.index.is_monotonic_increasing and df.index.is_unique
+    assert df.index[0] == pd.Timestamp('2019-01-01', tz='UTC')
+    assert df.loc['2020-03-30':].equals(delta)
+    assert (df.loc[:'2020-03-29'] < 1e6).all().all()
+    assert load_parsed(parsed_filepath(
+        delta_path, '60min', 'TenneT', 'wind')).equals(delta)
+
+    # Nothing new leaves the data as it was
+    merge_parsed(parsed_path, '60min', 'TenneT', 'wind', delta.iloc[:0])
+    assert load_parsed(parsed_filepath(
+        parsed_path, '60min', 'TenneT', 'wind')).equals(df)
@@ -0,0 +1,71 @@
+import os
+import shutil
+from datetime import date
+
+from timeseries_scripts.download import container_files
+from timeseries_scripts.manifest import DownloadManifest
+from timeseries_scripts import read
+from timeseries_scripts.read import dataset_files
+
+
+def add_file(data_path, period, content=b'x' * 200):
+    container = os.path.join(data_path, 'Elia', 'wind', period)
+    os.makedirs(container)
+    with open(os.path.join(container, 'data.xls'), 'wb') as f:
+        f.write(content)
+    return container
+
+
+def test_deleted_container_is_dropped(tmp_path):
+    data_path = str(tmp_path)
+    manifest = DownloadManifest(os.path.join(data_path, 'manifest.sqlite'))
+    container = add_file(data_path, '2020-01-01_2020-12-31')
+    manifest.record(os.path.join(container, 'data.xls'))
+
+    shutil.rmtree(container)
+    assert container_files(container, manifest) == []
+    assert manifest.lookup(container) is None
+    assert dataset_files(data_path, 'Elia', 'wind', manifest=manifest) == []
+    manifest.close()
+
+
+def test_files_missing_from_manifest_are_read(tmp_path):
+    data_path = str(tmp_path)
+    manifest = DownloadManifest(os.path.join(data_path, 'manifest.sqlite'))
+    indexed = add_file(data_path, '2020-01-01_2020-12-31')
+    manifest.record(os.path.join(indexed, 'data.xls'))
+    unindexed = add_file(data_path, '2019-01-01_2019-12-31')
+
+    files = dataset_files(data_path, 'Elia', 'wind',
+                          start_from_user=date(2019, 1, 1),
+                          end_from_user=date(2020, 12, 31),
+                          manifest=manifest)
+    assert [container for container, _, _ in files] == [unindexed, indexed]
+    assert manifest.lookup(unindexed) == 'data.xls'
+    manifest.close()
+
+
+def test_indexed_containers_are_not_listed(tmp_path, monkeypatch):
+    data_path = str(tmp_path)
+    manifest = DownloadManifest(os.path.join(data_path, 'manifest.sqlite'))
+    add_file(data_path, '2019-01-01_2019-12-31')
+    add_file(data_path, '2020-01-01_2020-12-31')
+    add_file(data_path, '2022-01-01_2022-12-31')
+    os.makedirs(os.path.join(data_path, 'Elia', 'wind', 'notes'))
+
+    listed = []
+
+    def list_container(container):
+        listed.append(os.path.basename(container))
+        return container_files(container)
+
+    monkeypatch.setattr(read, 'list_container', list_container)
+    period = {'start_from_user': date(2020, 1, 1),
+              'end_from_user': date(2020, 12, 31)}
+    first = dataset_files(data_path, 'Elia', 'wind', manifest=manifest,
+                          **period)
+    assert listed == ['2020-01-01_2020-12-31']
+    assert dataset_files(data_path, 'Elia', 'wind', manifest=manifest,
+                         **period) == first
+    assert listed == ['2020-01-01_2020-12-31']
+    manifest.close()
@@ -0,0 +1,117 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from timeseries_scripts import make_json, manifest as mf, read
+from timeseries_scripts.manifest import DownloadManifest
+from timeseries_scripts.parse_cache import ParseCache
+from timeseries_scripts.read import read_dataset
+
+
+def parsed(seed):
+    index = pd.date_range('2020-01-01', periods=48, freq='H')
+    data = np.random.default_rng(seed).random((48, 2))
+    return {'60min': pd.DataFrame(data, index=index, columns=['a', 'b'])}
+
+
+def entries(path):
+    return sorted(name for d in os.listdir(path) if len(d) == 2
+                  for name in os.listdir(os.path.join(path, d)))
+
+
+def test_hit_and_miss(tmp_path):
+    cache = ParseCache(str(tmp_path))
+    assert cache.get('ab01') is None
+    cache.put('ab01', parsed(1))
+    found = cache.get('ab01')
+    assert list(found) == ['60min']
+    pd.testing.assert_frame_equal(found['60min'], parsed(1)['60min'],
+                                  check_freq=False)
+    assert cache.get('ab02') is None
+    cache.close()
+
+
+def test_put_falls_back_to_pickle(tmp_path):
+    # Parquet can not hold a column of mixed types
+    df = pd.DataFrame({'a': [1, 'x']})
+    cache = ParseCache(str(tmp_path))
+    cache.put('ab01', {'60min': df})
+    assert os.listdir(str(tmp_path / 'ab' / 'ab01')) == ['60min.pickle']
+    assert cache.get('ab01')['60min'].equals(df)
+    cache.close()
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = ParseCache(str(tmp_path))
+    for key in ['ab01', 'ab02']:
+        cache.put(key, parsed(1))
+        time.sleep(0.01)
+    size = os.path.getsize(str(tmp_path / 'ab' / 'ab01' / '60min.parquet'))
+    cache.max_bytes = 2 * size
+    cache.get('ab01')
+    time.sleep(0.01)
+
+    cache.put('ab03', parsed(1))
+    assert entries(str(tmp_path)) == ['ab01', 'ab03']
+    assert cache.get('ab02') is None
+    cache.close()
+
+
+def count_reads(monkeypatch):
+    reads = []
+    read_file = read.read_file
+
+    def counted(*args, **kwargs):
+        reads.append(args[3])
+        return read_file(*args, **kwargs)
+
+    monkeypatch.setattr(read, 'read_file', counted)
+    return reads
+
+
+def test_reader_version_invalidates(tmp_path, monkeypatch, ceps_dataset):
+    dataset = ceps_dataset()
+    cache = ParseCache(str(tmp_path / 'cache'))
+    reads = count_reads(monkeypatch)
+
+    read_dataset(cache=cache, **dataset)
+    assert len(reads) == 2
+    del reads[:]
+    read_dataset(cache=cache, **dataset)
+    assert reads == []
+
+    monkeypatch.setitem(read.READER_VERSIONS, 'CEPS',
+                        read.READER_VERSIONS['CEPS'] + 1)
+    read_dataset(cache=cache, **dataset)
+    assert len(reads) == 2
+    cache.close()
+
+
+def test_hashes_are_taken_from_manifest(tmp_path, monkeypatch,
+                                        ceps_dataset):
+    dataset = ceps_dataset()
+    manifest = DownloadManifest(
+        os.path.join(dataset['data_path'], 'manifest.sqlite'))
+    for month in [1, 2]:
+        manifest.record(os.path.join(
+            dataset['data_path'], 'CEPS', 'wind_pv',
+            '2020-{0:02d}-01_2020-{0:02d}-28'.format(month), 'data.csv'))
+    cache = ParseCache(str(tmp_path / 'cache'))
+    read_dataset(cache=cache, manifest=manifest, **dataset)
+
+    hashed = []
+
+    def get_sha_hash(filepath, **kwargs):
+        hashed.append(filepath)
+        return make_json.get_sha_hash(filepath, **kwargs)
+
+    monkeypatch.setattr(read, 'get_sha_hash', get_sha_hash)
+    monkeypatch.setattr(mf, 'get_sha_hash', get_sha_hash)
+    reads = count_reads(monkeypatch)
+    read_dataset(cache=cache, manifest=manifest, **dataset)
+    assert hashed == []
+    assert reads == []
+    manifest.close()
+    cache.close()
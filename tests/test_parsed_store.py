@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from timeseries_scripts.parsed_store import (load_parsed, parsed_files,
+                                             save_parsed)
+
+pyarrow = pytest.importorskip('pyarrow')
+pytest.importorskip('pyarrow.parquet')
+
+HEADERS = ['region', 'variable', 'attribute', 'source', 'web', 'unit']
+
+
+def parsed_frame():
+    index = pd.date_range('2018-12-31 22:00', '2020-01-01 02:00', freq='H',
+                          name='timestamp')
+    columns = pd.MultiIndex.from_tuples(
+        [('DE', 'solar', 'generation_actual', 'TenneT', 'http://a', 'MW'),
+         ('DE', 'wind', 'generation_actual', 'TenneT', 'http://a', 'MW'),
+         ('AT', 'load', 'actual_entsoe', 'APG', 'http://b', 'MW')],
+        names=HEADERS)
+    data = np.arange(len(index) * 3, dtype=float).reshape(-1, 3)
+    data[5, 1] = np.nan
+    return pd.DataFrame(data, index=index, columns=columns)
+
+
+def test_round_trip(tmp_path):
+    df = parsed_frame()
+    before = df.copy()
+    filepath = save_parsed(df, str(tmp_path), '60min', 'TenneT', 'wind')
+
+    assert filepath.endswith('.parquet')
+    # one row group per year
+    assert pyarrow.parquet.ParquetFile(filepath).num_row_groups == 3
+    loaded = load_parsed(filepath)
+    assert df.equals(loaded)
+    assert loaded.columns.names == HEADERS
+    assert loaded.index.name == 'timestamp'
+    # the DataFrame saved is left as it was
+    assert df.equals(before)
+    assert df.index.name == 'timestamp'
+    assert df.columns.names == HEADERS
+
+
+def test_projection(tmp_path):
+    df = parsed_frame()
+    filepath = save_parsed(df, str(tmp_path), '60min', 'TenneT', 'wind')
+
+    loaded = load_parsed(filepath, columns=[('DE',)],
+                         start='2019-06-01', end='2019-06-02 05:00')
+    expected = df.loc['2019-06-01':'2019-06-02 05:00', ['DE']]
+    assert expected.equals(loaded)
+
+
+def test_replaces_pickle(tmp_path):
+    df = parsed_frame()
+    df.to_pickle(str(tmp_path / '60min_TenneT_wind.pickle'))
+    save_parsed(df, str(tmp_path), '60min', 'TenneT', 'wind')
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        '60min_TenneT_wind.parquet']
+
+
+def test_parsed_files(tmp_path):
+    for name in ['15min_Elia_wind_onshore.parquet',
+                 '60min_TenneT_solar.parquet',
+                 '60min_Elexon_generation_by_source.pickle',
+                 '60min_TenneT_solar.parquet.tmp', 'sources.yml']:
+        (tmp_path / name).touch()
+
+    assert [f[1:] for f in parsed_files(str(tmp_path))] == [
+        ('15min', 'Elia', 'wind_onshore'),
+        ('60min', 'Elexon', 'generation_by_source'),
+        ('60min', 'TenneT', 'solar')]
+    subset = {'Elia': ['wind_onshore'], 'Elexon': ['generation_by_source']}
+    assert [os.path.basename(f[0])
+            for f in parsed_files(str(tmp_path), subset)] == [
+        '15min_Elia_wind_onshore.parquet',
+        '60min_Elexon_generation_by_source.pickle']
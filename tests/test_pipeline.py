@@ -0,0 +1,111 @@
+import os
+import threading
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+import yaml
+
+from timeseries_scripts import download as dl, pipeline
+from timeseries_scripts.parsed_store import load_parsed
+from timeseries_scripts.pipeline import download_and_read
+from timeseries_scripts.read import read_dataset
+
+HEADERS = ['region', 'variable', 'attribute', 'source', 'web', 'unit']
+
+
+class Handler(BaseHTTPRequestHandler):
+    '''
+    Serves a day of PSE wind generation for /wind/20200101 and fails for
+    any other day.
+
+    '''
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        day = self.path.rsplit('/', 1)[-1]
+        if day != '20200101':
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        lines = ['Date;Time;Generation of Wind Farms'] + [
+            '{};{};{},5'.format(day, hour, 100 + hour)
+            for hour in range(1, 25)]
+        body = '\n'.join(lines).encode('cp1250')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Content-Disposition',
+                         'attachment; filename=PL_wind_{}.csv'.format(day))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def pse(tmp_path):
+    '''Sources with the PSE wind dataset, served by a local stand-in.'''
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    with open(os.path.join(os.path.dirname(__file__), os.pardir, 'input',
+                           'sources.yml'), encoding='UTF-8') as f:
+        param_dict = yaml.full_load(f.read())['PSE']['wind']
+    param_dict['url_template'] = (
+        'http://127.0.0.1:{}/wind/{{u_start:%Y%m%d}}'.format(
+            server.server_address[1]))
+    param_dict['retry'] = {'attempts': 1}
+    yield {'PSE': {'wind': param_dict}}
+    server.shutdown()
+    server.server_close()
+
+
+def run(tmp_path, sources):
+    data_path = str(tmp_path / 'original_data')
+    parsed_path = str(tmp_path / 'parsed')
+    os.makedirs(parsed_path)
+    download_and_read(
+        sources, data_path, None, parsed_path, None, HEADERS, {},
+        start_from_user=date(2020, 1, 1), end_from_user=date(2020, 1, 2),
+        parse_workers=1)
+    df = load_parsed(os.path.join(parsed_path, '60min_PSE_wind.parquet'))
+
+    # The same as reading the files downloaded
+    serial_path = str(tmp_path / 'serial')
+    os.makedirs(serial_path)
+    read_dataset('PSE', 'wind', sources['PSE']['wind'], data_path,
+                 serial_path, None, HEADERS, start_from_user=date(2020, 1, 1),
+                 end_from_user=date(2020, 1, 2))
+    pd.testing.assert_frame_equal(
+        df, load_parsed(os.path.join(serial_path, '60min_PSE_wind.parquet')))
+    return df.dropna()
+
+
+def test_download_and_read(tmp_path, pse):
+    df = run(tmp_path, pse)
+    # The day that failed to download is missing, the other one is read
+    assert not df.empty
+    assert set(df.index.date) <= {date(2019, 12, 31), date(2020, 1, 1)}
+    assert os.listdir(str(tmp_path / 'original_data' / 'PSE' / 'wind')) == [
+        '2020-01-01_2020-01-01']
+
+
+def test_download_not_reported(tmp_path, pse, monkeypatch):
+    # A failed download that does not report back does not hold up reading
+    submit_jobs = dl.submit_jobs
+
+    def unreported(*args, on_done=None, **kwargs):
+        def report(job):
+            if os.path.basename(job.container).startswith('2020-01-01'):
+                on_done(job)
+        return submit_jobs(*args, on_done=report, **kwargs)
+
+    monkeypatch.setattr(dl, 'submit_jobs', unreported)
+    monkeypatch.setattr(pipeline, 'EVENT_TIMEOUT', 0.1)
+    assert not run(tmp_path, pse).empty
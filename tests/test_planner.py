@@ -0,0 +1,127 @@
+import os
+import time
+from datetime import date, datetime, timedelta
+
+from timeseries_scripts.download import file_container
+from timeseries_scripts.manifest import DownloadManifest
+from timeseries_scripts.planner import (coalesce, dataset_period, deduplicate,
+                                        plan_source)
+
+SOURCE = {'load': {
+    'frequency': 'monthly',
+    'start': date(2019, 1, 1),
+    'end': date(2019, 3, 31),
+    'url_template': 'https://example.org/{u_start}',
+    'url_params_template': None,
+}}
+
+
+def downloaded_at(manifest, data_path, start, end, when,
+                  dataset_name='load'):
+    container = file_container(data_path, 'Example', dataset_name, start,
+                               end)
+    os.makedirs(container)
+    filepath = os.path.join(container, 'data.csv')
+    with open(filepath, 'w') as f:
+        f.write('x')
+    t = time.mktime(when.timetuple())
+    os.utime(filepath, (t, t))
+    manifest.record(filepath)
+    return container
+
+
+def test_refresh_files_downloaded_before_period_end(tmp_path):
+    data_path = str(tmp_path)
+    manifest = DownloadManifest(os.path.join(data_path, 'manifest.sqlite'))
+    # January was downloaded mid-month, February after it was over
+    january = downloaded_at(manifest, data_path, datetime(2019, 1, 1),
+                            datetime(2019, 1, 31), datetime(2019, 1, 15))
+    february = downloaded_at(manifest, data_path, datetime(2019, 2, 1),
+                             datetime(2019, 2, 28), datetime(2019, 3, 1))
+
+    jobs = {job.container: job for job in
+            plan_source('Example', SOURCE, data_path, manifest=manifest)}
+    assert jobs[january].refresh
+    assert not jobs[february].refresh
+    assert not any(job.refresh for job in jobs.values()
+                   if job.container not in (january, february))
+
+    # Found unchanged on the server after the period was over
+    manifest.confirm(january)
+    jobs = {job.container: job for job in
+            plan_source('Example', SOURCE, data_path, manifest=manifest)}
+    assert not jobs[january].refresh
+    manifest.close()
+
+
+def plan_coalesced(source, data_path, manifest):
+    jobs = plan_source('Example', source, data_path, manifest=manifest)
+    return coalesce(deduplicate(jobs, manifest), data_path)
+
+
+def test_open_period_is_not_merged(tmp_path):
+    data_path = str(tmp_path)
+    manifest = DownloadManifest(os.path.join(data_path, 'manifest.sqlite'))
+    today = date.today()
+    this_month = today.replace(day=1)
+    first = (this_month - timedelta(days=40)).replace(day=1)
+    source = {'wind': dict(SOURCE['load'], start=first, end='recent',
+                           max_span=92)}
+
+    # The two months that are over are fetched in one request, the current
+    # one on its own
+    jobs = plan_coalesced(source, data_path, manifest)
+    assert [(job.start.date(), job.end.date()) for job in jobs] == [
+        (first, this_month - timedelta(days=1)),
+        (this_month, jobs[-1].end.date())]
+    assert not any(job.exists or job.refresh for job in jobs)
+
+    now = datetime.now()
+    for job in jobs:
+        downloaded_at(manifest, data_path, job.start, job.end, now,
+                      dataset_name='wind')
+    jobs = plan_coalesced(source, data_path, manifest)
+    assert all(job.exists for job in jobs)
+    assert [job.container for job in jobs if job.refresh] == [
+        file_container(data_path, 'Example', 'wind', this_month,
+                       jobs[-1].end)]
+    manifest.close()
+
+
+def test_merged_file_of_open_period_is_refreshed(tmp_path):
+    data_path = str(tmp_path)
+    manifest = DownloadManifest(os.path.join(data_path, 'manifest.sqlite'))
+    today = date.today()
+    first = (today.replace(day=1) - timedelta(days=40)).replace(day=1)
+    source = {'wind': dict(SOURCE['load'], start=first, end='recent',
+                           max_span=92)}
+    # Merged before the current month was over, e.g. by an older version
+    last = (today.replace(day=28) + timedelta(days=4)).replace(day=1) - \
+        timedelta(days=1)
+    merged = downloaded_at(manifest, data_path, first, last, datetime.now(),
+                           dataset_name='wind')
+
+    jobs = plan_coalesced(source, data_path, manifest)
+    assert [job.container for job in jobs if job.pending] == [merged]
+    assert all(job.exists and job.refresh for job in jobs)
+    manifest.close()
+
+
+def test_since_keeps_the_last_day(tmp_path):
+    today = date.today()
+    param_dict = dict(SOURCE['load'], start=date(2019, 1, 1), end='recent')
+    assert dataset_period(param_dict, since=today) == (today, today)
+    # Day-ahead data reaches into tomorrow
+    tomorrow = today + timedelta(days=1)
+    assert dataset_period(param_dict, since=tomorrow) == (today, today)
+
+    data_path = str(tmp_path)
+    manifest = DownloadManifest(os.path.join(data_path, 'manifest.sqlite'))
+    jobs = plan_source('Example', {'load': param_dict}, data_path,
+                       manifest=manifest,
+                       since={('Example', 'load'): tomorrow})
+    # The file of the current month, not one of just the last day
+    assert [(job.start.date(), job.refresh) for job in jobs] == [
+        (today.replace(day=1), True)]
+    assert jobs[0].end.date() >= today
+    manifest.close()
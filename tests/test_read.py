@@ -0,0 +1,177 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from timeseries_scripts.parsed_store import load_parsed
+from timeseries_scripts.read import (combine_pieces, read_dataset,
+                                     read_GB, read_parallel,
+                                     shift_dst_positions)
+
+
+def combine_one_by_one(pieces):
+    '''How the files of a dataset were combined before combine_pieces().'''
+    cumulated = pd.DataFrame()
+    for df in pieces:
+        if cumulated.empty:
+            cumulated = df
+        else:
+            cumulated = cumulated.combine_first(df)
+    return cumulated
+
+
+def frame(start, periods, columns, seed=0, nan=False):
+    rng = np.random.default_rng(seed)
+    data = rng.random((periods, len(columns)))
+    if nan:
+        data[::3, 0] = np.nan
+    index = pd.date_range(start, periods=periods, freq='H')
+    return pd.DataFrame(data, index=index, columns=columns)
+
+
+CASES = {
+    'same unsorted columns': [
+        frame('2020-01-01', 24, ['b', 'a'], 1),
+        frame('2020-01-02', 24, ['b', 'a'], 2),
+        frame('2020-01-03', 24, ['b', 'a'], 3)],
+    'files out of order': [
+        frame('2020-01-03', 24, ['b', 'a'], 1),
+        frame('2020-01-01', 24, ['b', 'a'], 2)],
+    'overlapping with gaps': [
+        frame('2020-01-01', 36, ['b', 'a'], 1, nan=True),
+        frame('2020-01-02', 36, ['b', 'a'], 2),
+        frame('2020-01-02 06:00', 12, ['b', 'a'], 3, nan=True)],
+    'different columns': [
+        frame('2020-01-01', 24, ['c', 'a'], 1),
+        frame('2020-01-02', 24, ['b', 'a'], 2),
+        frame('2020-01-01 12:00', 24, ['d'], 3)],
+    'multiindex columns': [
+        frame('2020-01-01', 24, pd.MultiIndex.from_tuples(
+            [('DE', 'wind'), ('AT', 'solar')]), 1),
+        frame('2020-01-02', 24, pd.MultiIndex.from_tuples(
+            [('DE', 'wind'), ('AT', 'solar')]), 2)],
+}
+
+
+@pytest.mark.parametrize('case', sorted(CASES))
+def test_combine_pieces_like_combine_first(case):
+    pieces = CASES[case]
+    pd.testing.assert_frame_equal(combine_pieces(pieces),
+                                  combine_one_by_one(pieces),
+                                  check_freq=False)
+
+
+def test_combine_pieces_keeps_first_value():
+    index = pd.date_range('2020-01-01', periods=4, freq='H')
+    later = pd.DataFrame({'a': [10.0, 11.0, 12.0, 13.0]}, index=index)
+    # Read first, overlapping the later file in its last two hours
+    first = pd.DataFrame({'a': [0.0, np.nan, 2.0]},
+                         index=index[2:].append(index[-1:] +
+                                                pd.Timedelta('1H')))
+    # Read last, overlapping both
+    last = pd.DataFrame({'a': [20.0, 21.0], 'b': [1.0, 2.0]},
+                        index=index[1:3])
+
+    df = combine_pieces([first, later, last])
+    assert df.index.is_monotonic_increasing and df.index.is_unique
+    assert list(df.index) == list(index) + [index[-1] + pd.Timedelta('1H')]
+    # The value of the file read first wins, NaN are filled from later ones
+    assert list(df['a']) == [10.0, 11.0, 0.0, 13.0, 2.0]
+    assert list(df['b'].fillna(-1)) == [-1, 1.0, 2.0, -1, -1]
+    pd.testing.assert_frame_equal(df, combine_one_by_one(
+        [first, later, last]), check_freq=False)
+
+
+def shift_row_by_row(df, per_hour, spring_from, autumn_from):
+    '''How read_tennet() and read_GB() corrected the positions before.'''
+    day = 24 * per_hour
+    for i, row in df.iterrows():
+        if row['pos'] > day + per_hour:
+            continue
+        elif (row['pos'] == day - per_hour and (
+                (i == len(df.index) - 1) or (df['pos'][i + 1] == 1))):
+            slicer = df[(df['date'] == row['date']) &
+                        (df['pos'] >= spring_from)].index
+            df.loc[slicer, 'pos'] = df['pos'] + per_hour
+        elif row['pos'] == day + per_hour:
+            slicer = df[(df['date'] == row['date']) &
+                        (df['pos'] >= autumn_from)].index
+            df.loc[slicer, 'pos'] = df['pos'] - per_hour
+
+
+def positions(days):
+    '''Return date and position columns for days of (date, hours).'''
+    return pd.DataFrame([(date, pos) for date, n in days
+                         for pos in range(1, n + 1)],
+                        columns=['date', 'pos'])
+
+
+DAYS = [('30.03.2019', 24), ('31.03.2019', 23), ('01.04.2019', 24),
+        ('27.10.2019', 25), ('28.10.2019', 24), ('29.03.2020', 23)]
+
+
+@pytest.mark.parametrize('per_hour, spring_from, autumn_from',
+                         [(4, 9, 13), (2, 3, 5)])
+def test_shift_dst_positions_like_row_loop(per_hour, spring_from,
+                                           autumn_from):
+    df = positions([(date, n * per_hour) for date, n in DAYS])
+    expected = df.copy()
+    shift_row_by_row(expected, per_hour, spring_from, autumn_from)
+    shift_dst_positions(df, per_hour, spring_from, autumn_from)
+    pd.testing.assert_frame_equal(df, expected)
+    assert df['pos'].max() == 24 * per_hour
+
+
+def test_read_GB_across_dst(tmp_path):
+    days = [('2019-03-30', 48), ('2019-03-31', 46), ('2019-04-01', 48),
+            ('2019-10-26', 48), ('2019-10-27', 50), ('2019-10-28', 48)]
+    df = positions(days)
+    df.columns = ['SETTLEMENT_DATE', 'SETTLEMENT_PERIOD']
+    df['ND'] = range(len(df))
+    filepath = tmp_path / 'demand.csv'
+    df.to_csv(filepath, index=False)
+
+    parsed = read_GB(str(filepath))
+    assert parsed['ND'].tolist() == list(range(len(df)))
+    spring = 48 + 46 + 48
+    for first, last in [(0, spring), (spring, len(df))]:
+        index = parsed.index[first:last]
+        assert (index[1:] - index[:-1] == pd.Timedelta('30min')).all()
+    assert parsed.index[0] == pd.Timestamp('2019-03-30 00:00')
+    assert parsed.index[48] == pd.Timestamp('2019-03-31 00:00')
+    assert parsed.index[spring] == pd.Timestamp('2019-10-25 23:00')
+
+
+def test_read_parallel_like_read_dataset(tmp_path, ceps_dataset, caplog):
+    jobs = [dict(ceps_dataset('wind_pv'), start_from_user=None,
+                 end_from_user=None),
+            dict(ceps_dataset('wind_pv_old', months=(3, 4, 5), scale=2),
+                 start_from_user=None, end_from_user=None)]
+    broken = dict(jobs[0], dataset_name='broken',
+                  param_dict={k: v for k, v in jobs[0]['param_dict'].items()
+                              if k != 'colmap'})
+    ceps_dataset('broken')
+
+    with caplog.at_level(logging.INFO):
+        failed = read_parallel(jobs + [broken], max_workers=2)
+
+    # A job that raised is reported, the others are read as by
+    # read_dataset()
+    assert list(failed) == [('CEPS', 'broken')]
+    assert isinstance(failed['CEPS', 'broken'], KeyError)
+    serial_path = str(tmp_path / 'serial')
+    os.makedirs(serial_path)
+    for job in jobs:
+        read_dataset(**dict(job, parsed_path=serial_path))
+        filename = '60min_CEPS_{}.parquet'.format(job['dataset_name'])
+        pd.testing.assert_frame_equal(
+            load_parsed(os.path.join(job['parsed_path'], filename)),
+            load_parsed(os.path.join(serial_path, filename)))
+
+    # Log records of the workers reach the loggers here
+    reading = [r for r in caplog.records
+               if r.getMessage().endswith('reading...')]
+    assert len(reading) >= 3
+    assert {r.processName for r in reading[:3]} != {'MainProcess'}
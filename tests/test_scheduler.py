@@ -0,0 +1,76 @@
+import threading
+import time
+
+from timeseries_scripts.retry import RetryLater
+from timeseries_scripts.scheduler import RESCHEDULED, DownloadScheduler
+
+
+class Recorder():
+    '''Job function that records how many jobs run at the same time.'''
+
+    def __init__(self, duration=0.05):
+        self.duration = duration
+        self.running = {}
+        self.peak = {}
+        self.sessions = []
+        self._lock = threading.Lock()
+
+    def __call__(self, source_name, host, session=None):
+        with self._lock:
+            self.running[host] = self.running.get(host, 0) + 1
+            self.running['all'] = self.running.get('all', 0) + 1
+            for key in (host, 'all'):
+                self.peak[key] = max(self.peak.get(key, 0),
+                                     self.running[key])
+            self.sessions.append(session)
+        time.sleep(self.duration)
+        with self._lock:
+            self.running[host] -= 1
+            self.running['all'] -= 1
+        return True, session
+
+
+def test_capped_hosts_do_not_hold_workers():
+    job = Recorder()
+    scheduler = DownloadScheduler(max_workers=8)
+    t0 = time.perf_counter()
+    # Jobs for the host with the lowest cap come first
+    for host, limit in [('sftp', 2), ('a', 2), ('b', 4)]:
+        for i in range(16):
+            scheduler.submit(job, 'source', host, host=host,
+                             host_limit=limit)
+    assert scheduler.close() == 0
+    elapsed = time.perf_counter() - t0
+
+    assert job.peak == {'sftp': 2, 'a': 2, 'b': 4, 'all': 8}
+    # 8 rounds of the hosts capped at 2, in parallel
+    assert elapsed < 8 * job.duration * 1.5
+
+
+def test_worker_session_unless_job_brings_one():
+    job = Recorder(duration=0)
+    scheduler = DownloadScheduler(max_workers=2)
+    for i in range(4):
+        scheduler.submit(job, 'source', 'a', host='a')
+    scheduler.submit(job, 'source', 'a', host='a', session='own')
+    scheduler.submit(job, 'source', 'a', host='a', session=None)
+    scheduler.close()
+
+    assert None not in job.sessions
+    assert job.sessions.count('own') == 1
+
+
+def test_retry_later():
+    calls = []
+
+    def job(source_name, session=None, attempt=1):
+        calls.append(attempt)
+        if attempt == 1:
+            raise RetryLater(0.01, 'busy')
+        return True, session
+
+    scheduler = DownloadScheduler(max_workers=1)
+    future = scheduler.submit(job, 'source', host='a')
+    assert scheduler.close() == 0
+    assert future.result() == RESCHEDULED
+    assert calls == [1, 2]
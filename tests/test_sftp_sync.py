@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+import paramiko
+import pytest
+
+from timeseries_scripts.download import download_file
+from timeseries_scripts.manifest import DownloadManifest
+from timeseries_scripts.scheduler import DownloadScheduler
+from timeseries_scripts.sftp_sync import SFTPPool
+
+SOURCE_NAME = 'ENTSO-E Transparency FTP'
+PARAM_DICT = {'host': '127.0.0.1', 'path': 'export/',
+              'filename': '{u_start.year}_{u_start.month}_data.csv'}
+MONTHS = [(datetime(2020, m, 1), datetime(2020, m, 28)) for m in range(1, 7)]
+
+
+def remote_file(standin, month, body, mtime=1000000):
+    path = os.path.join(standin.root, 'export')
+    os.makedirs(path, exist_ok=True)
+    filepath = os.path.join(path, '2020_{}_data.csv'.format(month))
+    with open(filepath, 'wb') as f:
+        f.write(body)
+    os.utime(filepath, (mtime, mtime))
+
+
+def pool(standin, size=2):
+    return SFTPPool(standin.host, standin.port, 'user', 'password',
+                    size=size)
+
+
+def sync(standin, data_path, manifest, refresh=False):
+    sftp = pool(standin)
+    scheduler = DownloadScheduler(max_workers=4)
+    futures = [scheduler.submit(
+        download_file, SOURCE_NAME, 'generation', data_path, PARAM_DICT,
+        start, end, None, filename=PARAM_DICT['filename'], sftp=sftp,
+        manifest=manifest, refresh=refresh, host=standin.host, host_limit=4)
+        for start, end in MONTHS]
+    assert scheduler.close() == 0
+    sftp.close()
+    assert all(future.result() for future in futures)
+
+
+def test_pooled_sync(tmp_path, sftp_standin):
+    for month in range(1, 7):
+        remote_file(sftp_standin, month, str(month).encode() * 5000)
+    sftp_standin.latency = 0.02
+    data_path = str(tmp_path / 'data')
+    manifest = DownloadManifest(os.path.join(data_path, 'manifest.sqlite'))
+
+    sync(sftp_standin, data_path, manifest)
+    # One listing for all files, fetched on both connections of the pool
+    assert sftp_standin.listings == 1
+    assert sftp_standin.connections == 2
+    assert sftp_standin.opened == 6
+    assert sftp_standin.most_transfers == 2
+    with open(os.path.join(data_path, SOURCE_NAME, 'generation',
+                           '2020-03-01_2020-03-28', '2020_3_data.csv'),
+              'rb') as f:
+        assert f.read() == b'3' * 5000
+
+    # Only files whose size or mtime changed are fetched again
+    remote_file(sftp_standin, 2, b'2' * 5000, mtime=2000000)
+    remote_file(sftp_standin, 4, b'4' * 6000)
+    sync(sftp_standin, data_path, manifest, refresh=True)
+    assert sftp_standin.listings == 2
+    assert sftp_standin.opened == 8
+    with open(os.path.join(data_path, SOURCE_NAME, 'generation',
+                           '2020-04-01_2020-04-28', '2020_4_data.csv'),
+              'rb') as f:
+        assert f.read() == b'4' * 6000
+    manifest.close()
+
+
+def test_broken_connection_is_not_reused(sftp_standin):
+    sftp = pool(sftp_standin, size=1)
+    with sftp.client() as client:
+        first = client
+    with pytest.raises(EOFError):
+        with sftp.client() as client:
+            assert client is first
+            raise EOFError()
+    with sftp.client() as client:
+        assert client is not first
+        # The transport drops while the client is borrowed
+        client.get_channel().get_transport().close()
+        second = client
+    with sftp.client() as client:
+        assert client is not second
+    assert sftp_standin.connections == 3
+    sftp.close()
+
+
+class FakeClient():
+
+    def get_channel(self):
+        return self
+
+    def get_transport(self):
+        return self
+
+    def is_active(self):
+        return True
+
+    def close(self):
+        pass
+
+
+def test_slow_connect_does_not_block_idle_connection():
+    sftp_pool = SFTPPool('127.0.0.1', 22, 'user', 'password', size=2)
+    connecting = threading.Event()
+    release = threading.Event()
+    first = FakeClient()
+
+    def connect():
+        if not sftp_pool._opened:
+            return first
+        connecting.set()
+        release.wait(10)
+        return FakeClient()
+
+    sftp_pool._connect = connect
+    start = time.monotonic()
+    with sftp_pool.client():
+        # Another job opens the second connection, which takes its time
+        slow = threading.Thread(target=lambda: sftp_pool.client().__enter__())
+        slow.start()
+        assert connecting.wait(10)
+
+    # The first connection is idle again and handed out right away
+    borrowed = []
+    fast = threading.Thread(
+        target=lambda: borrowed.append(sftp_pool.client().__enter__()))
+    fast.start()
+    fast.join(5)
+    handed_out = list(borrowed)
+    release.set()
+    slow.join(10)
+    fast.join(10)
+    assert handed_out == [first]
+    assert time.monotonic() - start < 5
+
+
+def test_failed_connect_frees_its_slot():
+    sftp_pool = SFTPPool('127.0.0.1', 22, 'user', 'password', size=1)
+    attempts = []
+
+    def connect():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise paramiko.SSHException('handshake failed')
+        return FakeClient()
+
+    sftp_pool._connect = connect
+    with pytest.raises(paramiko.SSHException):
+        with sftp_pool.client():
+            pass
+    with sftp_pool.client() as sftp:
+        assert isinstance(sftp, FakeClient)
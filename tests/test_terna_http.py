@@ -0,0 +1,91 @@
+import datetime
+import os
+
+from timeseries_scripts.terna_http import (MONTH_ID, PAGE_URL, YEAR_ID,
+                                           TernaPage, search_subperiod)
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+PAGER = 'dnn$ctr5990$TernaViewDocumentView$grdDocuments$ctl00$ctl03$ctl01$'
+
+
+def saved_page(name):
+    with open(os.path.join(DATA, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def test_form():
+    page = TernaPage(saved_page('terna_page1.html'))
+    assert page.action == ('https://www.terna.it/SistemaElettrico/'
+                           'TransparencyReport/Generation/'
+                           'Forecastandactualgeneration.aspx')
+    assert page.names[YEAR_ID] == 'dnn$ctr5990$TernaViewDocumentView$cbAnno'
+    assert page.names[MONTH_ID] == 'dnn$ctr5990$TernaViewDocumentView$cbMese'
+    assert page.fields == {
+        '__VIEWSTATE': 'dDwtMTA4MTc0Mjs7Pg==',
+        '__EVENTVALIDATION': 'wEWAgL+raDpAgKM54rGBg==',
+        'dnn$ctr5990$TernaViewDocumentView$cbAnno': '2018',
+        'dnn$ctr5990$TernaViewDocumentView$cbMese': '',
+        'dnn$ctr5990$TernaViewDocumentView$chkAll': 'on'}
+    assert page.search == (
+        'postback', 'dnn$ctr5990$TernaViewDocumentView$btnSearch', '')
+
+
+def test_links():
+    page = TernaPage(saved_page('terna_page1.html'))
+    # Only the links in the results are collected
+    assert len(page.links) == 3
+    assert page.filter_links(datetime.date(2018, 9, 1),
+                             datetime.date(2018, 12, 31)) == {
+        (2018, 9, 30): 'https://www.terna.it/DesktopModules/Terna/'
+                       'Documents/20180930.xlsx',
+        (2018, 10, 1): 'https://download.terna.it/files/20181001.xlsx'}
+    assert page.filter_links(datetime.date(2018, 10, 1),
+                             datetime.date(2018, 10, 31)) == {
+        (2018, 10, 1): 'https://download.terna.it/files/20181001.xlsx'}
+
+
+def test_pager():
+    page = TernaPage(saved_page('terna_page1.html'))
+    assert page.next_page(1) == (PAGER + 'ctl01', '')
+    assert TernaPage(saved_page('terna_page2.html')).next_page(2) is None
+
+
+class Response():
+
+    def __init__(self, name):
+        self.text = saved_page(name)
+        self.url = PAGE_URL
+
+    def raise_for_status(self):
+        pass
+
+
+class Session():
+    '''Answers with the saved pages of a search with two result pages.'''
+
+    def __init__(self):
+        self.posts = []
+
+    def get(self, url, **kwargs):
+        return Response('terna_page1.html')
+
+    def post(self, url, data=None, **kwargs):
+        self.posts.append(data)
+        if data['__EVENTTARGET'] == PAGER + 'ctl01':
+            return Response('terna_page2.html')
+        return Response('terna_page1.html')
+
+
+def test_search_subperiod():
+    session = Session()
+    links = search_subperiod(datetime.date(2018, 10, 1),
+                             datetime.date(2018, 10, 31), 2018, 10,
+                             session=session)
+    assert sorted(links) == [(2018, 10, 1), (2018, 10, 2)]
+    search, pager = session.posts
+    assert search['__EVENTTARGET'] == ('dnn$ctr5990$TernaViewDocumentView'
+                                       '$btnSearch')
+    assert search['dnn$ctr5990$TernaViewDocumentView$cbAnno'] == '2018'
+    assert search['dnn$ctr5990$TernaViewDocumentView$cbMese'] == 'October'
+    assert search['__VIEWSTATE'] == 'dDwtMTA4MTc0Mjs7Pg=='
+    assert pager['__EVENTTARGET'] == PAGER + 'ctl01'
@@ -11,3 +11,19 @@ from . import download
 from . import read
 from . import imputation
 from . import terna
+from . import terna_http
+from . import scheduler
+from . import manifest
+from . import sftp_sync
+from . import retry
+from . import archive
+from . import planner
+from . import metrics
+from . import blobstore
+from . import incremental
+from . import sessions
+from . import cassette
+from . import pipeline
+from . import parse_cache
+from . import parsed_store
+from . import dst
@@ -0,0 +1,254 @@
+'''
+Open Power System Data
+
+Time series Datapackage
+
+archive.py : extract selected files from an archived original_data.zip
+
+'''
+
+import io
+import logging
+import os
+import re
+import shutil
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import requests
+
+from .download import PARTIAL_SUFFIX
+
+logger = logging.getLogger(__name__)
+logger.setLevel('DEBUG')
+
+# Name of the directory holding one file, e.g. 2018-01-01_2018-01-31
+CONTAINER = re.compile(r'^(\d{4}-\d{2}-\d{2})_(\d{4}-\d{2}-\d{2})$')
+
+
+class RemoteFile(io.RawIOBase):
+    '''
+    Read-only, seekable file object backed by HTTP range requests, so
+    zipfile can read the central directory and single members of an archive
+    on a server without downloading all of it.
+
+    Wrap it in io.BufferedReader to fetch larger blocks per request.
+
+    Parameters
+    ----------
+    url : str
+    size : int
+        Size of the remote file in bytes
+    session : requests.session, optional
+    timeout : float, default 120
+        Seconds to wait for the server on each request
+    chunks : list, optional
+        (offset, bytes) of parts of the file fetched before, shared between
+        several RemoteFile of the same file. Reads they cover are answered
+        from memory.
+    keep : bool, default False
+        Add the parts fetched to chunks, e.g. while zipfile reads the
+        central directory, so other RemoteFile need not fetch it again.
+
+    '''
+
+    def __init__(self, url, size, session=None, timeout=120, chunks=None,
+                 keep=False):
+        self.url = url
+        self.size = size
+        self.session = session or requests.session()
+        self.timeout = timeout
+        self.chunks = [] if chunks is None else chunks
+        self.keep = keep
+        self._pos = 0
+
+    @classmethod
+    def open(cls, url, session=None, timeout=120):
+        '''
+        Return a RemoteFile for url, or None if the server does not support
+        range requests.
+
+        '''
+        session = session or requests.session()
+        resp = session.head(url, allow_redirects=True, timeout=timeout)
+        if (resp.status_code != 200 or
+                resp.headers.get('accept-ranges') != 'bytes' or
+                'content-length' not in resp.headers):
+            return None
+        return cls(resp.url, int(resp.headers['content-length']), session,
+                   timeout)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def readinto(self, b):
+        if self._pos >= self.size or len(b) == 0:
+            return 0
+        for offset, chunk in self.chunks:
+            if offset <= self._pos < offset + len(chunk):
+                n = min(len(b), offset + len(chunk) - self._pos)
+                b[:n] = chunk[self._pos - offset:self._pos - offset + n]
+                self._pos += n
+                return n
+
+        end = min(self._pos + len(b), self.size) - 1
+        resp = self.session.get(
+            self.url, headers={'Range': 'bytes={}-{}'.format(self._pos, end)},
+            timeout=self.timeout)
+        if resp.status_code != 206:
+            raise IOError('range request to {} answered with http status {}'
+                          .format(self.url, resp.status_code))
+        n = len(resp.content)
+        b[:n] = resp.content
+        if self.keep:
+            self.chunks.append((self._pos, resp.content))
+        self._pos += n
+        return n
+
+
+def member_target(name, sources=None, start_from_user=None,
+                  end_from_user=None):
+    '''
+    Decide whether an archive member is needed and where to save it.
+
+    Members are expected at ``[...]/source/dataset/start_end/filename``.
+
+    Parameters
+    ----------
+    name : str
+        Name of the member in the archive
+    sources : dict, optional
+        Sources and datasets to extract, as in sources.yml. All if not given.
+    start_from_user : datetime.date, optional
+    end_from_user : datetime.date, optional
+        Period to extract files for, using the same rule as read_dataset()
+
+    Returns
+    ----------
+    target : tuple or None
+        (source_name, dataset_name, container, filename) or None if the
+        member is not needed.
+
+    '''
+    parts = name.split('/')
+    if len(parts) < 4 or not parts[-1]:
+        return None
+    source_name, dataset_name, container, filename = parts[-4:]
+    match = CONTAINER.match(container)
+    if not match:
+        return None
+
+    if sources is not None and dataset_name not in sources.get(
+            source_name, {}):
+        return None
+
+    start, end = [date(*map(int, d.split('-'))) for d in match.groups()]
+    # start lies after file end => filecontent is too old
+    if start_from_user and start_from_user > end:
+        return None
+    # end lies before file start => filecontent is too recent
+    if end_from_user and end_from_user < start - timedelta(days=1):
+        return None
+
+    return source_name, dataset_name, container, filename
+
+
+def extract_archive(
+        archive,
+        data_path,
+        sources=None,
+        start_from_user=None,
+        end_from_user=None,
+        max_workers=8,
+        manifest=None,
+        archived=None):
+    '''
+    Extract the files of the selected sources and period from a zip archive
+    into data_path, decompressing several members at the same time.
+
+    Files already extracted completely are skipped, a member is written
+    under a temporary name and renamed when complete.
+
+    Parameters
+    ----------
+    archive : callable
+        Returns a new binary file object of the archive on each call, so
+        every worker thread reads through its own file handle. The first
+        one is used to read the central directory, see RemoteFile for
+        how the others can be spared from fetching it again.
+    max_workers : int, default 8
+        Number of members extracted at the same time.
+    manifest : DownloadManifest, optional
+        Where to record the extracted files.
+    archived : datetime.datetime, optional
+        When the archive was made. The extracted files are dated, and
+        recorded as downloaded, at that time, so files of periods that were
+        still open then are checked for updates. By default, the time stored
+        with each member is used.
+
+    See member_target() for info on the other parameters.
+
+    Returns
+    ----------
+    count : int
+        Number of files extracted.
+
+    '''
+    with archive() as fp, zipfile.ZipFile(fp) as z:
+        members = []
+        for info in z.infolist():
+            target = member_target(info.filename, sources,
+                                   start_from_user, end_from_user)
+            if target is not None:
+                members.append((info, os.path.join(data_path, *target)))
+    logger.info('%s files in the archive match the sources and period '
+                'selected', len(members))
+
+    local = threading.local()
+    opened = []
+
+    def extract(info, filepath):
+        if (os.path.exists(filepath) and
+                os.path.getsize(filepath) == info.file_size):
+            return False
+        if not hasattr(local, 'zipfile'):
+            fp = archive()
+            opened.append(fp)
+            local.zipfile = zipfile.ZipFile(fp)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        part = filepath + PARTIAL_SUFFIX
+        with local.zipfile.open(info) as src, open(part, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 65536)
+        mtime = (archived or datetime(*info.date_time)).timestamp()
+        os.utime(part, (mtime, mtime))
+        os.replace(part, filepath)
+        if manifest is not None:
+            manifest.record(filepath)
+        return True
+
+    # Largest members first, so they do not hold up the end of the run
+    members.sort(key=lambda m: -m[0].file_size)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        count = sum(executor.map(lambda m: extract(*m), members))
+    for fp in opened:
+        fp.close()
+
+    logger.info('Extracted %s files to %s, %s were there already',
+                count, data_path, len(members) - count)
+    return count
@@ -0,0 +1,404 @@
+'''
+Open Power System Data
+
+Time series Datapackage
+
+async_download.py : download time series files with asyncio and aiohttp
+
+'''
+
+import asyncio
+import functools
+import inspect
+import logging
+import threading
+from time import perf_counter
+
+import aiohttp
+
+from . import download as dl
+from .manifest import http_validators
+from .retry import RetryLater, RetryPolicy, RetryStats
+from .sessions import LoginSession, rejected
+
+logger = logging.getLogger(__name__)
+logger.setLevel('DEBUG')
+
+
+class AsyncScheduler():
+    '''
+    Drop-in replacement for DownloadScheduler that keeps all downloads in
+    flight on a single event loop thread instead of a thread pool.
+
+    download_file jobs are run as download_file_async on the loop, any other
+    job is run in the loop's default executor. Response bodies are streamed
+    to disk and the latency of each file is recorded in ``latencies``. Jobs
+    raising RetryLater release their slots while they wait for the retry.
+
+    Parameters
+    ----------
+    max_workers : int, default 200
+        Maximum number of downloads in flight at the same time.
+    default_host_limit : int, default 2
+        Maximum number of downloads in flight per host, for hosts without a
+        ``max_connections`` entry in sources.yml.
+
+    '''
+
+    def __init__(self, max_workers=200, default_host_limit=2):
+        self.max_workers = max_workers
+        self.default_host_limit = default_host_limit
+        self.latencies = {}
+        self.stats = RetryStats()
+        self._host_slots = {}
+        self._slots = None
+        self._session = None
+        self._futures = []
+        self._cleanups = []
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    # Semaphores and the aiohttp session must be created on the loop thread,
+    # so they are set up lazily by the first job that needs them.
+    def _host_slot(self, host, host_limit):
+        if host not in self._host_slots:
+            limit = min(host_limit or self.default_host_limit,
+                        self.max_workers)
+            self._host_slots[host] = asyncio.Semaphore(limit)
+            logger.debug('%s: at most %s concurrent downloads', host, limit)
+        return self._host_slots[host]
+
+    def session(self):
+        '''Return the aiohttp.ClientSession shared by all jobs.'''
+        if self._session is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_workers))
+        return self._session
+
+    async def _run(self, func, args, kwargs, host, host_limit):
+        session = self.session()
+        job = inspect.signature(func).bind(*args, **kwargs).arguments
+        attempt = kwargs.pop('attempt', 1)
+        while True:
+            self.stats.record(job['source_name'], attempts=1)
+            try:
+                # Wait for the host before taking one of the global slots,
+                # so jobs for a host at its cap do not hold them
+                async with self._host_slot(host, host_limit), self._slots:
+                    if attempt > 1:
+                        kwargs['attempt'] = attempt
+                    downloaded = await self._attempt(
+                        func, args, kwargs, session, job)
+                break
+            except RetryLater as e:
+                logger.warning('%s, attempt %s, trying again in %.0f s',
+                               e.reason, attempt, e.delay)
+                self.stats.record(job['source_name'], retries=1, wait=e.delay)
+                await asyncio.sleep(e.delay)
+                attempt += 1
+
+        if not downloaded:
+            self.stats.record(job['source_name'], failed=1)
+        return downloaded
+
+    async def _attempt(self, func, args, kwargs, session, job):
+        # A job bringing its own session (e.g. of a cassette) is not run
+        # with aiohttp
+        if func is dl.download_file and kwargs.get('session') is None:
+            key = '{source_name} | {dataset_name} | {start:%Y-%m-%d}'
+            t0 = perf_counter()
+            downloaded, session = await download_file_async(
+                *args, **dict(kwargs, session=session))
+            self.latencies[key.format(**job)] = perf_counter() - t0
+        else:
+            downloaded, session = await self._loop.run_in_executor(
+                None, functools.partial(func, *args, **kwargs))
+        return downloaded
+
+    def submit(self, func, *args, host=None, host_limit=None, **kwargs):
+        '''
+        Schedule a download job on the event loop. See
+        DownloadScheduler.submit() for info on parameters.
+
+        '''
+        future = asyncio.run_coroutine_threadsafe(
+            self._run(func, args, kwargs, host, host_limit), self._loop)
+        self._futures.append(future)
+        return future
+
+    def on_close(self, cleanup):
+        '''Register a callable to run once all jobs have finished.'''
+        self._cleanups.append(cleanup)
+
+    def close(self):
+        '''
+        Wait for all scheduled jobs, then close the session and the loop.
+        See DownloadScheduler.close() for info on the return value.
+
+        '''
+        failed = 0
+        for future in self._futures:
+            try:
+                if not future.result():
+                    failed += 1
+            except Exception as e:
+                logger.error('download job raised: %r', e)
+                failed += 1
+
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(
+                self._session.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        for cleanup in self._cleanups:
+            cleanup()
+
+        logger.info('%s download jobs finished, %s failed',
+                    len(self._futures), failed)
+        self.stats.log()
+        slowest = sorted(self.latencies.items(), key=lambda x: -x[1])[:5]
+        for key, seconds in slowest:
+            logger.info('slowest: %s | %.1f s', key, seconds)
+
+        return failed
+
+
+async def download_file_async(
+        source_name,
+        dataset_name,
+        data_path,
+        param_dict,
+        start,
+        end,
+        url,
+        url_params_template=None,
+        filename=None,
+        session=None,
+        cookies=None,
+        sftp=None,
+        manifest=None,
+        metrics=None,
+        refresh=False,
+        attempt=1):
+    '''
+    Coroutine version of download.download_file(). See there for info on
+    parameters and return values. session is an aiohttp.ClientSession.
+
+    '''
+    if source_name == 'ENTSO-E Transparency FTP':
+        # paramiko is blocking, so the transfer runs in a worker thread
+        downloaded, _ = await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(
+                dl.download_file, source_name, dataset_name, data_path,
+                param_dict, start, end, url, filename=filename, sftp=sftp,
+                manifest=manifest, metrics=metrics, refresh=refresh,
+                attempt=attempt))
+        return downloaded, session
+
+    message = dl.log_prefix(source_name, dataset_name, start, end)
+    container = dl.file_container(data_path, source_name, dataset_name,
+                                  start, end)
+    start, end = dl.server_period(source_name, start, end)
+
+    # Attempt the download if there is no file yet, or check for a newer
+    # version of the file if it is to be refreshed
+    count_files = len(await asyncio.get_running_loop().run_in_executor(
+        None, dl.container_files, container, manifest))
+    if count_files == 0 or (count_files == 1 and refresh):
+        t0 = perf_counter()
+        transfer = None
+        if metrics is not None:
+            transfer = metrics.start(container, dl.host_of(url), attempt)
+        # The attempt is recorded even if it raises, e.g. RetryLater to be
+        # repeated by the scheduler
+        downloaded, outcome = False, None
+        try:
+            downloaded, session = await download_request_async(
+                source_name,
+                start,
+                end,
+                session,
+                filename,
+                container,
+                url_template=url,
+                url_params_template=url_params_template,
+                cookies=cookies,
+                manifest=manifest,
+                retry_policy=RetryPolicy.from_params(param_dict),
+                attempt=attempt,
+                transfer=transfer)
+        except RetryLater:
+            outcome = 'retry'
+            raise
+        finally:
+            if metrics is not None:
+                metrics.finish(transfer, downloaded, outcome)
+
+        if downloaded and count_files == 1:
+            logger.info(message + 'checked for update (%.1f s)',
+                        perf_counter() - t0)
+        elif downloaded:
+            logger.info(message + 'download successful (%.1f s)',
+                        perf_counter() - t0)
+        else:
+            logger.info(message + 'download failed')
+
+    elif count_files == 1:
+        downloaded = True
+        logger.debug(message + 'download previously')
+
+    else:
+        downloaded = True
+        logger.warning(
+            'There must not be more than one file in: %s. Please check ',
+            container)
+
+    return downloaded, session
+
+
+async def download_request_async(
+        source_name,
+        start,
+        end,
+        session,
+        filename,
+        container,
+        url_template,
+        url_params_template=None,
+        cookies=None,
+        manifest=None,
+        retry_policy=None,
+        attempt=1,
+        transfer=None):
+    '''
+    Coroutine version of download.download_request(), streaming the response
+    body to disk. See there for info on parameters and return values.
+
+    '''
+    url, url_params = dl.build_url(
+        url_template, url_params_template, start, end)
+    headers = dl.request_headers(container, manifest)
+
+    login = cookies if isinstance(cookies, LoginSession) else None
+    if login is not None:
+        # A login may start a browser, so it runs in a worker thread
+        cookies = await asyncio.get_running_loop().run_in_executor(
+            None, login.cookies)
+    jar = cookies
+    if cookies is not None:
+        cookies = {c.name: c.value for c in cookies}
+
+    if retry_policy is None:
+        retry_policy = RetryPolicy(attempts=1)
+    timeout = aiohttp.ClientTimeout(sock_connect=retry_policy.timeout,
+                                    sock_read=retry_policy.timeout)
+
+    def get(cookies):
+        return session.get(url, params=url_params, cookies=cookies,
+                           headers=headers, timeout=timeout)
+
+    try:
+        resp = await get(cookies)
+        if login is not None and rejected(
+                resp.status, resp.headers.get('content-type')):
+            # Log in again and repeat the request, as download_request() does
+            resp.release()
+            login.expire(jar)
+            logger.debug('cookies rejected by %s', resp.url)
+            jar = await asyncio.get_running_loop().run_in_executor(
+                None, login.cookies)
+            resp = await get({c.name: c.value for c in jar})
+        async with resp:
+            if transfer is not None:
+                transfer.first_byte()
+                transfer.status = resp.status
+
+            if login is not None and rejected(
+                    resp.status, resp.headers.get('content-type')):
+                # Rejected right after logging in, so trying again is no use
+                login.expire(jar)
+                logger.warning('cookies rejected by %s after logging in',
+                               resp.url)
+                downloaded = False
+                return downloaded, session
+            elif resp.status == 304:
+                logger.debug('%s not modified', resp.url)
+                if manifest is not None:
+                    manifest.confirm(container)
+                downloaded = True
+                return downloaded, session
+            elif resp.status not in (200, 206):
+                retry_policy.check(attempt, status=resp.status)
+                logger.debug('http status %s from %s', resp.status, resp.url)
+                downloaded = False
+                return downloaded, session
+
+            # File operations block, so they run in a worker thread while
+            # the loop keeps serving the other downloads
+            loop = asyncio.get_running_loop()
+            part, mode = await loop.run_in_executor(None, functools.partial(
+                resume_target,
+                container,
+                dl.original_filename(resp.headers, str(resp.url),
+                                     start, end, filename),
+                resp.status,
+                encoded='content-encoding' in resp.headers,
+                validators=http_validators(resp.headers)))
+            if mode is not None:
+                output_file = await loop.run_in_executor(
+                    None, open, part, mode)
+                try:
+                    async for chunk in resp.content.iter_chunked(65536):
+                        await loop.run_in_executor(
+                            None, output_file.write, chunk)
+                        if transfer is not None:
+                            transfer.add(len(chunk))
+                finally:
+                    await loop.run_in_executor(None, output_file.close)
+            elif 'Range' not in (headers or {}):
+                logger.warning('%s sent part of a file without being asked '
+                               'to', resp.url)
+                downloaded = False
+                return downloaded, session
+
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        # A partial file is kept, so a retry continues where this stopped
+        retry_policy.check(attempt, error=e)
+        logger.warning('Download from %s failed: %r', url, e)
+        downloaded = False
+        return downloaded, session
+
+    if mode is None:
+        logger.info('%s can not be resumed, downloading it again', resp.url)
+        return await download_request_async(
+            source_name, start, end, session, filename, container,
+            url_template, url_params_template,
+            cookies=login if login is not None else jar,
+            manifest=manifest, retry_policy=retry_policy, attempt=attempt,
+            transfer=transfer)
+
+    filepath = await asyncio.get_running_loop().run_in_executor(
+        None, dl.finish_download, part,
+        dl.expected_size(resp.status, resp.headers))
+    if filepath and manifest is not None:
+        # Hashing the file would block the loop
+        await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(manifest.record, filepath,
+                                    **http_validators(resp.headers)))
+    downloaded = filepath is not None
+    return downloaded, session
+
+
+def resume_target(container, name, status, encoded=False, validators=None):
+    '''
+    Find the partial file in a container and pass it to
+    download.resume_target(), so both can run in a worker thread.
+
+    '''
+    return dl.resume_target(container, name,
+                            dl.partial_download(container)[0], status,
+                            encoded=encoded, validators=validators)
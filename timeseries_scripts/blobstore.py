@@ -0,0 +1,177 @@
+'''
+Open Power System Data
+
+Time series Datapackage
+
+blobstore.py : content-addressed store of raw files shared by all versions
+
+'''
+
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+from datetime import datetime
+
+from .download import PARTIAL_SUFFIX
+
+logger = logging.getLogger(__name__)
+logger.setLevel('DEBUG')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS containers (
+    container TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    size INTEGER,
+    etag TEXT,
+    last_modified TEXT,
+    mtime REAL,
+    stored TEXT
+);
+'''
+
+VALIDATORS = ['etag', 'last_modified', 'mtime']
+
+# ioctl request to clone a file on copy-on-write filesystems (btrfs, XFS)
+FICLONE = 0x40049409
+
+
+class BlobStore():
+    '''
+    Raw files stored once by SHA-256 hash, shared by the original_data
+    trees of all versions.
+
+    Each container (source/dataset/period) points to the blob holding its
+    latest download. The files in a version's tree are hardlinks to the
+    blobs, or reflinks/copies if the store is on another filesystem, so a
+    new version only downloads and stores the periods that changed. Files
+    are never written to in place, downloads replace them by renaming.
+
+    Parameters
+    ----------
+    root : str
+        Directory of the store, e.g. ``save_path/raw_store``
+
+    '''
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(os.path.join(root, 'blobs'), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(root, 'index.sqlite'),
+                                   check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+
+    def blob_path(self, sha256):
+        '''Return the path of the blob with the given hash.'''
+        return os.path.join(self.root, 'blobs', sha256[:2], sha256)
+
+    def add(self, filepath, sha256, **validators):
+        '''
+        Store a downloaded file and make it the content of its container.
+
+        If the store already holds the content, filepath is replaced by a
+        link to the blob, so identical files take up disk space only once.
+
+        Parameters
+        ----------
+        filepath : str
+            .../source/dataset/start_end/filename
+        sha256 : str
+            Hash of the file
+        validators : dict
+            Any of etag, last_modified, mtime as reported by the server
+
+        '''
+        blob = self.blob_path(sha256)
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            link_or_copy(filepath, blob + PARTIAL_SUFFIX)
+            os.replace(blob + PARTIAL_SUFFIX, blob)
+        elif not os.path.samefile(blob, filepath):
+            link_or_copy(blob, filepath + PARTIAL_SUFFIX)
+            os.replace(filepath + PARTIAL_SUFFIX, filepath)
+
+        container, filename = os.path.split(filepath)
+        row = [container_key(container), filename, sha256,
+               os.path.getsize(blob)]
+        row += [validators.get(k) for k in VALIDATORS]
+        row += [datetime.now().isoformat(timespec='seconds')]
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO containers VALUES ({})'.format(
+                    ', '.join('?' * len(row))), row)
+
+    def checkout(self, container):
+        '''
+        Link the stored file of a container into a version's tree.
+
+        Returns
+        ----------
+        found : tuple or None
+            (filename, sha256, validators) of the file, None if the store
+            has no file for the container.
+
+        '''
+        with self._lock:
+            row = self._db.execute(
+                'SELECT filename, sha256, {} FROM containers '
+                'WHERE container = ?'.format(', '.join(VALIDATORS)),
+                (container_key(container),)).fetchone()
+        if row is None or not os.path.exists(self.blob_path(row[1])):
+            return None
+
+        filename, sha256 = row[:2]
+        filepath = os.path.join(container, filename)
+        os.makedirs(container, exist_ok=True)
+        method = link_or_copy(self.blob_path(sha256),
+                              filepath + PARTIAL_SUFFIX)
+        os.replace(filepath + PARTIAL_SUFFIX, filepath)
+        logger.debug('%s taken from store (%s)', filepath, method)
+
+        validators = {k: v for k, v in zip(VALIDATORS, row[2:])
+                      if v is not None}
+        return filename, sha256, validators
+
+    def close(self):
+        '''Close the index.'''
+        with self._lock:
+            self._db.close()
+
+
+def container_key(container):
+    '''Return source/dataset/start_end of a container path.'''
+    return '/'.join(os.path.normpath(container).split(os.sep)[-3:])
+
+
+def link_or_copy(src, dst):
+    '''
+    Make dst a hardlink to src, or a reflink if they are on different
+    filesystems that support it, or a copy.
+
+    Returns
+    ----------
+    method : str
+        'hardlink', 'reflink' or 'copy'
+
+    '''
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+        return 'hardlink'
+    except OSError:
+        pass
+
+    try:
+        import fcntl
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return 'reflink'
+    except (ImportError, OSError):
+        shutil.copyfile(src, dst)
+        return 'copy'
@@ -0,0 +1,358 @@
+'''
+Open Power System Data
+
+Time series Datapackage
+
+cassette.py : record downloads to disk and replay them without network
+
+'''
+
+import hashlib
+import json
+import logging
+import os
+from contextlib import contextmanager
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+logger = logging.getLogger(__name__)
+logger.setLevel('DEBUG')
+
+MODES = ['record', 'replay']
+
+# Headers describing the encoding on the wire. Bodies are saved decoded, so
+# these no longer apply to them.
+WIRE_HEADERS = ['content-encoding', 'transfer-encoding', 'content-length']
+
+
+class CassetteMiss(requests.exceptions.ConnectionError):
+    '''Raised when replaying a request that was never recorded.'''
+
+
+class Cassette():
+    '''
+    Directory of recorded HTTP responses and SFTP files.
+
+    In record mode, requests go to the servers as usual and every complete
+    response is saved, body and headers, under a key made of its URL. In
+    replay mode, nothing goes over the network: the saved responses are
+    served from disk, answering conditional and range requests the way the
+    server would, and requests never recorded fail like a lost connection.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the cassette
+    mode : str, default 'replay'
+        'record' or 'replay'
+
+    '''
+
+    def __init__(self, path, mode='replay'):
+        if mode not in MODES:
+            raise ValueError('cassette mode must be one of {}, not {!r}'
+                             .format(MODES, mode))
+        self.path = path
+        self.mode = mode
+        os.makedirs(os.path.join(path, 'http'), exist_ok=True)
+        os.makedirs(os.path.join(path, 'sftp'), exist_ok=True)
+
+    @property
+    def recording(self):
+        return self.mode == 'record'
+
+    def session(self):
+        '''Return a session to pass to download_file() as session.'''
+        return CassetteSession(self)
+
+    def sftp(self, host, pool=None):
+        '''
+        Return a stand-in for the SFTPPool of host. pool is the real pool
+        to record from, it is not needed for replay.
+
+        '''
+        return CassetteSFTP(self, host, pool)
+
+    def http_path(self, url, params=None):
+        '''Return the path, without extension, of the response to a GET.'''
+        url = requests.Request('GET', url, params=params).prepare().url
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, 'http', key)
+
+    def sftp_path(self, host, path):
+        '''Return the path, without extension, of a remote file or dir.'''
+        key = hashlib.sha256(path.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, 'sftp', host, key)
+
+
+class CassetteSession():
+    '''
+    Stand-in for requests.session that records or replays the responses of
+    GET requests, as used by download.download_request().
+
+    '''
+
+    def __init__(self, cassette):
+        self.cassette = cassette
+
+    def get(self, url, params=None, headers=None, **kwargs):
+        base = self.cassette.http_path(url, params)
+        if self.cassette.recording:
+            resp = requests.get(url, params=params, headers=headers,
+                                **kwargs)
+            if resp.status_code == 200 or resp.status_code >= 400:
+                return RecordingResponse(resp, base)
+            # 206 and 304 answer what is on disk here, not the request
+            return resp
+
+        if not os.path.exists(base + '.json'):
+            raise CassetteMiss('{} was not recorded'.format(url))
+        with open(base + '.json') as f:
+            meta = json.load(f)
+        return ReplayResponse(meta, base + '.body', headers or {})
+
+    def close(self):
+        pass
+
+
+class RecordingResponse():
+    '''
+    Wrap a streamed requests.Response, saving the body as it is read. The
+    recording is only kept if the body was read to the end.
+
+    '''
+
+    def __init__(self, resp, base):
+        self._resp = resp
+        self._base = base
+        self.status_code = resp.status_code
+        self.headers = resp.headers
+        self.url = resp.url
+
+    def iter_content(self, chunk_size=1):
+        size = 0
+        with open(self._base + '.body.part', 'wb') as f:
+            for chunk in self._resp.iter_content(chunk_size):
+                f.write(chunk)
+                size += len(chunk)
+                yield chunk
+        headers = {k: v for k, v in self.headers.items()
+                   if k.lower() not in WIRE_HEADERS}
+        headers['content-length'] = str(size)
+        os.replace(self._base + '.body.part', self._base + '.body')
+        write_json(self._base + '.json', {
+            'url': self.url, 'status': self.status_code,
+            'headers': headers})
+
+    def close(self):
+        self._resp.close()
+        if self.status_code >= 400:
+            # Failures are replayed as such
+            open(self._base + '.body', 'wb').close()
+            write_json(self._base + '.json', {
+                'url': self.url, 'status': self.status_code, 'headers': {}})
+
+
+class ReplayResponse():
+    '''
+    Recorded response, as it would be answered to the headers of the request:
+    304 if the validators sent match, 206 for a range request.
+
+    '''
+
+    def __init__(self, meta, body_path, request_headers):
+        self.url = meta['url']
+        self.status_code = meta['status']
+        self.headers = CaseInsensitiveDict(meta['headers'])
+        self._body_path = body_path
+        self._offset = 0
+
+        request_headers = CaseInsensitiveDict(request_headers)
+        etag = self.headers.get('etag')
+        last_modified = self.headers.get('last-modified')
+        if self.status_code != 200:
+            return
+        if ((etag and request_headers.get('if-none-match') == etag) or
+                (last_modified and
+                 request_headers.get('if-modified-since') == last_modified)):
+            self.status_code = 304
+            return
+        range_header = request_headers.get('range', '')
+        if range_header.startswith('bytes=') and range_header.endswith('-'):
+            size = int(self.headers['content-length'])
+            self._offset = int(range_header[6:-1])
+            self.status_code = 206
+            self.headers['content-length'] = str(size - self._offset)
+            self.headers['content-range'] = 'bytes {}-{}/{}'.format(
+                self._offset, size - 1, size)
+
+    def iter_content(self, chunk_size=1):
+        if self.status_code not in (200, 206):
+            return
+        with open(self._body_path, 'rb') as f:
+            f.seek(self._offset)
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def close(self):
+        pass
+
+
+class SFTPStat():
+    '''Attributes of a recorded remote file, like paramiko.SFTPAttributes.'''
+
+    def __init__(self, filename, st_size, st_mtime):
+        self.filename = filename
+        self.st_size = st_size
+        self.st_mtime = st_mtime
+
+
+class CassetteSFTP():
+    '''
+    Stand-in for sftp_sync.SFTPPool that records or replays directory
+    listings and files.
+
+    '''
+
+    def __init__(self, cassette, host, pool=None):
+        self.cassette = cassette
+        self.host = host
+        self.pool = pool
+        os.makedirs(os.path.join(cassette.path, 'sftp', host), exist_ok=True)
+
+    def listing(self, path):
+        base = self.cassette.sftp_path(self.host, path)
+        if self.cassette.recording:
+            listing = self.pool.listing(path)
+            write_json(base + '.json', {
+                a.filename: [a.st_size, a.st_mtime]
+                for a in listing.values()})
+            return listing
+
+        if not os.path.exists(base + '.json'):
+            raise IOError('listing of {} was not recorded'.format(path))
+        with open(base + '.json') as f:
+            return {name: SFTPStat(name, *attrs)
+                    for name, attrs in json.load(f).items()}
+
+    @contextmanager
+    def client(self):
+        if self.cassette.recording:
+            with self.pool.client() as sftp:
+                yield CassetteClient(self, sftp)
+        else:
+            yield CassetteClient(self)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+
+
+class CassetteClient():
+    '''Stand-in for the paramiko.SFTPClient lent by CassetteSFTP.client().'''
+
+    def __init__(self, owner, sftp=None):
+        self.owner = owner
+        self.sftp = sftp
+
+    def _base(self, path):
+        return self.owner.cassette.sftp_path(self.owner.host, path)
+
+    def stat(self, path):
+        base = self._base(path)
+        if self.sftp is not None:
+            stat = self.sftp.stat(path)
+            write_json(base + '.json', [stat.st_size, stat.st_mtime])
+            return stat
+        if not os.path.exists(base + '.json'):
+            raise IOError('{} was not recorded'.format(path))
+        with open(base + '.json') as f:
+            return SFTPStat(os.path.basename(path), *json.load(f))
+
+    def open(self, path, mode='rb'):
+        base = self._base(path)
+        if self.sftp is not None:
+            return RecordingFile(self.sftp.open(path, mode), base)
+        if not os.path.exists(base + '.body'):
+            raise IOError('{} was not recorded'.format(path))
+        return ReplayFile(base + '.body')
+
+
+class RecordingFile():
+    '''
+    Wrap a remote paramiko.SFTPFile, saving what is read from it. Only
+    files read from the start to the end are kept.
+
+    '''
+
+    def __init__(self, remote_file, base):
+        self._remote = remote_file
+        self._base = base
+        self._out = None
+        self._done = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def seek(self, offset):
+        self._remote.seek(offset)
+        if offset == 0:
+            self._out = open(self._base + '.body.part', 'wb')
+
+    def prefetch(self, size=None):
+        self._remote.prefetch(size)
+
+    def read(self, size):
+        chunk = self._remote.read(size)
+        if self._out is not None:
+            self._out.write(chunk)
+            self._done = not chunk
+        return chunk
+
+    def close(self):
+        self._remote.close()
+        if self._out is not None:
+            self._out.close()
+            if self._done:
+                os.replace(self._base + '.body.part', self._base + '.body')
+            else:
+                os.remove(self._base + '.body.part')
+
+
+class ReplayFile():
+    '''Recorded remote file, read from disk.'''
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def seek(self, offset):
+        self._file.seek(offset)
+
+    def prefetch(self, size=None):
+        pass
+
+    def read(self, size):
+        return self._file.read(size)
+
+    def close(self):
+        self._file.close()
+
+
+def write_json(filepath, obj):
+    '''Write obj to filepath, replacing it at once.'''
+    with open(filepath + '.tmp', 'w') as f:
+        json.dump(obj, f)
+    os.replace(filepath + '.tmp', filepath)
@@ -8,6 +8,9 @@ download.py : download time series files
 '''
 
 import argparse
+import functools
+import io
+import json
 from datetime import datetime, date, time, timedelta
 import pytz
 import logging
@@ -19,14 +22,29 @@ import yaml
 from ftplib import FTP
 import math
 import sys
-from time import sleep
 import pickle
-from . import terna
+from . import planner, terna, terna_http
+from .scheduler import DownloadScheduler, host_of
+from .manifest import (DownloadManifest, http_validators,
+                       conditional_headers, if_range)
+from .sftp_sync import SFTPPool
+from .retry import RetryLater, RetryPolicy
+from .metrics import DownloadMetrics
+from .sessions import LoginSession, rejected
 import paramiko
 
 logger = logging.getLogger(__name__)
 logger.setLevel('DEBUG')
 
+# Files are downloaded under a temporary name with this suffix and renamed
+# once complete, so an interrupted download is never mistaken for a file.
+PARTIAL_SUFFIX = '.part'
+
+# The validators of the remote file a partial file comes from are saved next
+# to it with this suffix, so the rest is only appended if the file has not
+# changed in the meantime.
+VALIDATORS_SUFFIX = PARTIAL_SUFFIX + '.json'
+
 
 def download(
         sources,
@@ -36,11 +54,22 @@ def download(
         archive_version=None,
         start_from_user=None,
         end_from_user=None,
-        testmode=False):
+        testmode=False,
+        max_workers=8,
+        transport='requests',
+        dry_run=False,
+        metrics_path=None,
+        store_path=None,
+        since=None,
+        cassette_path=None,
+        cassette_mode='replay'):
     '''
     Load YAML file with sources from disk, and download all files for each
     source into the given data_path.
 
+    All files to download are planned up front, skipping those downloaded
+    before, and the largest are started first.
+
     Parameters
     ----------
     sources : dict
@@ -48,17 +77,52 @@ def download(
     data_path : str
         Base download directory in which to save all downloaded files.
     archive_version: str, default None
-        OPSD Data Package Version to download original data from.
+        OPSD Data Package Version to download original data from. Only the
+        files of the sources and period selected are extracted.
     start_from_user : datetime.date, default None
         Start of period for which to download the data.
     end_from_user : datetime.date, default None
         End of period for which to download the data.
     testmode: only download 1 file per source to check if the URLs still still
         work
+    max_workers : int, default 8
+        Maximum number of files downloaded at the same time. The number of
+        concurrent downloads per host can be limited further with
+        ``max_connections`` in sources.yml.
+    transport : str, default 'requests'
+        'requests' to download on a pool of max_workers threads, 'asyncio' to
+        keep up to max_workers downloads in flight on a single thread
+        (requires aiohttp). With 'asyncio', max_workers can be set to a few
+        hundred.
+    dry_run : bool, default False
+        Only plan the download: log the number of files and bytes per dataset
+        and return the plan, without downloading anything. The size of files
+        not downloaded before is requested from the servers.
+
+    metrics_path : str, optional
+        Directory to write the download metrics to, see
+        metrics.DownloadMetrics. Defaults to data_path.
+    store_path : str, optional
+        Directory of a raw store shared by all versions, see
+        blobstore.BlobStore. Files the store holds are linked into data_path
+        instead of being downloaded again, downloaded files are added to it.
+    since : dict, optional
+        Date to download each dataset from, by (source_name, dataset_name),
+        to update data parsed before, see incremental.last_parsed_dates().
+        The file covering that date is checked for changes, as it was still
+        growing when downloaded.
+    cassette_path : str, optional
+        Directory to record the HTTP and SFTP downloads of the planned files
+        to, or to replay them from, see cassette.Cassette. Replaying needs
+        neither network nor credentials. Always uses the 'requests'
+        transport.
+    cassette_mode : str, default 'replay'
+        'record' or 'replay'
 
     Returns
     ----------
-    None
+    plan : pandas.DataFrame or None
+        One row per file if dry_run is True, None otherwise
 
     '''
 
@@ -70,59 +134,155 @@ def download(
                            name, date, datetime.today().date())
             return
 
+    store = None
+    if store_path is not None:
+        from .blobstore import BlobStore
+        store = BlobStore(store_path)
+    manifest = DownloadManifest(os.path.join(data_path, 'manifest.sqlite'),
+                                store=store)
     if archive_version:
-        download_archive(archive_version, data_path)
+        download_archive(
+            archive_version,
+            data_path,
+            sources=sources,
+            start_from_user=start_from_user,
+            end_from_user=end_from_user,
+            max_workers=max_workers,
+            manifest=manifest)
+        manifest.close()
+        if store is not None:
+            store.close()
+        return
+
+    # Skip download where it is not implemented
+    no_download = ['Energinet.dk', 'ENTSO-E Power Statistics', 'CEPS']
+    sources = {source_name: source_dict
+               for source_name, source_dict in sources.items()
+               if source_name not in no_download}
+
+    jobs = []
+    for source_name, source_dict in sources.items():
+        jobs += planner.plan_source(
+            source_name,
+            source_dict,
+            data_path,
+            start_from_user,
+            end_from_user,
+            testmode=testmode,
+            manifest=manifest,
+            since=since)
+    jobs = planner.prioritize(planner.coalesce(
+        planner.deduplicate(jobs, manifest), data_path))
+
+    if dry_run:
+        sftp = {}
+        for job in jobs:
+            if job.sftp and job.pending and job.source_name not in sftp and \
+                    job.source_name in auth:
+                sftp[job.source_name] = sftp_pool(job, auth[job.source_name])
+        planner.estimate_sizes(jobs, sftp, max_workers=max_workers)
+        for pool in sftp.values():
+            pool.close()
+        manifest.close()
+        if store is not None:
+            store.close()
+        jobs = planner.prioritize(jobs)
+        planner.log_plan(jobs)
+        return planner.plan_frame(jobs)
+
+    planner.log_plan(jobs)
+    metrics = DownloadMetrics(metrics_path or data_path)
+    cassette = None
+    if cassette_path is not None:
+        from .cassette import Cassette
+        cassette = Cassette(cassette_path, cassette_mode)
+        transport = 'requests'
+    if transport == 'asyncio':
+        from .async_download import AsyncScheduler
+        scheduler = AsyncScheduler(max_workers=max_workers)
     else:
-        for source_name, source_dict in sources.items():
-            # Skip download where it is not implemented
-            no_download = ['Energinet.dk', 'ENTSO-E Power Statistics', 'CEPS']
-            if source_name in no_download:
-                continue
-
-            if source_name in auth.keys():
-                source_auth = auth[source_name]
-            else:
-                source_auth = None
+        scheduler = DownloadScheduler(max_workers=max_workers)
 
-            download_source(
-                source_name,
-                source_dict,
-                data_path,
-                input_path,
-                source_auth,
-                start_from_user,
-                end_from_user,
-                testmode=testmode)
+    submit_jobs(jobs, data_path, auth, scheduler, manifest, metrics,
+                cassette)
+
+    # Scraped datasets only know their files once the links are extracted,
+    # they are downloaded while the planned files are under way
+    for source_name, source_dict in sources.items():
+        download_scraped(source_name, source_dict, data_path, input_path,
+                         start_from_user, end_from_user, manifest, metrics,
+                         since)
+
+    scheduler.close()
+    metrics.close()
+    manifest.close()
+    if store is not None:
+        store.close()
 
     return
 
 
-def download_archive(archive_version, data_path):
+def download_archive(
+        archive_version,
+        data_path,
+        sources=None,
+        start_from_user=None,
+        end_from_user=None,
+        max_workers=8,
+        manifest=None):
     '''
-    Download archived data from the OPSD server. See download()
-    for info on parameters.
+    Extract the files of the selected sources and period from the archived
+    data on the OPSD server. See download() for info on parameters.
+
+    If the server supports range requests, only the central directory and
+    the members needed are fetched. Otherwise the whole archive is
+    downloaded once and kept as data_path/original_data.zip.
 
     '''
+    from .archive import RemoteFile, extract_archive
 
     filepath = os.path.join(data_path, 'original_data.zip')
+    url = ('http://data.open-power-system-data.org/time_series/'
+           '{}/original_data/original_data.zip'.format(archive_version))
 
+    remote = None
     if not os.path.exists(filepath):
-        url = ('http://data.open-power-system-data.org/time_series/'
-               '{}/original_data/original_data.zip'.format(archive_version))
-        logger.info('Downloading and extracting archived data from %s', url)
-        resp = requests.get(url)
-        with open(filepath, 'wb') as output_file:
-            for chunk in resp.iter_content(1024):
-                output_file.write(chunk)
+        remote = RemoteFile.open(url)
+
+    if remote is not None:
+        logger.info('Extracting archived data from %s', url)
+        directory = []
 
-        myzipfile = zipfile.ZipFile(filepath)
-        myzipfile.extractall(data_path)
-        logger.info('Extracted data to {}'.format(data_path))
+        def archive():
+            # The parts the first file fetches to read the central directory
+            # are kept, the others read it from memory
+            raw = RemoteFile(remote.url, remote.size, chunks=directory,
+                             keep=not directory)
+            return io.BufferedReader(raw, buffer_size=1 << 20)
 
     else:
-        logger.warning(
-            '%s already exists. Delete it if you want to download again',
-            filepath)
+        if not os.path.exists(filepath):
+            logger.info('Downloading archived data from %s', url)
+            os.makedirs(data_path, exist_ok=True)
+            resp = requests.get(url, stream=True)
+            with open(filepath + PARTIAL_SUFFIX, 'wb') as output_file:
+                for chunk in resp.iter_content(65536):
+                    output_file.write(chunk)
+            os.replace(filepath + PARTIAL_SUFFIX, filepath)
+
+        logger.info('Extracting archived data from %s', filepath)
+        def archive():
+            return open(filepath, 'rb')
+
+    extract_archive(
+        archive,
+        data_path,
+        sources=sources,
+        start_from_user=start_from_user,
+        end_from_user=end_from_user,
+        max_workers=max_workers,
+        manifest=manifest,
+        archived=datetime.strptime(archive_version, '%Y-%m-%d'))
 
     return
 
@@ -135,7 +295,10 @@ def download_source(
         source_auth,
         start_from_user=None,
         end_from_user=None,
-        testmode=False):
+        testmode=False,
+        scheduler=None,
+        manifest=None,
+        metrics=None):
     '''
     Download all files for source_name as specified by the given
     source_dict into data_path.
@@ -152,6 +315,14 @@ def download_source(
         Start of period for which to download the data. 
     end_from_user : datetime.date, default None
         End of period for which to download the data
+    scheduler : DownloadScheduler, optional
+        Pool to run the downloads on. If not given, the files are downloaded
+        one after another before returning.
+    manifest : DownloadManifest, optional
+        Validators of previous downloads. If given, files for periods that
+        have not ended yet are re-checked and downloaded again if changed.
+    metrics : DownloadMetrics, optional
+        Where to record bytes and timings of each download.
 
     Returns
     ----------
@@ -159,175 +330,197 @@ def download_source(
 
     '''
 
-    session = None
+    own_scheduler = scheduler is None
+    if own_scheduler:
+        scheduler = DownloadScheduler(max_workers=1)
 
-    for dataset_name, param_dict in source_dict.items():
-        # Set up the filename structure
-        if 'filename' in param_dict:
-            filename = param_dict['filename']
-        else:
-            filename = None
-
-        # Determine time range to be downloaded.
-        # Start with everything from first to last datapoint on server
-        start_server = param_dict['start']
-        end_server = param_dict['end']
-        if end_server == 'recent':
-            end_server = datetime.now().date()
-        # narrow down the time range if specified by user
-        if start_from_user:
-            if start_from_user <= start_server:
-                pass  # do nothing
-            elif start_server < start_from_user < end_server:
-                start_server = start_from_user  # replace start_server
-            else:
-                continue
-                # skip this dataset from the source dict, e.g. in Sweden
-
-        if end_from_user:
-            if end_from_user <= start_server:
-                continue
-                # skip this dataset from the source dict, e.g. in Sweden
-            elif start_server < end_from_user < end_server:
-                end_server = end_from_user  # replace  end_server
+    jobs = planner.plan_source(
+        source_name,
+        source_dict,
+        data_path,
+        start_from_user,
+        end_from_user,
+        testmode=testmode,
+        manifest=manifest)
+    jobs = planner.prioritize(planner.coalesce(
+        planner.deduplicate(jobs, manifest), data_path))
+    submit_jobs(jobs, data_path, {source_name: source_auth}, scheduler,
+                manifest, metrics)
+
+    download_scraped(source_name, source_dict, data_path, input_path,
+                     start_from_user, end_from_user, manifest, metrics)
+
+    if own_scheduler:
+        scheduler.close()
+
+    return
+
+
+def submit_jobs(jobs, data_path, auth, scheduler, manifest=None,
+                metrics=None, cassette=None, on_done=None):
+    '''
+    Submit the planned jobs to the scheduler in the order given, leaving out
+    files downloaded before that need no re-check.
+
+    SFTP connections are shared between all datasets of a source. The
+    Elexon login is only done once an Elexon file is actually downloaded,
+    and its cookies are saved to ``data_path/elexon_cookies.json`` to be
+    reused by later runs.
+
+    Parameters
+    ----------
+    jobs : list
+        DownloadJob, as returned by planner.plan_source()
+    auth : dict
+        Credentials by source_name
+    cassette : cassette.Cassette, optional
+        Where to record the downloads to or replay them from. No login is
+        done for replay.
+    on_done : callable, optional
+        Called with the DownloadJob once its download has finished or
+        failed, from the worker thread. Not called for attempts that are
+        tried again later.
+
+    '''
+    sftp = {}
+    cookies = {}
+    replay = cassette is not None and not cassette.recording
+    # Without a cassette, each job runs with the session of its worker
+    session = {}
+    for job in jobs:
+        if not job.pending:
+            continue
+
+        source_auth = auth.get(job.source_name)
+        if job.sftp and job.source_name not in sftp:
+            if cassette is None:
+                sftp[job.source_name] = sftp_pool(job, source_auth)
             else:
-                pass  # do nothing
+                sftp[job.source_name] = cassette.sftp(
+                    job.param_dict['host'],
+                    None if replay else sftp_pool(job, source_auth))
+            # Close the connections once all queued files are fetched
+            scheduler.on_close(sftp[job.source_name].close)
+        if (job.source_name == 'Elexon' and 'Elexon' not in cookies and
+                not replay):
+            cookies['Elexon'] = LoginSession(
+                'Elexon',
+                lambda source_auth=source_auth: elexon_cookies(source_auth),
+                os.path.join(data_path, 'elexon_cookies.json'))
+        if cassette is not None:
+            session['session'] = cassette.session()
+
+        task = download_file
+        if on_done is not None:
+            task = functools.partial(report_done, on_done, job)
+        scheduler.submit(
+            task,
+            job.source_name,
+            job.dataset_name,
+            data_path,
+            job.param_dict,
+            start=job.start,
+            end=job.end,
+            url=job.url,
+            url_params_template=job.url_params_template,
+            filename=job.filename,
+            cookies=cookies.get(job.source_name),
+            sftp=sftp.get(job.source_name),
+            manifest=manifest,
+            metrics=metrics,
+            refresh=job.refresh and job.exists,
+            host=job.host,
+            host_limit=job.host_limit,
+            **session
+        )
 
-        if 'method' in param_dict and param_dict['method'] == 'scrape':
-            # In this case, the data have to be scraped from the website in a
-            # source-specific way.
-            downloaded = download_with_driver(
-                source_name,
-                dataset_name,
-                data_path,
-                input_path,
-                param_dict,
-                start=start_server,
-                end=end_server,
-                filename=filename
-            )
+    return
 
-        elif param_dict['frequency'] == 'single file':
-            # In these two cases, all data is housed in one file on the server
-            downloaded, session = download_file(
-                source_name,
-                dataset_name,
-                data_path,
-                param_dict,
-                start=start_server,
-                end=end_server,
-                url=param_dict['url_template'],
-                url_params_template=param_dict['url_params_template'],
-                filename=filename
-            )
 
-        elif param_dict['frequency'] == 'file list':
-            # Log into the Elexon website to obtain cookies to download files
-            jar = None
-            if source_name == 'Elexon':
-                from selenium import webdriver
-                from selenium.webdriver.common.keys import Keys
-
-                driver = webdriver.Chrome(
-                    executable_path='./chromedriver/chromedriver')
-                driver.get("https://www.elexonportal.co.uk")
-                u = driver.find_element_by_id('pf_control_pf_username')
-                p = driver.find_element_by_id('pf_control_pf_password')
-                u.send_keys(source_auth['username'])
-                p.send_keys(source_auth['password'])
-                p.send_keys(Keys.RETURN)
-                jar = requests.cookies.RequestsCookieJar()
-                for cookie in driver.get_cookies():
-                    jar.set(cookie['name'], cookie['value'],
-                            domain=cookie['domain'], path=cookie['path'])
-                driver.quit()
-
-            for file in param_dict['files']:
-                downloaded, session = download_file(
-                    source_name,
-                    dataset_name,
-                    data_path,
-                    param_dict,
-                    start=file['start'],
-                    end=file['end'],
-                    url=file['url'],
-                    filename=filename,
-                    cookies=jar
-                )
-        else:
-            # In all other cases, the files on the servers usually contain the
-            # data for subperiods of some regular length (i.e. months or years)
-            # Create lists of start- and enddates of periods represented in
-            # individual files to be downloaded.
-
-            # tranlate frequency to argument for pd.date_range()
-            freq_start = {'yearly': 'AS', 'quarterly': 'QS',
-                          'monthly': 'MS', 'daily': 'D'}
-            freq_end = {'yearly': 'A', 'quarterly': 'Q',
-                        'monthly': 'M', 'daily': 'D'}
-
-            starts = pd.date_range(
-                start=start_server, end=end_server,
-                freq=freq_start[param_dict['frequency']]
-            )
+def report_done(on_done, job, *args, **kwargs):
+    '''Run download_file() and pass job to on_done once it is over.'''
+    try:
+        result = download_file(*args, **kwargs)
+    except RetryLater:
+        raise
+    except Exception:
+        on_done(job)
+        raise
+    on_done(job)
+    return result
 
-            ends = pd.date_range(
-                start=start_server, end=end_server,
-                freq=freq_end[param_dict['frequency']]
-            )
 
-            if len(starts) == 0:
-                starts = pd.DatetimeIndex([start_server])
-            if len(ends) == 0:
-                ends = pd.DatetimeIndex([end_server])
+def sftp_pool(job, source_auth):
+    '''Open a pool of SFTP connections to the server of job.'''
+    return SFTPPool(job.param_dict['host'], job.param_dict['port'],
+                    source_auth['username'], source_auth['password'],
+                    size=job.host_limit or 1)
 
-            if starts[0].date() > start_server:
-                # make sure to include full first period, i.e. if start_server
-                # is 2014-12-14, set first start to 2014-01-01
-                starts = starts.union([starts[0] - 1 * starts.freq])
 
-            if ends[-1].date() < end_server:
-                # make sure to include full last period, i.e. if end_server
-                # is 2018-01-14, set last end to 2018-01-31
-                ends = ends.union([ends[-1] + 1 * ends.freq])
+def elexon_cookies(source_auth):
+    '''
+    Log into the Elexon website to obtain cookies to download files.
 
-            # else:
-            #    # extend both by one period to load a little more data than the user asked for.
-            #    # Reasoning: The last hour of the year in UTC is already the first hour of the new year in CET
-            #    starts = starts.union([starts[-1] + 1])
-            #    ends = ends.union([ends[-1] + 1])
+    '''
+    from selenium import webdriver
+    from selenium.webdriver.common.keys import Keys
+
+    driver = webdriver.Chrome(executable_path='./chromedriver/chromedriver')
+    driver.get("https://www.elexonportal.co.uk")
+    u = driver.find_element_by_id('pf_control_pf_username')
+    p = driver.find_element_by_id('pf_control_pf_password')
+    u.send_keys(source_auth['username'])
+    p.send_keys(source_auth['password'])
+    p.send_keys(Keys.RETURN)
+    jar = requests.cookies.RequestsCookieJar()
+    for cookie in driver.get_cookies():
+        jar.set(cookie['name'], cookie['value'],
+                domain=cookie['domain'], path=cookie['path'],
+                expires=cookie.get('expiry'))
+    driver.quit()
+
+    return jar
+
+
+def download_scraped(
+        source_name,
+        source_dict,
+        data_path,
+        input_path,
+        start_from_user=None,
+        end_from_user=None,
+        manifest=None,
+        metrics=None,
+        since=None):
+    '''
+    Download the datasets of source_name that have to be scraped from the
+    website in a source-specific way. See download_source() and download()
+    for info on parameters.
 
-            if source_name == 'ENTSO-E Transparency FTP':
-                transport = paramiko.Transport(
-                    param_dict['host'], param_dict['port'])
-                transport.connect(username=source_auth['username'],
-                                  password=source_auth['password'])
-                sftp = paramiko.SFTPClient.from_transport(transport)
-                param_dict['url_template'] = None
-                param_dict['url_params_template'] = None
+    '''
+    for dataset_name, param_dict in source_dict.items():
+        if param_dict.get('method') != 'scrape':
+            continue
 
-            else:
-                sftp = None
+        period = planner.dataset_period(
+            param_dict, start_from_user, end_from_user,
+            (since or {}).get((source_name, dataset_name)))
+        if period is None:
+            continue
 
-            for s, e in zip(starts, ends):
-                downloaded, session = download_file(
-                    source_name,
-                    dataset_name,
-                    data_path,
-                    param_dict,
-                    start=s,
-                    end=e,
-                    url=param_dict['url_template'],
-                    url_params_template=param_dict['url_params_template'],
-                    filename=filename,
-                    session=session,
-                    sftp=sftp
-                )
-                if testmode:
-                    break
+        download_with_driver(
+            source_name,
+            dataset_name,
+            data_path,
+            input_path,
+            param_dict,
+            start=period[0],
+            end=period[1],
+            filename=param_dict.get('filename'),
+            manifest=manifest,
+            metrics=metrics
+        )
 
-            if source_name == 'ENTSO-E Transarency FTP':
-                sftp.close()
     return
 
 
@@ -339,7 +532,9 @@ def download_with_driver(
         param_dict,
         start,
         end,
-        filename=None):
+        filename=None,
+        manifest=None,
+        metrics=None):
     '''
     Decide which scraping function should download the data.
 
@@ -360,16 +555,21 @@ def download_with_driver(
         end of data in the file
     filename : str, default None
         pattern of filename to use if it can not be retrieved from server
+    manifest : DownloadManifest, optional
+        Where to look up and record the downloaded files.
+    metrics : DownloadMetrics, optional
+        Where to record bytes and timings of each download.
 
     Returns
     ----------
-    downloaded: bool
-        True if all the files were downloaded, False otherwise
+    None
 
     '''
 
     if source_name == 'Terna':
-        return download_Terna(dataset_name, data_path, input_path, param_dict, start, end, filename)
+        return download_Terna(dataset_name, data_path, input_path, param_dict,
+                              start, end, filename, manifest=manifest,
+                              metrics=metrics)
 
 
 def download_Terna(
@@ -379,9 +579,11 @@ def download_Terna(
         param_dict,
         start,
         end,
-        filename):
+        filename,
+        manifest=None,
+        metrics=None):
     '''
-    Download the files from the Tera page one by one
+    Download the files from the Tera page
 
     Extract the links from the database of recorded links.
     If that does not cover the paeriod [start, end],
@@ -402,6 +604,10 @@ def download_Terna(
         end of data in the file
     filename : str, default None
         pattern of filename to use if it can not be retrieved from server
+    manifest : DownloadManifest, optional
+        Where to look up and record the downloaded files.
+    metrics : DownloadMetrics, optional
+        Where to record bytes and timings of each download.
 
     Returns
     ----------
@@ -425,8 +631,18 @@ def download_Terna(
     if extract_new:
         # and such links do exist
         if start <= end:
-            # extract them from the Terna's web page
-            extracted_date_url_dictionary = terna.extract_urls(start, end)
+            # extract them from the Terna's web page, falling back to the
+            # browser if the search form can not be posted directly
+            try:
+                extracted_date_url_dictionary = terna_http.extract_urls(
+                    start, end)
+            except (requests.exceptions.RequestException, KeyError,
+                    ValueError) as e:
+                logger.warning('Terna links could not be extracted without '
+                               'a browser: %r', e)
+                extracted_date_url_dictionary = {}
+            if not extracted_date_url_dictionary:
+                extracted_date_url_dictionary = terna.extract_urls(start, end)
             # and add them to the dictionary of recorded links
             date_url_dictionary.update(extracted_date_url_dictionary)
             # update the file holding the recorded URLs
@@ -443,26 +659,100 @@ def download_Terna(
                       date_format='%Y-%m-%d')
 
     # Now, download the files from the links
-    session = None
-    for date_key in date_url_dictionary:
-        url = date_url_dictionary[date_key]
-        year, month, day = date_key
-        the_date = date(year=year, month=month, day=day)
-        downloaded, session = download_file(
-            'Terna',
-            dataset_name,
-            data_path,
-            param_dict,
-            the_date,
-            the_date,
-            url=date_url_dictionary[date_key],
-            filename=filename,
-            session=session
-        )
+    fetch_terna_files(
+        dataset_name,
+        data_path,
+        param_dict,
+        date_url_dictionary,
+        filename,
+        manifest=manifest,
+        metrics=metrics)
 
     return
 
 
+def fetch_terna_files(
+        dataset_name,
+        data_path,
+        param_dict,
+        date_url_dictionary,
+        filename,
+        manifest=None,
+        metrics=None):
+    '''
+    Download the daily Terna files in parallel.
+
+    The files are small, so most of the time is spent waiting for the
+    server: up to ``max_connections`` files (default 8) are requested at the
+    same time, each worker reusing its connection. Dates whose file could
+    not be downloaded are tried again in a second pass once all others are
+    done. Those still missing are written to
+    ``data_path/Terna/<dataset_name>_failed_dates.csv``. As files downloaded
+    before are skipped, running the download again only fetches those.
+
+    Parameters
+    ----------
+    date_url_dictionary : dict
+        Maps (year, month, day) to the URL of the file for that day, as
+        returned by terna.read_recorded()
+
+    See download_Terna() for info on the other parameters.
+
+    Returns
+    ----------
+    failed : list
+        datetime.date of the days whose file could not be downloaded
+
+    '''
+    urls = {date(*k): url for k, url in date_url_dictionary.items()}
+    limit = param_dict.get('max_connections') or 8
+
+    pending = sorted(urls)
+    for pass_name in ['first pass', 'retry pass']:
+        if not pending:
+            break
+        scheduler = DownloadScheduler(max_workers=limit,
+                                      default_host_limit=limit)
+        for the_date in pending:
+            scheduler.submit(
+                download_file,
+                'Terna',
+                dataset_name,
+                data_path,
+                param_dict,
+                the_date,
+                the_date,
+                url=urls[the_date],
+                filename=filename,
+                manifest=manifest,
+                metrics=metrics,
+                host=host_of(urls[the_date]),
+                host_limit=limit
+            )
+        if scheduler.close() == 0:
+            pending = []
+        else:
+            pending = [d for d in pending if not container_files(
+                file_container(data_path, 'Terna', dataset_name, d, d),
+                manifest)]
+        logger.info('Terna | %s | %s: %s files missing',
+                    dataset_name, pass_name, len(pending))
+
+    failed_path = os.path.join(data_path, 'Terna',
+                               dataset_name + '_failed_dates.csv')
+    if pending:
+        failed = pd.DataFrame({'url': [urls[d] for d in pending]},
+                              index=pd.Index(pending, name='date'))
+        os.makedirs(os.path.dirname(failed_path), exist_ok=True)
+        failed.to_csv(failed_path, date_format='%Y-%m-%d')
+        logger.warning('Terna | %s | dates that failed saved to %s',
+                       dataset_name, failed_path)
+    elif os.path.exists(failed_path):
+        os.remove(failed_path)
+
+    return pending
+
+
 def download_file(
         source_name,
         dataset_name,
@@ -475,7 +765,11 @@ def download_file(
         filename=None,
         session=None,
         cookies=None,
-        sftp=None):
+        sftp=None,
+        manifest=None,
+        metrics=None,
+        refresh=False,
+        attempt=1):
     '''
     Prepare the Download of a single file.
     Make a directory to save the file to and check if it might have been
@@ -499,6 +793,17 @@ def download_file(
         pattern of filename to use if it can not be retrieved from server
     session : requests.session, optional
         If not given, a new session is created.
+    manifest : DownloadManifest, optional
+        Where to look up whether the file was downloaded before and to record
+        it once downloaded.
+    metrics : DownloadMetrics, optional
+        Where to record bytes and timings of the download.
+    refresh : bool, default False
+        If True, download the file again if the server reports that it has
+        changed since the last download.
+    attempt : int, default 1
+        Number of this attempt to download the file. If it fails and the
+        dataset's retry policy allows another one, RetryLater is raised.
 
     Returns
     ----------
@@ -510,51 +815,71 @@ def download_file(
     if session is None:
         session = requests.session()
 
-    message = '| {:20.20} | {:20.20} | {:%Y-%m-%d} | {:%Y-%m-%d} | '.format(
-        source_name, dataset_name, start, end)
-
-    # Each file will be saved in a folder of its own, this allows us to preserve
-    # the original filename when saving to disk.
-    container = os.path.join(data_path, source_name, dataset_name,
-                             start.strftime('%Y-%m-%d') + '_' +
-                             end.strftime('%Y-%m-%d'))
-    os.makedirs(container, exist_ok=True)
-
-    # Belgian TSO Elia requires start/end with time in UTC format
-    if source_name == 'Elia':
-        start = (pytz.timezone('Europe/Brussels')
-                 .localize(datetime.combine(start, time()))
-                 .astimezone(pytz.timezone('UTC')))
-
-        end = (pytz.timezone('Europe/Brussels')
-               .localize(datetime.combine(end + timedelta(days=1), time()))
-               .astimezone(pytz.timezone('UTC')))
-
-    # Attempt the download if there is no file yet.
-    count_files = len(os.listdir(container))
-    if count_files == 0:
-        if source_name == 'ENTSO-E Transparency FTP':
-            filename = filename.format(u_start=start, u_end=end)
-            filepath = os.path.join(container, filename)
-            try:
-                sftp.get(param_dict['path'] + filename, filepath)
-                downloaded = True
-            except SSHException:
-                donwloaded = False
+    message = log_prefix(source_name, dataset_name, start, end)
+    container = file_container(data_path, source_name, dataset_name,
+                               start, end)
+    start, end = server_period(source_name, start, end)
+
+    # Attempt the download if there is no file yet, or check for a newer
+    # version of the file if it is to be refreshed
+    count_files = len(container_files(container, manifest))
+    if count_files == 0 or (count_files == 1 and refresh):
+        transfer = None
+        if metrics is not None:
+            transfer = metrics.start(
+                container, host_of(url) or param_dict.get('host'), attempt)
+
+        # The attempt is recorded even if it raises, e.g. RetryLater to be
+        # repeated by the scheduler
+        downloaded, outcome = False, None
+        try:
+            if source_name == 'ENTSO-E Transparency FTP':
+                filename = filename.format(u_start=start, u_end=end)
+                retry_policy = RetryPolicy.from_params(param_dict)
+                try:
+                    stat = sftp.listing(param_dict['path']).get(filename)
+                    with sftp.client() as client:
+                        downloaded = download_sftp(
+                            client,
+                            param_dict['path'],
+                            filename,
+                            container,
+                            manifest=manifest,
+                            stat=stat,
+                            transfer=transfer,
+                            retry_policy=retry_policy,
+                            attempt=attempt)
+                except (IOError, paramiko.SSHException) as e:
+                    # Connecting or listing the directory failed
+                    retry_policy.check(attempt, error=e)
+                    logger.warning('SFTP connection to %s failed: %s',
+                                   param_dict.get('host'), e)
 
-        else:
-            downloaded, session = download_request(
-                source_name,
-                start,
-                end,
-                session,
-                filename,
-                container,
-                url_template=url,
-                url_params_template=url_params_template,
-                cookies=cookies)
-
-        if downloaded:
+            else:
+                downloaded, session = download_request(
+                    source_name,
+                    start,
+                    end,
+                    session,
+                    filename,
+                    container,
+                    url_template=url,
+                    url_params_template=url_params_template,
+                    cookies=cookies,
+                    manifest=manifest,
+                    retry_policy=RetryPolicy.from_params(param_dict),
+                    attempt=attempt,
+                    transfer=transfer)
+        except RetryLater:
+            outcome = 'retry'
+            raise
+        finally:
+            if metrics is not None:
+                metrics.finish(transfer, downloaded, outcome)
+
+        if downloaded and count_files == 1:
+            logger.info(message + 'checked for update')
+        elif downloaded:
             logger.info(message + 'download successful')
         else:
             logger.info(message + 'download failed')
@@ -572,38 +897,367 @@ def download_file(
     return downloaded, session
 
 
-def download_request(
-        source_name,
-        start,
-        end,
-        session,
-        filename,
-        container,
-        url_template,
-        url_params_template=None,
-        cookies=None):
+def list_container(container):
     '''
-    Download a single file via HTTP get.
-    Build the url from parameters and save the file to disk under it's original
-    filename 
+    List the complete files in a container, leaving out interrupted
+    downloads. Returns [] if the container does not exist.
+
+    '''
+    if not os.path.isdir(container):
+        return []
+    return [f for f in os.listdir(container)
+            if not f.endswith((PARTIAL_SUFFIX, VALIDATORS_SUFFIX))]
+
+
+def container_files(container, manifest=None):
+    '''
+    List the complete files in a container, looking them up in the manifest
+    if possible. Files found on disk but missing from the manifest, e.g.
+    those downloaded before it existed, are added to it, and rows of files
+    deleted since are dropped from it. If there is no file, it is taken from
+    the manifest's store, if that holds one.
+
+    '''
+    if manifest is not None:
+        filename = manifest.lookup(container)
+        if filename is not None:
+            if os.path.isfile(os.path.join(container, filename)):
+                return [filename]
+            logger.info('%s no longer in %s, dropped from the manifest',
+                        filename, container)
+            manifest.forget(container)
+
+    files = list_container(container)
+    if manifest is not None and len(files) == 1:
+        manifest.record(os.path.join(container, files[0]))
+    elif manifest is not None and not files:
+        filename = manifest.checkout(container)
+        if filename is not None:
+            return [filename]
+
+    return files
+
+
+def partial_download(container):
+    '''
+    Find an interrupted download in a container.
+
+    Returns
+    ----------
+    partial : str or None
+        Path of the partial file, None if there is none.
+    offset : int
+        Number of bytes downloaded so far.
+
+    '''
+    if not os.path.isdir(container):
+        return None, 0
+    for f in os.listdir(container):
+        if f.endswith(PARTIAL_SUFFIX):
+            partial = os.path.join(container, f)
+            return partial, os.path.getsize(partial)
+
+    return None, 0
+
+
+def resume_target(container, name, partial, status, encoded=False,
+                  validators=None):
+    '''
+    Return the temporary path to save a response to and the mode to open it
+    with. The response is appended to the partial file only if the server
+    answered the range request (HTTP 206) for the same version of the same
+    file.
+
+    A range that can not be appended, because the server now names the file
+    differently, sent it compressed or the file has changed since the
+    partial file was saved, must not be saved as a file of its own either.
+    The partial file is then dropped and the mode is None: the request has
+    to be repeated without a range.
 
     Parameters
     ----------
+    validators : dict, optional
+        Validators of the remote file as sent now, e.g. etag and
+        last_modified, or size and mtime over SFTP. They are compared with
+        those saved with the partial file, and saved with a new one.
+
+    '''
+    os.makedirs(container, exist_ok=True)
+    part = os.path.join(container, name + PARTIAL_SUFFIX)
+    validators = validators or {}
+    if partial and (partial != part or (status == 206 and encoded) or
+                    not same_version(partial, validators)):
+        # Start over
+        drop_partial(partial)
+        partial = None
+    if status == 206:
+        return part, 'ab' if partial else None
+
+    with open(part[:-len(PARTIAL_SUFFIX)] + VALIDATORS_SUFFIX, 'w') as f:
+        json.dump(validators, f)
+    return part, 'wb'
+
+
+def partial_validators(partial):
+    '''
+    Return the validators of the remote file saved with a partial file, {}
+    if there are none.
+
+    '''
+    try:
+        with open(partial[:-len(PARTIAL_SUFFIX)] + VALIDATORS_SUFFIX) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def same_version(partial, validators):
+    '''
+    Return True if the partial file was downloaded from the version of the
+    remote file described by validators. Without validators in common, this
+    can not be told and False is returned.
+
+    '''
+    saved = partial_validators(partial)
+    common = [k for k, v in saved.items()
+              if v is not None and validators.get(k) is not None]
+    return bool(common) and all(saved[k] == validators[k] for k in common)
+
+
+def drop_partial(partial):
+    '''Remove a partial file and the validators saved with it.'''
+    for path in [partial,
+                 partial[:-len(PARTIAL_SUFFIX)] + VALIDATORS_SUFFIX]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def expected_size(status, headers):
+    '''
+    Return the full size of a file in bytes as announced by the server or
+    None if it is unknown, e.g. for compressed transfers.
+
+    '''
+    if 'content-encoding' in headers:
+        return None
+    if status == 206 and 'content-range' in headers:
+        total = headers['content-range'].split('/')[-1]
+        return int(total) if total.isdigit() else None
+    if 'content-length' in headers:
+        return int(headers['content-length'])
+
+    return None
+
+
+def finish_download(part, size=None):
+    '''
+    Atomically rename a completed partial file to its final name, replacing
+    the previous version of the file in the container, if any.
+
+    Parameters
+    ----------
+    part : str
+        Path of the partial file
+    size : int, optional
+        Expected size of the complete file. If it does not match, the partial
+        file is kept for resuming later.
+
+    Returns
+    ----------
+    filepath : str or None
+        Final path of the file if it is complete, None otherwise.
+
+    '''
+    if size is not None and os.path.getsize(part) != size:
+        logger.warning('%s incomplete: %s of %s bytes, will resume next run',
+                       part, os.path.getsize(part), size)
+        return None
+    filepath = part[:-len(PARTIAL_SUFFIX)]
+    os.replace(part, filepath)
+    if os.path.exists(filepath + VALIDATORS_SUFFIX):
+        os.remove(filepath + VALIDATORS_SUFFIX)
+
+    # The server may have changed the filename of a refreshed file
+    container, name = os.path.split(filepath)
+    for f in list_container(container):
+        if f != name:
+            os.remove(os.path.join(container, f))
+
+    return filepath
+
+
+def download_sftp(sftp, path, filename, container, manifest=None,
+                  stat=None, transfer=None, retry_policy=None, attempt=1):
+    '''
+    Download a single file via SFTP, resuming at the offset of an interrupted
+    earlier download of the same file. If the container already holds the
+    file, it is only downloaded again if size or mtime on the server differ
+    from those recorded in the manifest.
+
+    Parameters
+    ----------
+    sftp : paramiko.SFTPClient
+        Connected client
+    path : str
+        Remote directory
+    filename : str
+        Name of the file in the remote directory
     container : str
         unique filepath for the file to be saved
-    url_template : 
-        stem of URL 
-    url_params_template : dict
-        dict of parameter names and values to paste into URL
+    manifest : DownloadManifest, optional
+        Where to look up and record size and mtime of the file
+    stat : paramiko.SFTPAttributes, optional
+        Attributes of the remote file from a directory listing. If not given,
+        they are requested from the server.
+    transfer : metrics.Transfer, optional
+        Where to count the bytes received
+    retry_policy : RetryPolicy, optional
+        Decides whether a failed attempt is worth repeating, by raising
+        RetryLater. If not given, the download is attempted only once.
+    attempt : int, default 1
+        Number of this attempt
 
     Returns
     ----------
     downloaded : bool
         True if download successful, False otherwise.
-    session : requests.session
 
     '''
-    url_params = {}  # A dict for URL-parameters
+    if retry_policy is None:
+        retry_policy = RetryPolicy(attempts=1)
+    try:
+        if stat is None:
+            stat = sftp.stat(path + filename)
+    except FileNotFoundError as e:
+        logger.warning('SFTP stat of %s failed: %s', filename, e)
+        return False
+    except (IOError, paramiko.SSHException) as e:
+        retry_policy.check(attempt, error=e)
+        logger.warning('SFTP stat of %s failed: %s', filename, e)
+        return False
+    validators = {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    if manifest is not None and manifest.lookup(container) == filename:
+        recorded = manifest.get(container)
+        if 'mtime' not in recorded and recorded['size'] == stat.st_size:
+            # Downloaded before the manifest existed, adopt the local file
+            manifest.record(os.path.join(container, filename), **validators)
+            recorded = validators
+        if all(recorded.get(k) == v for k, v in validators.items()):
+            logger.debug('%s unchanged on server', filename)
+            manifest.confirm(container)
+            return True
+
+    # A partial file is only continued if size and mtime on the server are
+    # still those of the file it was downloaded from
+    partial, offset = partial_download(container)
+    part, mode = resume_target(container, filename, partial,
+                               206 if offset else 200, validators=validators)
+    if mode is None:
+        part, mode = resume_target(container, filename, None, 200,
+                                   validators=validators)
+    if mode == 'wb':
+        offset = 0
+    try:
+        with sftp.open(path + filename, 'rb') as remote_file, \
+                open(part, mode) as output_file:
+            remote_file.seek(offset)
+            remote_file.prefetch(stat.st_size)
+            while True:
+                chunk = remote_file.read(32768)
+                if not chunk:
+                    break
+                output_file.write(chunk)
+                if transfer is not None:
+                    transfer.first_byte()
+                    transfer.add(len(chunk))
+    except (IOError, paramiko.SSHException) as e:
+        # The part downloaded so far is continued by the next attempt
+        retry_policy.check(attempt, error=e)
+        logger.warning('SFTP download of %s failed: %s', filename, e)
+        return False
+
+    filepath = finish_download(part, stat.st_size)
+    if filepath and manifest is not None:
+        manifest.record(filepath, **validators)
+
+    return filepath is not None
+
+
+def request_headers(container, manifest=None):
+    '''
+    Build the HTTP headers to continue an interrupted download or, if the
+    container already holds the file, to only download it again if it has
+    changed on the server.
+
+    '''
+    partial, offset = partial_download(container)
+    validator = if_range(partial_validators(partial)) if offset else None
+    if validator:
+        # The server only sends the rest if the file is still the one the
+        # partial file came from, the whole file otherwise. The offset
+        # counts decoded bytes, so the rest must not come compressed.
+        return {'Range': 'bytes={}-'.format(offset),
+                'If-Range': validator,
+                'Accept-Encoding': 'identity'}
+    if manifest is not None:
+        return conditional_headers(manifest.get(container)) or None
+
+    return None
+
+
+def log_prefix(source_name, dataset_name, start, end):
+    '''Return the columns identifying a file in the download log.'''
+    return '| {:20.20} | {:20.20} | {:%Y-%m-%d} | {:%Y-%m-%d} | '.format(
+        source_name, dataset_name, start, end)
+
+
+def file_container(data_path, source_name, dataset_name, start, end):
+    '''
+    Return the directory for the file covering [start, end]. It is created
+    once there is something to save in it.
+
+    Each file will be saved in a folder of its own, this allows us to preserve
+    the original filename when saving to disk.
+
+    '''
+    container = os.path.join(data_path, source_name, dataset_name,
+                             start.strftime('%Y-%m-%d') + '_' +
+                             end.strftime('%Y-%m-%d'))
+
+    return container
+
+
+def server_period(source_name, start, end):
+    '''
+    Convert start and end of a file to the format expected by the server.
+
+    '''
+    # Belgian TSO Elia requires start/end with time in UTC format
+    if source_name == 'Elia':
+        start = (pytz.timezone('Europe/Brussels')
+                 .localize(datetime.combine(start, time()))
+                 .astimezone(pytz.timezone('UTC')))
+
+        end = (pytz.timezone('Europe/Brussels')
+               .localize(datetime.combine(end + timedelta(days=1), time()))
+               .astimezone(pytz.timezone('UTC')))
+
+    return start, end
+
+
+def build_url(url_template, url_params_template, start, end):
+    '''
+    Paste start and end of a file into the URL or the URL-parameters.
+
+    Returns
+    ----------
+    url : str
+    url_params : dict
+        A dict for URL-parameters, empty if the URL has no parameters
+
+    '''
+    url_params = {}
 
     # For most sources, we can use HTTP get method with parameters-dict
     if url_params_template:
@@ -622,37 +1276,38 @@ def download_request(
             u_end=end,
         )
 
-    if source_name == 'PSE':
-        attempts = 10
-    else:
-        attempts = 1
+    return url, url_params
 
-    # For polish TSO PSE, sometimes the first attempt to download does not work,
-    # but later attempts will.
-    for i in range(attempts):
-        resp = session.get(url, params=url_params, cookies=cookies)
-        if resp.status_code == 200:
-            break
-        elif i == attempts - 1:
-            downloaded = False
-            return downloaded, session
-        elif source_name == 'PSE':
-            logger.warning(
-                'http status %s, attempt %s, trying again in 1:10 minutes...',
-                resp.status_code, i + 1)
-            sleep(70)
 
-    # Get the original filename
+def original_filename(headers, resp_url, start, end, filename=None):
+    '''
+    Get the original filename from the content-disposition header of a
+    response, falling back to the filename pattern from sources.yml.
+
+    Parameters
+    ----------
+    headers : dict-like
+        Case-insensitive response headers
+    resp_url : str
+        URL the file was downloaded from, for logging
+    filename : str, default None
+        pattern of filename to use if it can not be retrieved from server
+
+    Returns
+    ----------
+    original_filename : str
+
+    '''
     try:
         original_filename = (
-            resp.headers['content-disposition']
+            headers['content-disposition']
             .split('filename=')[-1]
             .replace('"', '')
             .replace(';', '')
             .replace(':', '_')
         )
         logger.debug('Downloaded from URL: %s Original filename: %s',
-                     resp.url, original_filename)
+                     resp_url, original_filename)
 
     # For cases where the original filename can not be retrieved,
     # I put the filename in the param_dict
@@ -666,12 +1321,161 @@ def download_request(
             )
             original_filename = 'unknown_filename'
 
-        logger.debug('Downloaded from URL: %s', resp.url)
+        logger.debug('Downloaded from URL: %s', resp_url)
+
+    return original_filename
+
 
-    # Save file to disk
-    filepath = os.path.join(container, original_filename)
-    with open(filepath, 'wb') as output_file:
-        for chunk in resp.iter_content(1024):
-            output_file.write(chunk)
-    downloaded = True
+def download_request(
+        source_name,
+        start,
+        end,
+        session,
+        filename,
+        container,
+        url_template,
+        url_params_template=None,
+        cookies=None,
+        manifest=None,
+        retry_policy=None,
+        attempt=1,
+        transfer=None):
+    '''
+    Download a single file via HTTP get.
+    Build the url from parameters and save the file to disk under it's original
+    filename 
+
+    Parameters
+    ----------
+    container : str
+        unique filepath for the file to be saved
+    url_template : 
+        stem of URL 
+    url_params_template : dict
+        dict of parameter names and values to paste into URL
+    cookies : RequestsCookieJar or sessions.LoginSession, optional
+        Cookies to send. With a LoginSession, the request is repeated once
+        with the cookies of a new login if the server rejects them.
+    manifest : DownloadManifest, optional
+        Where to record the validators of the downloaded file. If the
+        container already holds the file, the validators are used to only
+        download it again if it has changed.
+    retry_policy : RetryPolicy, optional
+        Decides whether a failed attempt is worth repeating. If not given,
+        the download is attempted only once.
+    attempt : int, default 1
+        Number of this attempt
+    transfer : metrics.Transfer, optional
+        Where to note the status code, time to first byte and bytes received
+
+    Returns
+    ----------
+    downloaded : bool
+        True if download successful, False otherwise.
+    session : requests.session
+
+    '''
+    url, url_params = build_url(url_template, url_params_template, start, end)
+    headers = request_headers(container, manifest)
+
+    if retry_policy is None:
+        retry_policy = RetryPolicy(attempts=1)
+
+    # Failed attempts raise RetryLater if the retry policy allows another
+    # attempt, so the scheduler can run other downloads in the meantime.
+    login = cookies if isinstance(cookies, LoginSession) else None
+    renewed = False
+    try:
+        if login is not None:
+            cookies = login.cookies()
+        resp = session.get(url, params=url_params, cookies=cookies,
+                           headers=headers, stream=True,
+                           timeout=retry_policy.timeout)
+        if login is not None and rejected(resp.status_code,
+                                          resp.headers.get('content-type')):
+            resp.close()
+            login.expire(cookies)
+            logger.debug('cookies rejected by %s', resp.url)
+            cookies = login.cookies()
+            renewed = True
+            resp = session.get(url, params=url_params, cookies=cookies,
+                               headers=headers, stream=True,
+                               timeout=retry_policy.timeout)
+    except (requests.exceptions.Timeout,
+            requests.exceptions.ConnectionError) as e:
+        retry_policy.check(attempt, error=e)
+        logger.warning('Download from %s failed: %s', url, e)
+        downloaded = False
+        return downloaded, session
+
+    if transfer is not None:
+        transfer.first_byte()
+        transfer.status = resp.status_code
+
+    if renewed and rejected(resp.status_code,
+                            resp.headers.get('content-type')):
+        # Rejected right after logging in, so trying again is no use
+        resp.close()
+        login.expire(cookies)
+        logger.warning('cookies rejected by %s after logging in', resp.url)
+        downloaded = False
+        return downloaded, session
+    elif resp.status_code == 304:
+        resp.close()
+        logger.debug('%s not modified', resp.url)
+        if manifest is not None:
+            manifest.confirm(container)
+        downloaded = True
+        return downloaded, session
+    elif resp.status_code not in (200, 206):
+        resp.close()
+        retry_policy.check(attempt, status=resp.status_code)
+        logger.debug('http status %s from %s', resp.status_code, resp.url)
+        downloaded = False
+        return downloaded, session
+
+    # Get the original filename
+    part, mode = resume_target(
+        container,
+        original_filename(resp.headers, resp.url, start, end, filename),
+        partial_download(container)[0],
+        resp.status_code,
+        encoded='content-encoding' in resp.headers,
+        validators=http_validators(resp.headers))
+    if mode is None:
+        resp.close()
+        if 'Range' not in (headers or {}):
+            logger.warning('%s sent part of a file without being asked to',
+                           resp.url)
+            downloaded = False
+            return downloaded, session
+        logger.info('%s can not be resumed, downloading it again', resp.url)
+        return download_request(
+            source_name, start, end, session, filename, container,
+            url_template, url_params_template,
+            cookies=login if login is not None else cookies,
+            manifest=manifest, retry_policy=retry_policy, attempt=attempt,
+            transfer=transfer)
+
+    # Save file to disk under a temporary name
+    try:
+        with open(part, mode) as output_file:
+            for chunk in resp.iter_content(65536):
+                output_file.write(chunk)
+                if transfer is not None:
+                    transfer.add(len(chunk))
+    except requests.exceptions.RequestException as e:
+        # The partial file is kept, so a retry continues where this stopped
+        resp.close()
+        retry_policy.check(attempt, error=e)
+        logger.warning('Download from %s interrupted: %s', resp.url, e)
+        downloaded = False
+        return downloaded, session
+    resp.close()
+
+    filepath = finish_download(part, expected_size(resp.status_code,
+                                                   resp.headers))
+    if filepath and manifest is not None:
+        manifest.record(filepath, **http_validators(resp.headers))
+    downloaded = filepath is not None
     return downloaded, session
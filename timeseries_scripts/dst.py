@@ -0,0 +1,102 @@
+'''
+Open Power System Data
+
+Time series Datapackage
+
+dst.py : daylight saving time (DST) transitions and conversion of local
+time to UTC
+
+'''
+
+import logging
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+import pytz
+
+logger = logging.getLogger(__name__)
+logger.setLevel('DEBUG')
+
+# How the hour repeated when summertime ends in October is represented in a
+# file, mapped to the argument `ambiguous` of tz_localize():
+# both:   the hour appears twice, first in summertime, then in wintertime
+# summer: the hour appears once, in summertime
+# winter: the hour appears once, in wintertime
+# none:   the hour has been removed, it is an error if it is still there
+AUTUMN_POLICIES = ['both', 'summer', 'winter', 'none']
+
+
+@lru_cache(maxsize=None)
+def transitions(timezone, month, hour, minutes=(0,)):
+    '''
+    Return the timestamps of the DST transitions of a timezone in one month
+    since 2000, computed once per process.
+
+    The timestamps are the days of the transitions at the given local hour
+    and minutes, e.g. month=3, hour=2 for the hour that is skipped in March
+    in Central Europe.
+
+    Parameters
+    ----------
+    timezone : str
+        A timezone name from pytz.all_timezones
+    month : int
+        3 for the transitions in spring, 10 for those in autumn
+    hour : int
+        Hour of the day to return
+    minutes : tuple, default (0,)
+        Minutes of the hour to return for each transition
+
+    Returns
+    ----------
+    timestamps : tuple
+        datetime.datetime in the order of the transitions
+
+    '''
+    return tuple(
+        d.replace(hour=hour, minute=m)
+        for d in pytz.timezone(timezone)._utc_transition_times
+        if 2000 <= d.year <= datetime.today().year and d.month == month
+        for m in minutes)
+
+
+def drop_transitions(df, timezone, month, hour, minutes=(0,)):
+    '''
+    Remove the rows of df indexed by a transition timestamp, see
+    transitions() for the parameters.
+
+    '''
+    return df.loc[~df.index.isin(transitions(timezone, month, hour,
+                                             tuple(minutes)))]
+
+
+def to_utc(index, timezone, autumn='both'):
+    '''
+    Convert a DatetimeIndex in local time to naive UTC.
+
+    Parameters
+    ----------
+    index : pandas.DatetimeIndex
+        Naive timestamps in the local time of timezone
+    timezone : str
+        A timezone name from pytz.all_timezones
+    autumn : str, default 'both'
+        How the hour repeated in October appears in index, one of
+        AUTUMN_POLICIES
+
+    Returns
+    ----------
+    index : pandas.DatetimeIndex
+
+    '''
+    if autumn == 'both':
+        ambiguous = 'infer'
+    elif autumn in ('summer', 'winter'):
+        ambiguous = np.full(len(index), autumn == 'summer')
+    elif autumn == 'none':
+        ambiguous = 'raise'
+    else:
+        raise ValueError('autumn must be one of {}, not {!r}'
+                         .format(AUTUMN_POLICIES, autumn))
+    return index.tz_localize(timezone, ambiguous=ambiguous).tz_convert(None)
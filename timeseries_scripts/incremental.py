@@ -0,0 +1,106 @@
+'''
+Open Power System Data
+
+Time series Datapackage
+
+incremental.py : bring the parsed data up to date instead of rebuilding it
+
+'''
+
+import logging
+import os
+
+import pandas as pd
+
+from .parsed_store import load_parsed, parsed_filepath, save_parsed
+
+logger = logging.getLogger(__name__)
+logger.setLevel('DEBUG')
+
+RESOLUTIONS = ['15min', '30min', '60min']
+
+
+def last_parsed(parsed_path, source_name, dataset_name):
+    '''
+    Return the last timestamp (UTC) with data in the parsed data of a
+    dataset, the earliest over its resolutions, or None if it has not been
+    parsed before.
+
+    '''
+    last = None
+    for res_key in RESOLUTIONS:
+        filepath = parsed_filepath(parsed_path, res_key, source_name,
+                                   dataset_name)
+        if not os.path.exists(filepath):
+            continue
+        t = load_parsed(filepath).last_valid_index()
+        if t is not None and (last is None or t < last):
+            last = t
+    return last
+
+
+def last_parsed_dates(sources, parsed_path):
+    '''
+    Find where the parsed data of each dataset ends, to pass as ``since``
+    to download() and read().
+
+    The date of the last timestamp is returned rather than the day after,
+    so the period still open at the last run is downloaded and read again.
+
+    Parameters
+    ----------
+    sources : dict
+        Sources and datasets, as in sources.yml
+    parsed_path : str
+        Directory of the parsed data
+
+    Returns
+    ----------
+    since : dict
+        Maps (source_name, dataset_name) to a datetime.date. Datasets not
+        parsed before are left out, so they are downloaded and read in full.
+
+    '''
+    since = {}
+    for source_name, source_dict in sources.items():
+        for dataset_name in source_dict:
+            last = last_parsed(parsed_path, source_name, dataset_name)
+            if last is None:
+                continue
+            since[source_name, dataset_name] = last.date()
+            logger.info(' {:20.20} | {:20.20} | parsed until {}'
+                        .format(source_name, dataset_name, last))
+    return since
+
+
+def merge_parsed(parsed_path, res_key, source_name, dataset_name, delta,
+                 delta_path=None):
+    '''
+    Update the parsed data of a dataset with the data read since its last
+    timestamp, replacing the rows the two have in common.
+
+    Parameters
+    ----------
+    delta : pandas.DataFrame
+        Data read for the period since the last update
+    delta_path : str, optional
+        Directory to also save delta to, under the same name as the parsed
+        data, so later steps can process just the new rows.
+
+    '''
+    filepath = parsed_filepath(parsed_path, res_key, source_name,
+                               dataset_name)
+    if delta_path is not None:
+        os.makedirs(delta_path, exist_ok=True)
+        save_parsed(delta, delta_path, res_key, source_name, dataset_name)
+    if delta.empty:
+        return
+    if os.path.exists(filepath):
+        # Only the years up to the start of delta are needed
+        df = load_parsed(filepath, end=delta.index[0])
+        df = pd.concat([df.loc[df.index < delta.index[0]], delta], sort=False)
+    else:
+        df = delta
+    save_parsed(df, parsed_path, res_key, source_name, dataset_name)
+    logger.info(' {:20.20} | {:20.20} | {} rows added or replaced'
+                .format(source_name, dataset_name, len(delta)))
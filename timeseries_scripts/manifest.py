@@ -0,0 +1,370 @@
+'''
+Open Power System Data
+
+Time series Datapackage
+
+manifest.py : index of downloaded files and their server validators
+
+Rebuild the index from an existing download directory with:
+
+    python -m timeseries_scripts.manifest path/to/original_data
+
+'''
+
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from .make_json import get_sha_hash
+
+logger = logging.getLogger(__name__)
+logger.setLevel('DEBUG')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    container TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    period_start TEXT NOT NULL,
+    period_end TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    size INTEGER,
+    sha256 TEXT,
+    downloaded TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS files_period
+    ON files (source, dataset, period_start, period_end);
+'''
+
+VALIDATORS = ['etag', 'last_modified', 'size', 'mtime']
+
+
+class DownloadManifest():
+    '''
+    SQLite index of the files under data_path, one row per container.
+
+    Each row holds source, dataset, the period covered, the filename, its
+    size and SHA-256 hash, when it was downloaded or last found unchanged
+    on the server, and what the server
+    reported about it (``etag``, ``last_modified``, and ``mtime`` for SFTP),
+    so files for periods that are still open can be re-checked cheaply and
+    the download and read stages need not scan the directory tree.
+
+    Parameters
+    ----------
+    path : str
+        SQLite file, usually ``data_path/manifest.sqlite``. The directory it
+        is in is taken as data_path.
+    store : BlobStore, optional
+        Store shared between versions. Recorded files are added to it, and
+        files missing from data_path are taken from it.
+
+    '''
+
+    def __init__(self, path, store=None):
+        self.path = path
+        self.store = store
+        self.root = os.path.dirname(path)
+        os.makedirs(self.root or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+
+    def _key(self, container):
+        return os.path.relpath(container, self.root).replace(os.sep, '/')
+
+    def get(self, container):
+        '''Return the validators stored for container, {} if there are none.'''
+        with self._lock:
+            row = self._db.execute(
+                'SELECT {} FROM files WHERE container = ?'.format(
+                    ', '.join(VALIDATORS)),
+                (self._key(container),)).fetchone()
+        if row is None:
+            return {}
+        return {k: v for k, v in zip(VALIDATORS, row) if v is not None}
+
+    def lookup(self, container):
+        '''Return the name of the file recorded for container, or None.'''
+        with self._lock:
+            row = self._db.execute(
+                'SELECT filename FROM files WHERE container = ?',
+                (self._key(container),)).fetchone()
+        return row[0] if row else None
+
+    def downloaded(self, container):
+        '''
+        Return when the file of container was downloaded or last found
+        unchanged on the server, as datetime.datetime, or None.
+
+        '''
+        with self._lock:
+            row = self._db.execute(
+                'SELECT downloaded FROM files WHERE container = ?',
+                (self._key(container),)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return datetime.fromisoformat(row[0])
+
+    def confirm(self, container):
+        '''Record that the file of container is unchanged on the server.'''
+        with self._lock:
+            self._db.execute(
+                'UPDATE files SET downloaded = ? WHERE container = ?',
+                (datetime.now().isoformat(timespec='seconds'),
+                 self._key(container)))
+
+    def record(self, filepath, hashed=True, sha256=None, **validators):
+        '''
+        Add or replace the row of a complete file, and add the file to the
+        store, if any.
+
+        Parameters
+        ----------
+        filepath : str
+            data_path/source/dataset/start_end/filename
+        hashed : bool, default True
+            Compute the SHA-256 hash of the file.
+        sha256 : str, optional
+            Hash of the file if known already
+        validators : dict
+            Any of etag, last_modified, mtime as reported by the server.
+
+        '''
+        if sha256 is None and hashed:
+            sha256 = get_sha_hash(filepath)
+        container, filename = os.path.split(filepath)
+        key = self._key(container)
+        source_name, dataset_name, period = key.split('/')
+        period_start, period_end = period.split('_')
+        row = {
+            'container': key,
+            'source': source_name,
+            'dataset': dataset_name,
+            'period_start': period_start,
+            'period_end': period_end,
+            'filename': filename,
+            'size': os.path.getsize(filepath),
+            'sha256': sha256,
+            'downloaded': datetime.fromtimestamp(
+                os.path.getmtime(filepath)).isoformat(timespec='seconds'),
+            'etag': validators.get('etag'),
+            'last_modified': validators.get('last_modified'),
+            'mtime': validators.get('mtime')
+        }
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO files ({}) VALUES ({})'.format(
+                    ', '.join(row), ', '.join('?' * len(row))),
+                list(row.values()))
+
+        if self.store is not None and sha256 is not None:
+            self.store.add(filepath, sha256, **validators)
+
+    def sha256(self, filepath):
+        '''
+        Return the SHA-256 hash of a file, from its row if the file recorded
+        there has the same name and size. Otherwise the file is hashed, and
+        the hash is kept in its row if there is one.
+
+        '''
+        container, filename = os.path.split(filepath)
+        size = os.path.getsize(filepath)
+        with self._lock:
+            row = self._db.execute(
+                'SELECT filename, size, sha256 FROM files '
+                'WHERE container = ?', (self._key(container),)).fetchone()
+        if row is not None and row[2] is not None and \
+                tuple(row[:2]) == (filename, size):
+            return row[2]
+
+        sha256 = get_sha_hash(filepath)
+        with self._lock:
+            self._db.execute(
+                'UPDATE files SET sha256 = ? '
+                'WHERE container = ? AND filename = ? AND size = ?',
+                (sha256, self._key(container), filename, size))
+        return sha256
+
+    def forget(self, container):
+        '''Drop the row of a container whose file no longer exists.'''
+        with self._lock:
+            self._db.execute('DELETE FROM files WHERE container = ?',
+                             (self._key(container),))
+
+    def checkout(self, container):
+        '''
+        Take the file of a container from the store and record it.
+
+        Returns
+        ----------
+        filename : str or None
+            Name of the file, None if there is no store or it has no file for
+            the container.
+
+        '''
+        if self.store is None:
+            return None
+        found = self.store.checkout(container)
+        if found is None:
+            return None
+        filename, sha256, validators = found
+        self.record(os.path.join(container, filename), sha256=sha256,
+                    **validators)
+        return filename
+
+    def files(self, source_name, dataset_name, start=None, end=None):
+        '''
+        Return the files of a dataset whose period overlaps [start, end].
+
+        Parameters
+        ----------
+        start : datetime.date, optional
+            Skip files ending before start
+        end : datetime.date, optional
+            Skip files starting more than one day after end
+
+        Returns
+        ----------
+        files : list
+            Tuples (container, filename, size), sorted by container name,
+            with container as absolute path.
+
+        '''
+        query = ('SELECT container, filename, size FROM files '
+                 'WHERE source = ? AND dataset = ?')
+        params = [source_name, dataset_name]
+        if start:
+            query += ' AND period_end >= ?'
+            params.append(start.isoformat())
+        if end:
+            query += ' AND period_start <= ?'
+            params.append((end + timedelta(days=1)).isoformat())
+        query += ' ORDER BY container'
+
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return [(os.path.join(self.root, *container.split('/')), f, size)
+                for container, f, size in rows]
+
+    def average_sizes(self):
+        '''
+        Return the average file size in bytes per dataset, as a dict keyed by
+        (source_name, dataset_name).
+
+        '''
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT source, dataset, AVG(size) FROM files '
+                'GROUP BY source, dataset').fetchall()
+        return {(source_name, dataset_name): int(size)
+                for source_name, dataset_name, size in rows
+                if size is not None}
+
+    def rebuild(self, hashed=True):
+        '''
+        Index all files found under data_path, keeping the validators of
+        files already in the manifest and dropping the rows of files that
+        no longer exist.
+
+        Returns
+        ----------
+        count : int
+            Number of files indexed.
+
+        '''
+        from .download import list_container
+
+        found = set()
+        for source_name in sorted(os.listdir(self.root)):
+            source_dir = os.path.join(self.root, source_name)
+            if not os.path.isdir(source_dir):
+                continue
+            for dataset_name in sorted(os.listdir(source_dir)):
+                dataset_dir = os.path.join(source_dir, dataset_name)
+                if not os.path.isdir(dataset_dir):
+                    continue
+                for container in sorted(os.listdir(dataset_dir)):
+                    container = os.path.join(dataset_dir, container)
+                    files = list_container(container)
+                    if len(files) != 1:
+                        continue
+                    self.record(os.path.join(container, files[0]),
+                                hashed=hashed, **self.get(container))
+                    found.add(self._key(container))
+
+        with self._lock:
+            stale = [key for key, in self._db.execute(
+                'SELECT container FROM files') if key not in found]
+            self._db.executemany('DELETE FROM files WHERE container = ?',
+                                 [(key,) for key in stale])
+        logger.info('indexed %s files in %s, dropped %s missing files',
+                    len(found), self.path, len(stale))
+        return len(found)
+
+    def close(self):
+        '''Close the database.'''
+        with self._lock:
+            self._db.close()
+
+
+def http_validators(headers):
+    '''Extract the validators to remember from HTTP response headers.'''
+    return {'etag': headers.get('etag'),
+            'last_modified': headers.get('last-modified')}
+
+
+def conditional_headers(validators):
+    '''Build the headers for a conditional HTTP request.'''
+    headers = {}
+    if 'etag' in validators:
+        headers['If-None-Match'] = validators['etag']
+    if 'last_modified' in validators:
+        headers['If-Modified-Since'] = validators['last_modified']
+
+    return headers
+
+
+def if_range(validators):
+    '''
+    Return the value of an If-Range header to resume a file downloaded with
+    validators, None if there is none. Weak ETags can not be used.
+
+    '''
+    etag = validators.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return validators.get('last_modified')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Rebuild the manifest of downloaded files')
+    parser.add_argument('data_path',
+                        help='directory holding the downloaded files')
+    parser.add_argument('--no-hash', action='store_true',
+                        help='skip computing SHA-256 hashes')
+    parser.add_argument('--store',
+                        help='also add the files to the shared raw store in '
+                             'this directory')
+    args = parser.parse_args()
+    logging.basicConfig(level='INFO')
+    store = None
+    if args.store:
+        from .blobstore import BlobStore
+        store = BlobStore(args.store)
+    manifest = DownloadManifest(os.path.join(args.data_path,
+                                             'manifest.sqlite'), store=store)
+    manifest.rebuild(hashed=not args.no_hash or store is not None)
+    manifest.close()
+    if store is not None:
+        store.close()
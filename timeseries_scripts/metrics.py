@@ -0,0 +1,228 @@
+'''
+Open Power System Data
+
+Time series Datapackage
+
+metrics.py : throughput and latency metrics of downloads
+
+'''
+
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+logger.setLevel('DEBUG')
+
+JSONL_FILE = 'download_metrics.jsonl'
+PROMETHEUS_FILE = 'download_metrics.prom'
+
+
+class Transfer():
+    '''
+    Measurements of one download attempt, filled in by the download
+    functions while it runs.
+
+    '''
+
+    def __init__(self, container, host, attempt=1):
+        self.container = container
+        self.host = host
+        self.attempt = attempt
+        self.status = None
+        self.bytes = 0
+        self.ttfb = None
+        self.t0 = perf_counter()
+
+    def first_byte(self):
+        '''Note the time the server started to answer.'''
+        if self.ttfb is None:
+            self.ttfb = perf_counter() - self.t0
+
+    def add(self, n):
+        '''Count n bytes received.'''
+        self.bytes += n
+
+
+class DownloadMetrics():
+    '''
+    Collect one record per downloaded file: bytes, transfer time, time to
+    first byte, number of retries and throughput.
+
+    Records are appended to ``download_metrics.jsonl`` as they come in. On
+    close(), totals per source are written to ``download_metrics.prom`` in
+    the Prometheus text format, e.g. for the textfile collector of the node
+    exporter, and the slowest sources and hosts are logged.
+
+    Parameters
+    ----------
+    path : str, optional
+        Directory to write the files to. If not given, metrics are only
+        kept in memory.
+
+    '''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.files = []
+        self._lock = threading.Lock()
+        self._jsonl = None
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            self._jsonl = open(os.path.join(path, JSONL_FILE), 'a')
+
+    def start(self, container, host, attempt=1):
+        '''Return a Transfer to measure a download attempt.'''
+        return Transfer(container, host, attempt)
+
+    def finish(self, transfer, downloaded, outcome=None):
+        '''
+        Record the outcome of a download attempt.
+
+        Parameters
+        ----------
+        transfer : Transfer
+            The measurements of the attempt
+        downloaded : bool
+            True if the attempt was successful
+        outcome : str, optional
+            'retry' for an attempt that failed and will be repeated. By
+            default the outcome is derived from downloaded and transfer.
+
+        '''
+        seconds = perf_counter() - transfer.t0
+        source_name, dataset_name, period = os.path.normpath(
+            transfer.container).split(os.sep)[-3:]
+        if outcome is None and not downloaded:
+            outcome = 'failed'
+        elif outcome is None and (transfer.status == 304 or
+                                  transfer.bytes == 0):
+            outcome = 'unchanged'
+        elif outcome is None:
+            outcome = 'downloaded'
+        record = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'source': source_name,
+            'dataset': dataset_name,
+            'period': period,
+            'host': transfer.host,
+            'outcome': outcome,
+            'status': transfer.status,
+            'bytes': transfer.bytes,
+            'seconds': round(seconds, 3),
+            'ttfb': None if transfer.ttfb is None else round(
+                transfer.ttfb, 3),
+            'throughput': round(transfer.bytes / seconds) if seconds else 0,
+            'retries': transfer.attempt - 1
+        }
+        with self._lock:
+            self.files.append(record)
+            if self._jsonl is not None:
+                self._jsonl.write(json.dumps(record) + '\n')
+                self._jsonl.flush()
+
+    def totals(self, key='source'):
+        '''
+        Sum up the records by key.
+
+        Parameters
+        ----------
+        key : str, default 'source'
+            'source' or 'host'
+
+        Returns
+        ----------
+        totals : dict
+            Maps each value of key to a dict of files, failed, bytes,
+            seconds, ttfb (sum) and retries.
+
+        '''
+        totals = {}
+        with self._lock:
+            files = list(self.files)
+        for record in files:
+            total = totals.setdefault(record[key], {
+                'files': 0, 'failed': 0, 'bytes': 0, 'seconds': 0.0,
+                'ttfb': 0.0, 'retries': 0})
+            # An attempt to be repeated is counted with the final one,
+            # whose record holds the number of retries before it
+            final = record['outcome'] != 'retry'
+            total['files'] += final
+            total['failed'] += record['outcome'] == 'failed'
+            total['bytes'] += record['bytes']
+            total['seconds'] += record['seconds']
+            total['ttfb'] += record['ttfb'] or 0
+            total['retries'] += record['retries'] if final else 0
+        return totals
+
+    def prometheus(self):
+        '''Return the totals per source in the Prometheus text format.'''
+        metrics = [
+            ('files', 'opsd_download_files_total', 'counter',
+             'Files downloaded or checked'),
+            ('failed', 'opsd_download_failed_total', 'counter',
+             'Files that could not be downloaded'),
+            ('bytes', 'opsd_download_bytes_total', 'counter',
+             'Bytes received'),
+            ('seconds', 'opsd_download_seconds_total', 'counter',
+             'Time spent downloading'),
+            ('ttfb', 'opsd_download_ttfb_seconds_total', 'counter',
+             'Time spent waiting for the first byte'),
+            ('retries', 'opsd_download_retries_total', 'counter',
+             'Attempts repeated after a failure'),
+            ('throughput', 'opsd_download_throughput_bytes', 'gauge',
+             'Bytes received per second spent downloading')]
+
+        totals = self.totals('source')
+        for total in totals.values():
+            total['throughput'] = (total['bytes'] / total['seconds']
+                                   if total['seconds'] else 0)
+
+        lines = []
+        for key, name, kind, text in metrics:
+            lines.append('# HELP {} {}'.format(name, text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for source_name, total in sorted(totals.items()):
+                lines.append('{}{{source="{}"}} {}'.format(
+                    name, escape_label(source_name), total[key]))
+        return '\n'.join(lines) + '\n'
+
+    def log_summary(self, n=5):
+        '''Log the n sources and hosts with the lowest throughput.'''
+        for key in ['source', 'host']:
+            totals = self.totals(key)
+            slowest = sorted(
+                totals.items(),
+                key=lambda x: x[1]['bytes'] / max(x[1]['seconds'], 1e-9))
+            for name, total in slowest[:n]:
+                logger.info(
+                    'slowest {}: {:30.30} | {:5} files | {:8.1f} MB | '
+                    '{:7.1f} s | {:6.2f} s to first byte | {:8.1f} kB/s | '
+                    '{} retries'.format(
+                        key, str(name), total['files'], total['bytes'] / 1e6,
+                        total['seconds'],
+                        total['ttfb'] / max(total['files'], 1),
+                        total['bytes'] / max(total['seconds'], 1e-9) / 1e3,
+                        total['retries']))
+
+    def close(self):
+        '''Write the Prometheus snapshot, log the summary and close files.'''
+        if self.path is not None:
+            # Written under a temporary name, so the exporter never reads a
+            # partial file
+            filepath = os.path.join(self.path, PROMETHEUS_FILE)
+            with open(filepath + '.tmp', 'w') as f:
+                f.write(self.prometheus())
+            os.replace(filepath + '.tmp', filepath)
+            self._jsonl.close()
+        if self.files:
+            self.log_summary()
+
+
+def escape_label(value):
+    '''Escape a Prometheus label value.'''
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
@@ -0,0 +1,173 @@
+'''
+Open Power System Data
+
+Time series Datapackage
+
+parse_cache.py : keep the DataFrames parsed from each raw file for later runs
+
+'''
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+logger.setLevel('DEBUG')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL
+);
+'''
+
+# Default limit of the space taken up by the cache
+MAX_BYTES = 20 * 2**30
+
+
+class ParseCache():
+    '''
+    DataFrames parsed from raw files, by resolution, keyed on the content of
+    the file and the version of the code reading it (see file_key()).
+
+    Entries are saved in Parquet files if pyarrow is installed, as pickles
+    otherwise or if a DataFrame can not be stored in Parquet. When the cache
+    grows beyond max_bytes, the entries used least recently are removed.
+    Several processes can use the same cache at the same time.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the cache
+    max_bytes : int, default MAX_BYTES
+        Size limit of the cache
+
+    '''
+
+    def __init__(self, path, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(path, 'index.sqlite'),
+                                   timeout=60, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+
+    def _dir(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key):
+        '''
+        Return the DataFrames saved under key as a dict by resolution, or
+        None if there are none.
+
+        '''
+        with self._lock:
+            found = self._db.execute(
+                'UPDATE entries SET used = ? WHERE key = ?',
+                (time.time(), key)).rowcount
+        entry = self._dir(key)
+        if not found or not os.path.isdir(entry):
+            return None
+
+        parsed = {}
+        try:
+            for filename in os.listdir(entry):
+                res_key, ext = os.path.splitext(filename)
+                filepath = os.path.join(entry, filename)
+                if ext == '.parquet':
+                    parsed[res_key] = pd.read_parquet(filepath)
+                elif ext == '.pickle':
+                    parsed[res_key] = pd.read_pickle(filepath)
+        except Exception as e:
+            # Removed by another process in the meantime, or damaged
+            logger.debug('cache entry %s not readable: %r', key, e)
+            return None
+        return parsed
+
+    def put(self, key, parsed):
+        '''Save the dict of DataFrames parsed from a file under key.'''
+        entry = self._dir(key)
+        tmp = '{}.{}.tmp'.format(entry, os.getpid())
+        os.makedirs(tmp, exist_ok=True)
+        for res_key, df in parsed.items():
+            filepath = os.path.join(tmp, res_key)
+            try:
+                df.to_parquet(filepath + '.parquet')
+                # Only keep Parquet if it gives back the same DataFrame
+                if not pd.read_parquet(filepath + '.parquet').equals(df):
+                    raise ValueError('not preserved by Parquet')
+            except Exception:
+                if os.path.exists(filepath + '.parquet'):
+                    os.remove(filepath + '.parquet')
+                df.to_pickle(filepath + '.pickle')
+
+        size = sum(os.path.getsize(os.path.join(tmp, f))
+                   for f in os.listdir(tmp))
+        if os.path.isdir(entry):
+            shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                (key, size, time.time()))
+        self.evict()
+
+    def evict(self):
+        '''Remove the least recently used entries beyond max_bytes.'''
+        with self._lock:
+            total = self._db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = self._db.execute(
+                'SELECT key, size FROM entries ORDER BY used').fetchall()
+            removed = []
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                removed.append(key)
+                total -= size
+            self._db.executemany('DELETE FROM entries WHERE key = ?',
+                                 [(key,) for key in removed])
+        for key in removed:
+            shutil.rmtree(self._dir(key), ignore_errors=True)
+        logger.debug('%s entries removed from the parse cache', len(removed))
+
+    def close(self):
+        '''Close the index.'''
+        with self._lock:
+            self._db.close()
+
+
+def reader_digest(source_name, dataset_name, param_dict, headers,
+                  version, areas=None):
+    '''
+    Return a hash of everything besides the file that the DataFrames read
+    from it depend on: the dataset, its parameters from sources.yml, the
+    column headers, the version of the read function and, for ENTSO-E
+    Transparency, the areas table.
+
+    '''
+    h = hashlib.sha256()
+    h.update(json.dumps([source_name, dataset_name, param_dict, headers,
+                         version], sort_keys=True, default=str)
+             .encode('utf-8'))
+    if areas is not None and source_name == 'ENTSO-E Transparency FTP':
+        h.update(pd.util.hash_pandas_object(areas).values.tobytes())
+    return h.hexdigest()
+
+
+def file_key(sha256, digest):
+    '''Return the cache key of a file with the given content hash.'''
+    return hashlib.sha256((sha256 + digest).encode('utf-8')).hexdigest()
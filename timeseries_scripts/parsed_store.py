@@ -0,0 +1,246 @@
+'''
+Open Power System Data
+
+Time series Datapackage
+
+parsed_store.py : save the parsed data of each dataset in columnar files
+
+'''
+
+import json
+import logging
+import os
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+logger.setLevel('DEBUG')
+
+# Key of the schema metadata holding the column header and the years
+META_KEY = b'opsd'
+
+# Name of the column the index is stored in
+INDEX_COLUMN = '__index__'
+
+EXTENSIONS = ('.parquet', '.pickle')
+
+
+def arrow():
+    '''Return pyarrow and pyarrow.parquet, or None if not installed.'''
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow, pyarrow.parquet
+
+
+def parsed_filepath(parsed_path, res_key, source_name, dataset_name):
+    '''
+    Return the path of the parsed data of a dataset: the file saved by
+    save_parsed() if there is one, otherwise the path a new one is saved to.
+
+    '''
+    base = os.path.join(parsed_path,
+                        '_'.join([res_key, source_name, dataset_name]))
+    for ext in EXTENSIONS:
+        if os.path.exists(base + ext):
+            return base + ext
+    return base + ('.parquet' if arrow() else '.pickle')
+
+
+def parsed_files(parsed_path, subset=None):
+    '''
+    List the parsed data saved by save_parsed().
+
+    Parameters
+    ----------
+    parsed_path : str
+        Directory of the parsed data
+    subset : dict, optional
+        Sources and the lists of their datasets to keep, e.g.
+        ``{'Elia': ['wind_onshore']}``. Default: all of them.
+
+    Returns
+    ----------
+    files : list
+        (filepath, res_key, source_name, dataset_name) of each file
+
+    '''
+    files = []
+    for filename in sorted(os.listdir(parsed_path)):
+        base, ext = os.path.splitext(filename)
+        if ext not in EXTENSIONS or base.count('_') < 2:
+            continue
+        # Dataset names may contain underscores, e.g. wind_onshore
+        res_key, source_name, dataset_name = base.split('_', 2)
+        if subset and dataset_name not in (subset.get(source_name) or []):
+            continue
+        files.append((os.path.join(parsed_path, filename),
+                      res_key, source_name, dataset_name))
+    return files
+
+
+def save_parsed(df, parsed_path, res_key, source_name, dataset_name):
+    '''
+    Save the parsed data of a dataset, replacing what was saved before.
+
+    The data go into a Parquet file if pyarrow is installed, with one row
+    group per year and the column header in the schema metadata, so that
+    load_parsed() can read just some of the columns and years. DataFrames
+    Parquet can not hold, and all of them without pyarrow, are pickled.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Parsed data, indexed by timestamp
+    parsed_path : str
+        Directory of the parsed data
+
+    Returns
+    ----------
+    filepath : str
+        Path of the file written
+
+    '''
+    base = os.path.join(parsed_path,
+                        '_'.join([res_key, source_name, dataset_name]))
+    filepath = None
+    if arrow() is not None:
+        try:
+            write_parquet(df, base + '.parquet')
+            filepath = base + '.parquet'
+        except Exception as e:
+            logger.debug('%s not saved as Parquet: %r', base, e)
+    if filepath is None:
+        filepath = base + '.pickle'
+        df.to_pickle(filepath + '.tmp')
+        os.replace(filepath + '.tmp', filepath)
+
+    # Leave no file in the other format behind to be read as well
+    for ext in EXTENSIONS:
+        if base + ext != filepath and os.path.exists(base + ext):
+            os.remove(base + ext)
+    return filepath
+
+
+def write_parquet(df, filepath):
+    '''Write df to a Parquet file with one row group per year.'''
+    pa, pq = arrow()
+    columns = list(df.columns)
+    meta = {
+        'columns': [list(col) if isinstance(col, tuple) else col
+                    for col in columns],
+        'names': list(df.columns.names),
+        'multiindex': isinstance(df.columns, pd.MultiIndex),
+        'index_name': df.index.name,
+    }
+    # Parquet needs unique column names made of strings. Both axes are
+    # replaced on a new DataFrame, so df keeps its own.
+    flat = df.set_axis([str(i) for i in range(len(columns))], axis='columns')
+    flat = flat.rename_axis(INDEX_COLUMN)
+    table = pa.Table.from_pandas(flat, preserve_index=True)
+
+    if isinstance(df.index, pd.DatetimeIndex) and len(df.index):
+        years = df.index.year
+        meta['years'] = sorted(set(int(year) for year in years))
+        bounds = [(years == year).nonzero()[0] for year in meta['years']]
+        if any(b[-1] - b[0] + 1 != len(b) for b in bounds):
+            raise ValueError('index not sorted by year')
+        slices = [(b[0], len(b)) for b in bounds]
+    else:
+        meta['years'] = None
+        slices = [(0, len(df.index))]
+
+    table = table.replace_schema_metadata(
+        {**(table.schema.metadata or {}),
+         META_KEY: json.dumps(meta).encode('utf-8')})
+    with pq.ParquetWriter(filepath + '.tmp', table.schema) as writer:
+        for offset, length in slices:
+            writer.write_table(table.slice(offset, length),
+                               row_group_size=max(length, 1))
+    os.replace(filepath + '.tmp', filepath)
+
+
+def load_parsed(filepath, columns=None, start=None, end=None):
+    '''
+    Load the parsed data of a dataset saved by save_parsed().
+
+    Parquet files are memory-mapped and only the row groups of the years
+    and the columns asked for are read.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the file
+    columns : list, optional
+        Columns to load, each given by its header or the first levels of it,
+        e.g. ``('DE',)`` for all columns of Germany. Default: all columns.
+    start : datetime-like, optional
+        First timestamp to load
+    end : datetime-like, optional
+        Last timestamp to load
+
+    Returns
+    ----------
+    df : pandas.DataFrame
+
+    '''
+    if filepath.endswith('.pickle'):
+        df = pd.read_pickle(filepath)
+        if columns is not None:
+            df = df.loc[:, [col for col in df.columns
+                            if selected(col, columns)]]
+        if start is not None or end is not None:
+            df = df.loc[start:end]
+        return df
+
+    pa, pq = arrow()
+    pf = pq.ParquetFile(filepath, memory_map=True)
+    meta = json.loads(pf.metadata.metadata[META_KEY])
+    header = [tuple(col) if meta['multiindex'] else col
+              for col in meta['columns']]
+
+    if columns is None:
+        positions = list(range(len(header)))
+    else:
+        positions = [i for i, col in enumerate(header)
+                     if selected(col, columns)]
+
+    names = [str(i) for i in positions]
+    groups = list(range(pf.num_row_groups))
+    if meta['years'] and (start is not None or end is not None):
+        first = meta['years'][0] if start is None else \
+            pd.Timestamp(start).year
+        last = meta['years'][-1] if end is None else pd.Timestamp(end).year
+        groups = [i for i, year in enumerate(meta['years'])
+                  if first <= year <= last]
+
+    if groups:
+        table = pf.read_row_groups(groups, columns=names,
+                                   use_pandas_metadata=True)
+    else:
+        table = pf.read_row_group(0, columns=names,
+                                  use_pandas_metadata=True).slice(0, 0)
+    df = table.to_pandas()
+    df.index.name = meta['index_name']
+    selection = [header[i] for i in positions]
+    if meta['multiindex']:
+        levels = [list(level) for level in zip(*selection)]
+        df.columns = pd.MultiIndex.from_arrays(
+            levels or [[] for name in meta['names']], names=meta['names'])
+    else:
+        df.columns = pd.Index(selection, name=meta['names'][0])
+    if start is not None or end is not None:
+        df = df.loc[start:end]
+    return df
+
+
+def selected(col, columns):
+    '''Return True if col is one of columns or begins with one of them.'''
+    key = col if isinstance(col, tuple) else (col,)
+    for c in columns:
+        c = c if isinstance(c, tuple) else (c,)
+        if key[:len(c)] == c:
+            return True
+    return False
@@ -0,0 +1,292 @@
+'''
+Open Power System Data
+
+Time series Datapackage
+
+pipeline.py : read files while the download of others is still under way
+
+'''
+
+import logging
+import multiprocessing
+import os
+import queue
+from concurrent.futures import ProcessPoolExecutor
+
+from . import download as dl
+from . import planner
+from . import read as rd
+from .manifest import DownloadManifest
+from .metrics import DownloadMetrics
+from .scheduler import DownloadScheduler
+
+logger = logging.getLogger(__name__)
+logger.setLevel('DEBUG')
+
+# Seconds to wait for news from downloads and parse workers before checking
+# whether any are still under way
+EVENT_TIMEOUT = 60
+
+
+class DatasetReader():
+    '''
+    Combine the files of one dataset as they come in from the parse workers.
+
+    Files are added to the combined DataFrames in the order of their
+    containers, as in read_dataset(), whatever order they are parsed in, so
+    the result does not depend on which download finished first.
+
+    '''
+
+    def __init__(self, source_name, dataset_name, param_dict, containers):
+        self.source_name = source_name
+        self.dataset_name = dataset_name
+        self.param_dict = param_dict
+        self.containers = sorted(set(containers))
+        self.cumulated = {'15min': [],
+                          '30min': [],
+                          '60min': []}
+        self.submitted = 0
+        # Containers reported as downloaded
+        self.reported = set()
+        self._results = {}
+        self._next = 0
+
+    @property
+    def complete(self):
+        return self._next == len(self.containers)
+
+    def add(self, container, filename, parsed):
+        '''Take the result for a container, None if it has no data.'''
+        self._results[container] = (filename, parsed)
+        while (not self.complete and
+               self.containers[self._next] in self._results):
+            filename, parsed = self._results.pop(
+                self.containers[self._next])
+            if parsed is not None:
+                rd.add_parsed(self.cumulated, parsed, self.param_dict,
+                              filename)
+            self._next += 1
+
+
+def download_and_read(
+        sources,
+        data_path,
+        input_path,
+        parsed_path,
+        areas,
+        headers,
+        auth,
+        start_from_user=None,
+        end_from_user=None,
+        testmode=False,
+        max_workers=8,
+        parse_workers=None,
+        since=None,
+        delta_path=None,
+        cassette_path=None,
+        cassette_mode='replay'):
+    '''
+    Download and read all datasets in one go: each file is handed to a pool
+    of parse processes as soon as its download has finished, and files
+    downloaded before right away, so reading runs while the network is busy.
+    The result is the same as running download() and then read().
+
+    The files read for a planned dataset are those read_dataset() would
+    find for the period, whether or not the plan mentions their container,
+    plus the containers being downloaded. Datasets that are not planned up
+    front, i.e. scraped ones and those downloaded by hand, are read with
+    read_dataset() once all downloads are done.
+
+    Parameters
+    ----------
+    parse_workers : int, optional
+        Number of processes parsing files, defaults to the number of CPUs.
+
+    See download() and read() for info on the other parameters.
+
+    '''
+    # Workers are started fresh rather than forked, as download threads and
+    # the SQLite connection of the manifest exist by the time the first file
+    # is parsed
+    parse_pool = ProcessPoolExecutor(
+        max_workers=parse_workers,
+        mp_context=multiprocessing.get_context('spawn'))
+    manifest = DownloadManifest(os.path.join(data_path, 'manifest.sqlite'))
+
+    no_download = ['Energinet.dk', 'ENTSO-E Power Statistics', 'CEPS']
+    jobs = []
+    for source_name, source_dict in sources.items():
+        if source_name in no_download:
+            continue
+        jobs += planner.plan_source(
+            source_name, source_dict, data_path, start_from_user,
+            end_from_user, testmode=testmode, manifest=manifest, since=since)
+    jobs = planner.prioritize(planner.coalesce(
+        planner.deduplicate(jobs, manifest), data_path))
+    planner.log_plan(jobs)
+
+    # Containers that are read once their download has finished
+    pending = {}
+    for job in jobs:
+        key = job.source_name, job.dataset_name
+        pending.setdefault(key, set())
+        if job.pending:
+            pending[key].add(os.path.normpath(job.container))
+
+    readers = {}
+    for (source_name, dataset_name), downloading in pending.items():
+        param_dict = sources[source_name][dataset_name]
+        if source_name == 'Svenska Kraftnaet':
+            param_dict['colmap'] = sources[source_name]['wind_solar_1'][
+                'colmap']
+        start = dataset_start(since, source_name, dataset_name,
+                              start_from_user)
+        on_disk = {os.path.normpath(container) for container, _, _ in
+                   rd.dataset_files(data_path, source_name, dataset_name,
+                                    start, end_from_user, manifest)}
+        if not on_disk | downloading:
+            # Left to read_dataset() below, which reports it
+            continue
+        readers[source_name, dataset_name] = DatasetReader(
+            source_name, dataset_name, param_dict, on_disk | downloading)
+
+    # Downloads report finished containers through this queue, parse
+    # results come back through it as well
+    events = queue.Queue()
+
+    def downloaded(job):
+        events.put(('downloaded', (job.source_name, job.dataset_name),
+                    os.path.normpath(job.container)))
+
+    for key, reader in readers.items():
+        for container in reader.containers:
+            if container not in pending[key]:
+                events.put(('downloaded', key, container))
+
+    metrics = DownloadMetrics(data_path)
+    cassette = None
+    if cassette_path is not None:
+        from .cassette import Cassette
+        cassette = Cassette(cassette_path, cassette_mode)
+    scheduler = DownloadScheduler(max_workers=max_workers)
+    dl.submit_jobs(jobs, data_path, auth, scheduler, manifest, metrics,
+                   cassette, on_done=downloaded)
+
+    def parsed(key, container, filename):
+        def done(future):
+            try:
+                result = future.result()
+            except Exception as e:
+                # Also when the worker died, as the pool is broken then
+                logger.error('%s could not be read: %r', container, e)
+                result = None
+            events.put(('parsed', key, (container, filename, result)))
+        return done
+
+    remaining = sum(len(reader.containers) for reader in readers.values())
+    parsing = 0
+    try:
+        while remaining:
+            try:
+                kind, key, item = events.get(timeout=EVENT_TIMEOUT)
+            except queue.Empty:
+                if scheduler.busy or parsing:
+                    continue
+                # All downloads are over, but some never reported back, e.g.
+                # a job that failed before it started. Read what is there.
+                for key, reader in readers.items():
+                    for container in reader.containers:
+                        if container not in reader.reported:
+                            logger.warning('no news of the download of %s',
+                                           container)
+                            events.put(('downloaded', key, container))
+                continue
+
+            reader = readers[key]
+            if kind == 'downloaded':
+                if item in reader.reported:
+                    continue
+                reader.reported.add(item)
+                filename = read_target(item, manifest)
+                if filename is not None and not (testmode and
+                                                 reader.submitted):
+                    future = parse_pool.submit(
+                        rd.read_file, key[0], key[1], reader.param_dict,
+                        os.path.join(item, filename), areas, headers)
+                    future.add_done_callback(parsed(key, item, filename))
+                    reader.submitted += 1
+                    parsing += 1
+                    continue
+                reader.add(item, None, None)
+            else:
+                parsing -= 1
+                reader.add(*item)
+
+            remaining -= 1
+            if reader.complete:
+                finish(reader, parsed_path, headers, start_from_user,
+                       end_from_user, since, delta_path)
+    finally:
+        scheduler.close()
+        parse_pool.shutdown()
+        metrics.close()
+
+    for source_name, source_dict in sources.items():
+        if source_name not in no_download:
+            dl.download_scraped(source_name, source_dict, data_path,
+                                input_path, start_from_user, end_from_user,
+                                manifest, since=since)
+        for dataset_name, param_dict in source_dict.items():
+            if (source_name, dataset_name) in readers:
+                continue
+            rd.read_dataset(
+                source_name, dataset_name, param_dict, data_path,
+                parsed_path, areas, headers,
+                start_from_user=start_from_user, end_from_user=end_from_user,
+                testmode=testmode, manifest=manifest,
+                since=(since or {}).get((source_name, dataset_name)),
+                delta_path=delta_path)
+
+    manifest.close()
+
+
+def read_target(container, manifest=None):
+    '''
+    Return the name of the file to read in a container, or None if there is
+    none or it can not be read, with the same checks as read_dataset().
+
+    '''
+    files = dl.container_files(container, manifest)
+    if len(files) != 1:
+        if files:
+            logger.warning(container + '> 1 file found')
+        return None
+    if os.path.getsize(os.path.join(container, files[0])) < 128:
+        logger.warning(container + 'file too small')
+        return None
+    return files[0]
+
+
+def dataset_start(since, source_name, dataset_name, start_from_user=None):
+    '''Return the start of the period to read of a dataset, as read() does.'''
+    dataset_since = (since or {}).get((source_name, dataset_name))
+    if dataset_since is not None and (start_from_user is None or
+                                      dataset_since > start_from_user):
+        return dataset_since
+    return start_from_user
+
+
+def finish(reader, parsed_path, headers, start_from_user=None,
+           end_from_user=None, since=None, delta_path=None):
+    '''Save the combined data of a dataset once all its files are read.'''
+    dataset_since = (since or {}).get((reader.source_name,
+                                       reader.dataset_name))
+    start_from_user = dataset_start(since, reader.source_name,
+                                    reader.dataset_name, start_from_user)
+    logger.info(' {:20.20} | {:20.20} | {} files read'.format(
+        reader.source_name, reader.dataset_name, len(reader.containers)))
+    rd.save_dataset(reader.cumulated, reader.source_name,
+                    reader.dataset_name, reader.param_dict, parsed_path,
+                    headers, start_from_user, end_from_user, dataset_since,
+                    delta_path)
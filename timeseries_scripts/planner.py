@@ -0,0 +1,528 @@
+'''
+Open Power System Data
+
+Time series Datapackage
+
+planner.py : expand sources.yml into the list of files to download
+
+'''
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pandas as pd
+import requests
+from pandas.tseries.frequencies import to_offset
+
+from . import download as dl
+from .scheduler import host_of
+
+logger = logging.getLogger(__name__)
+logger.setLevel('DEBUG')
+
+# tranlate frequency to argument for pd.date_range()
+FREQ_START = {'yearly': 'AS', 'quarterly': 'QS', 'monthly': 'MS', 'daily': 'D'}
+FREQ_END = {'yearly': 'A', 'quarterly': 'Q', 'monthly': 'M', 'daily': 'D'}
+
+
+class DownloadJob():
+    '''
+    One file to download, i.e. one container.
+
+    Attributes
+    ----------
+    source_name, dataset_name : str
+    param_dict : dict
+        Parameters of the dataset from sources.yml
+    start, end : datetime.date
+        Period covered by the file
+    url : str or None
+        URL template, None for SFTP
+    url_params_template : dict or None
+    filename : str or None
+        Pattern of the filename
+    host : str
+        Host the file is downloaded from
+    host_limit : int or None
+        ``max_connections`` of the dataset
+    container : str
+        Directory the file is saved in
+    exists : bool
+        True if the container already holds the file
+    refresh : bool
+        True if an existing file is to be checked for changes
+    size : int or None
+        Expected size of the file in bytes
+    size_from : str or None
+        Where size comes from: 'manifest', 'dataset' (average size of the
+        files of the dataset in the manifest), 'head' or 'sftp'
+
+    '''
+
+    def __init__(self, source_name, dataset_name, param_dict, start, end,
+                 url=None, url_params_template=None, filename=None,
+                 host=None, host_limit=None, container=None, refresh=False):
+        self.source_name = source_name
+        self.dataset_name = dataset_name
+        self.param_dict = param_dict
+        self.start = start
+        self.end = end
+        self.url = url
+        self.url_params_template = url_params_template
+        self.filename = filename
+        self.host = host
+        self.host_limit = host_limit
+        self.container = container
+        self.refresh = refresh
+        self.exists = False
+        self.size = None
+        self.size_from = None
+
+    @property
+    def pending(self):
+        '''True if running the job may transfer data.'''
+        return not self.exists or self.refresh
+
+    @property
+    def sftp(self):
+        '''True if the file is fetched from an SFTP server.'''
+        return self.source_name == 'ENTSO-E Transparency FTP'
+
+    def __repr__(self):
+        return '<DownloadJob {} | {} | {:%Y-%m-%d} | {:%Y-%m-%d}>'.format(
+            self.source_name, self.dataset_name, self.start, self.end)
+
+
+def period_over(end):
+    '''Return when the period ending on end is over, as datetime.datetime.'''
+    return datetime.combine(pd.Timestamp(end).date() + timedelta(days=1),
+                            datetime.min.time())
+
+
+def dataset_period(param_dict, start_from_user=None, end_from_user=None,
+                   since=None):
+    '''
+    Return the period to download for a dataset: everything from first to
+    last datapoint on the server, narrowed down to the period given by the
+    user and to the dates from since on. Returns None if the two do not
+    overlap.
+
+    A dataset parsed up to its last day on the server, or beyond it for
+    day-ahead data, keeps its last day, so the file it ends in is checked
+    again.
+
+    '''
+    start_server = param_dict['start']
+    end_server = param_dict['end']
+    if end_server == 'recent':
+        end_server = datetime.now().date()
+    if since is not None:
+        start_server = max(start_server, min(since, end_server))
+    # narrow down the time range if specified by user
+    if start_from_user:
+        if start_from_user <= start_server:
+            pass  # do nothing
+        elif start_server < start_from_user < end_server:
+            start_server = start_from_user  # replace start_server
+        else:
+            return None
+            # skip this dataset from the source dict, e.g. in Sweden
+
+    if end_from_user:
+        if end_from_user <= start_server:
+            return None
+            # skip this dataset from the source dict, e.g. in Sweden
+        elif start_server < end_from_user < end_server:
+            end_server = end_from_user  # replace  end_server
+        else:
+            pass  # do nothing
+
+    return start_server, end_server
+
+
+def file_periods(frequency, start_server, end_server):
+    '''
+    Create lists of start- and enddates of periods represented in individual
+    files, for files that contain the data for subperiods of some regular
+    length (i.e. months or years).
+
+    Returns
+    ----------
+    periods : list
+        Tuples (start, end) of pandas.Timestamp
+
+    '''
+    starts = pd.date_range(
+        start=start_server, end=end_server, freq=FREQ_START[frequency])
+
+    ends = pd.date_range(
+        start=start_server, end=end_server, freq=FREQ_END[frequency])
+
+    # Both dates in one period, e.g. the update of a still open month
+    if len(starts) == 0:
+        starts = pd.DatetimeIndex([
+            to_offset(FREQ_START[frequency]).rollback(start_server)])
+    if len(ends) == 0:
+        ends = pd.DatetimeIndex([
+            to_offset(FREQ_END[frequency]).rollforward(end_server)])
+
+    if starts[0].date() > start_server:
+        # make sure to include full first period, i.e. if start_server
+        # is 2014-12-14, set first start to 2014-01-01
+        starts = starts.union([starts[0] - 1 * starts.freq])
+
+    if ends[-1].date() < end_server:
+        # make sure to include full last period, i.e. if end_server
+        # is 2018-01-14, set last end to 2018-01-31
+        ends = ends.union([ends[-1] + 1 * ends.freq])
+
+    return list(zip(starts, ends))
+
+
+def plan_source(
+        source_name,
+        source_dict,
+        data_path,
+        start_from_user=None,
+        end_from_user=None,
+        testmode=False,
+        manifest=None,
+        since=None):
+    '''
+    List the files to download for source_name. See download() for info
+    on parameters.
+
+    Datasets to be scraped (Terna) are not planned, as their files are only
+    known once the links are extracted.
+
+    Returns
+    ----------
+    jobs : list
+        DownloadJob for each container, including those downloaded before
+
+    '''
+    jobs = []
+    for dataset_name, param_dict in source_dict.items():
+        if param_dict.get('method') == 'scrape':
+            continue
+
+        dataset_since = (since or {}).get((source_name, dataset_name))
+        period = dataset_period(param_dict, start_from_user, end_from_user,
+                                dataset_since)
+        if period is None:
+            continue
+        start_server, end_server = period
+
+        common = {
+            'filename': param_dict.get('filename'),
+            'host_limit': param_dict.get('max_connections')}
+
+        if param_dict['frequency'] == 'single file':
+            # all data is housed in one file on the server
+            new = [DownloadJob(
+                source_name, dataset_name, param_dict,
+                start_server, end_server,
+                url=param_dict['url_template'],
+                url_params_template=param_dict['url_params_template'],
+                host=host_of(param_dict['url_template']),
+                **common)]
+
+        elif param_dict['frequency'] == 'file list':
+            new = [DownloadJob(
+                source_name, dataset_name, param_dict,
+                file['start'], file['end'],
+                url=file['url'],
+                host=host_of(file['url']),
+                **common)
+                for file in param_dict['files']]
+
+        else:
+            if source_name == 'ENTSO-E Transparency FTP':
+                url = url_params_template = None
+                host = param_dict['host']
+            else:
+                url = param_dict['url_template']
+                url_params_template = param_dict['url_params_template']
+                host = host_of(url)
+
+            new = []
+            for s, e in file_periods(param_dict['frequency'],
+                                     start_server, end_server):
+                new.append(DownloadJob(
+                    source_name, dataset_name, param_dict, s, e,
+                    url=url, url_params_template=url_params_template,
+                    host=host,
+                    **common))
+                if testmode:
+                    break
+
+        for job in new:
+            job.container = dl.file_container(
+                data_path, source_name, dataset_name, job.start, job.end)
+            if manifest is not None:
+                # A file downloaded before its period was over may lack the
+                # last days
+                downloaded = manifest.downloaded(job.container)
+                job.refresh = (downloaded is not None and
+                               downloaded < period_over(job.end))
+            if (dataset_since is not None and
+                    pd.Timestamp(job.start).date() <= dataset_since <=
+                    pd.Timestamp(job.end).date()):
+                # The file the parsed data ends in was still growing when it
+                # was downloaded
+                job.refresh = manifest is not None
+            if job.sftp:
+                # The remote directory is listed once, so checking every
+                # file for changes costs no extra requests
+                job.refresh = manifest is not None
+        jobs += new
+
+    return jobs
+
+
+def container_periods(dataset_dir, source_name, dataset_name,
+                      manifest=None):
+    '''
+    Return the periods of the containers of a dataset that hold a file, as
+    tuples (start, end, container) with start and end as datetime.date.
+
+    '''
+    if manifest is not None:
+        containers = [c for c, filename, size in
+                      manifest.files(source_name, dataset_name)]
+    else:
+        containers = []
+    if not containers and os.path.isdir(dataset_dir):
+        containers = [os.path.join(dataset_dir, c)
+                      for c in os.listdir(dataset_dir)]
+        containers = [c for c in containers if dl.list_container(c)]
+
+    periods = []
+    for container in containers:
+        try:
+            start, end = [datetime.strptime(d, '%Y-%m-%d').date() for d in
+                          os.path.basename(container).split('_')]
+        except ValueError:
+            continue
+        periods.append((start, end, container))
+    return periods
+
+
+def deduplicate(jobs, manifest=None):
+    '''
+    Drop jobs for a container planned before and mark the jobs whose
+    file exists already, with its size from the manifest. Jobs for missing
+    files get the average size of their dataset's files as estimate.
+
+    For datasets with ``max_span``, a file also exists if a container
+    merged by coalesce() covers its period. If that container is to be
+    checked for changes, the job is pointed to it, so the merged file is
+    checked once instead of the period being downloaded again next to it.
+
+    '''
+    unique = {}
+    for job in jobs:
+        if job.container in unique:
+            logger.debug('%r planned twice', job)
+            continue
+        unique[job.container] = job
+
+    averages = {}
+    if manifest is not None:
+        averages = manifest.average_sizes()
+    merged = {}
+    for job in unique.values():
+        job.exists = bool(dl.container_files(job.container, manifest))
+        if not job.exists and job.param_dict.get('max_span'):
+            dataset_dir = os.path.dirname(job.container)
+            if dataset_dir not in merged:
+                merged[dataset_dir] = container_periods(
+                    dataset_dir, job.source_name, job.dataset_name, manifest)
+            start = pd.Timestamp(job.start).date()
+            end = pd.Timestamp(job.end).date()
+            covering = [(s, e, c) for s, e, c in merged[dataset_dir]
+                        if s <= start and end <= e]
+            if covering:
+                s, e, container = covering[0]
+                job.exists = True
+                downloaded = None
+                if manifest is not None:
+                    downloaded = manifest.downloaded(container)
+                # The refresh flag of the job was decided for its own
+                # container, which holds no file
+                if job.refresh or (downloaded is not None and
+                                   downloaded < period_over(e)):
+                    job.start, job.end = pd.Timestamp(s), pd.Timestamp(e)
+                    job.container = container
+                    job.refresh = True
+
+    jobs = []
+    containers = set()
+    for job in unique.values():
+        if job.container in containers:
+            continue
+        containers.add(job.container)
+        jobs.append(job)
+        recorded = {}
+        if manifest is not None:
+            recorded = manifest.get(job.container)
+        if 'size' in recorded:
+            job.size, job.size_from = recorded['size'], 'manifest'
+        elif (job.source_name, job.dataset_name) in averages:
+            job.size = averages[job.source_name, job.dataset_name]
+            job.size_from = 'dataset'
+
+    return jobs
+
+
+def coalesce(jobs, data_path):
+    '''
+    Merge the jobs for adjacent missing files of a dataset into as few
+    requests as its server allows, given as ``max_span`` in days in
+    sources.yml. Only datasets that pass the period to the server as
+    u_start and u_end can set it.
+
+    A merged file is saved in a container for the whole period it covers,
+    which read_dataset() reads like any other. Files still to be checked
+    for changes and files of periods that have not ended are not merged, so
+    the open period keeps a container of its own and is re-checked on later
+    runs.
+
+    '''
+    now = datetime.now()
+
+    def mergeable(job):
+        return (bool(job.param_dict.get('max_span')) and not job.exists and
+                not job.refresh and period_over(job.end) <= now)
+
+    coalesced = []
+    current = None
+    for job in jobs:
+        max_span = job.param_dict.get('max_span')
+        if (current is not None and mergeable(job) and
+                (job.source_name, job.dataset_name) ==
+                (current.source_name, current.dataset_name) and
+                pd.Timestamp(job.start) ==
+                pd.Timestamp(current.end) + timedelta(days=1) and
+                (pd.Timestamp(job.end) - pd.Timestamp(current.start)).days
+                < max_span):
+            current.end = job.end
+            current.size = (current.size + job.size
+                            if current.size and job.size else None)
+            continue
+
+        if current is not None:
+            coalesced.append(current)
+        if mergeable(job):
+            current = job
+        else:
+            current = None
+            coalesced.append(job)
+    if current is not None:
+        coalesced.append(current)
+
+    for job in coalesced:
+        if job.param_dict.get('max_span'):
+            job.container = dl.file_container(
+                data_path, job.source_name, job.dataset_name, job.start,
+                job.end)
+    logger.debug('%s requests for %s files', len(coalesced), len(jobs))
+    return coalesced
+
+
+def estimate_sizes(jobs, sftp=None, max_workers=8):
+    '''
+    Ask the servers for the size of the files to be downloaded. Sent as
+    HEAD requests for HTTP downloads, looked up in the directory listing for
+    SFTP downloads.
+
+    Parameters
+    ----------
+    sftp : dict, optional
+        SFTPPool by source_name, to list remote directories
+
+    '''
+    def head(job):
+        url, params = dl.build_url(job.url, job.url_params_template,
+                                   *dl.server_period(job.source_name,
+                                                     job.start, job.end))
+        try:
+            resp = requests.head(url, params=params, allow_redirects=True,
+                                 timeout=30)
+        except requests.exceptions.RequestException as e:
+            logger.debug('HEAD %s failed: %s', url, e)
+            return
+        size = dl.expected_size(resp.status_code, resp.headers)
+        if resp.status_code == 200 and size:
+            job.size, job.size_from = size, 'head'
+
+    todo = [job for job in jobs if job.pending and job.size_from in
+            (None, 'dataset')]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for job in todo:
+            if not job.sftp:
+                executor.submit(head, job)
+            elif sftp and job.source_name in sftp:
+                filename = job.filename.format(u_start=job.start,
+                                               u_end=job.end)
+                listing = sftp[job.source_name].listing(
+                    job.param_dict['path'])
+                if filename in listing:
+                    job.size = listing[filename].st_size
+                    job.size_from = 'sftp'
+
+    return jobs
+
+
+def prioritize(jobs):
+    '''
+    Order jobs by expected size, largest first, so big files (e.g. from
+    ENTSO-E) are under way while the many small ones fill the remaining
+    slots. Jobs of unknown size keep their order at the end.
+
+    '''
+    return sorted(jobs, key=lambda job: -(job.size or 0))
+
+
+def plan_frame(jobs):
+    '''
+    Return the plan as a DataFrame with one row per job, e.g. for a dry run.
+
+    '''
+    return pd.DataFrame(
+        [{'source': job.source_name,
+          'dataset': job.dataset_name,
+          'start': pd.Timestamp(job.start).date(),
+          'end': pd.Timestamp(job.end).date(),
+          'host': job.host,
+          'exists': job.exists,
+          'refresh': job.refresh,
+          'size': job.size,
+          'size_from': job.size_from}
+         for job in jobs],
+        columns=['source', 'dataset', 'start', 'end', 'host', 'exists',
+                 'refresh', 'size', 'size_from'])
+
+
+def log_plan(jobs):
+    '''Log the number of files and expected bytes per dataset.'''
+    df = plan_frame(jobs)
+    if df.empty:
+        logger.info('nothing to download')
+        return
+    df['missing'] = ~df['exists']
+    df['bytes'] = df['size'].where(df['missing'] | df['refresh'], 0)
+    summary = df.groupby(['source', 'dataset'], sort=False).agg(
+        {'start': 'size', 'missing': 'sum', 'refresh': 'sum',
+         'bytes': 'sum'})
+    for (source_name, dataset_name), row in summary.iterrows():
+        logger.info('| {:20.20} | {:20.20} | {:5} files | {:5} missing | '
+                    '{:5} to check | {:8.1f} MB'.format(
+                        source_name, dataset_name, row['start'],
+                        int(row['missing']), int(row['refresh']),
+                        row['bytes'] / 1e6))
+    logger.info('%s of %s files to download or check, about %.1f MB',
+                int((df['missing'] | df['refresh']).sum()), len(df),
+                df['bytes'].sum() / 1e6)
@@ -7,20 +7,59 @@ read.py : read time series files
 
 '''
 import pytz
-import yaml
 import os
 import sys
 import numpy as np
 import pandas as pd
 import logging
+import logging.handlers
+import multiprocessing
+import threading
+from collections import Counter
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, date, time, timedelta
 import xlrd
 from xml.sax import ContentHandler, parse
 from .excel_parser import ExcelHandler
+from .download import list_container
+from .manifest import DownloadManifest
+from .dst import drop_transitions, to_utc, transitions
+from .incremental import merge_parsed
+from .parsed_store import save_parsed
+from .make_json import get_sha_hash
+from .parse_cache import MAX_BYTES, ParseCache, file_key, reader_digest
 
 logger = logging.getLogger(__name__)
 logger.setLevel('DEBUG')
 
+# Version of the read function of each source, part of the key of the files
+# in the parse cache. Bump it when changing what a read function returns.
+READER_VERSIONS = {
+    'OPSD': 2,
+    'CEPS': 2,
+    'ENTSO-E Transparency FTP': 2,
+    'ENTSO-E Data Portal': 2,
+    'ENTSO-E Power Statistics': 2,
+    'Energinet.dk': 2,
+    'Elia': 2,
+    'PSE': 2,
+    'RTE': 2,
+    'Svenska Kraftnaet': 1,
+    '50Hertz': 2,
+    'Amprion': 2,
+    'TenneT': 2,
+    'TransnetBW': 2,
+    'APG': 2,
+    'Terna': 2,
+    'Elexon': 2,
+    'National Grid': 2,
+}
+
+# Per-file progress bars are turned off in worker processes, where they
+# would overwrite each other
+SHOW_PROGRESS = True
+
 
 def read_entso_e_transparency(
         areas,
@@ -124,12 +163,8 @@ def read_entso_e_transparency(
         # DST-handling
         # Hours 2-3 of the DST-day in March are both labelled 3:00, with no possibility
         # to distinguish them. We have to delete both
-        dst_transitions_spring = [d.replace(hour=3, minute=m)
-            for d in pytz.timezone('Europe/Paris')._utc_transition_times
-                if 2000 <= d.year <= datetime.today().year and d.month == 3
-                for m in [0, 15, 30, 45]]
-
-        df = df.loc[~df.index.isin(dst_transitions_spring)]
+        df = drop_transitions(df, 'Europe/Paris', 3, hour=3,
+                              minutes=(0, 15, 30, 45))
 
         # juggle the index and columns
         df.set_index(stacked, append=True, inplace=True)
@@ -197,11 +232,8 @@ def read_pse(filepath):
             'Time': lambda x: '2:00' if x == '2A' else str(int(x) - 1) + ':00'
         }
     )
-    # Create a list of spring-daylight savings time (DST)-transitions
-    dst_transitions_spring = [
-        d.replace(hour=2)
-        for d in pytz.timezone('Europe/Warsaw')._utc_transition_times
-        if 2000 <= d.year <= datetime.today().year and d.month == 3]
+    # Spring-daylight savings time (DST)-transitions
+    dst_transitions_spring = transitions('Europe/Warsaw', 3, hour=2)
 
     # Account for an error where an hour is jumped in the data, incrementing
     # the hour by one
@@ -225,10 +257,8 @@ def read_pse(filepath):
     df.index = pd.to_datetime(df['Date'].astype(str) + ' ' + df['Time'])
 
     # DST-handling
-    # 'ambiguous' refers to how the October dst-transition hour is handled.
-    # 'infer' will attempt to infer dst-transition hours based on order.
-    df.index = df.index.tz_localize('Europe/Warsaw', ambiguous='infer')
-    df.index = df.index.tz_convert(None)
+    # The October dst-transition hour appears twice, in order
+    df.index = to_utc(df.index, 'Europe/Warsaw', autumn='both')
 
     return df
 
@@ -247,8 +277,7 @@ def read_ceps(filepath):
     )
 
     # DST-handling
-    df.index = df.index.tz_localize('Europe/Prague', ambiguous='infer')
-    df.index = df.index.tz_convert(None)
+    df.index = to_utc(df.index, 'Europe/Prague', autumn='both')
 
     return df
 
@@ -265,8 +294,7 @@ def read_elia(filepath):
     )
 
     # DST handling
-    df.index = df.index.tz_localize('Europe/Brussels', ambiguous='infer')
-    df.index = df.index.tz_convert(None)
+    df.index = to_utc(df.index, 'Europe/Brussels', autumn='both')
 
     return df
 
@@ -295,22 +323,14 @@ def read_energinet_dk(filepath):
     df.index = df.iloc[:, 0] + pd.to_timedelta(df.iloc[:, 1], unit='h')
 
     # DST-handling
-    # Create a list of spring-daylight savings time (DST)-transitions
-    dst_transitions_spring = [
-        d.replace(hour=2)
-        for d in pytz.timezone('Europe/Copenhagen')._utc_transition_times
-        if 2000 <= d.year <= datetime.today().year and d.month == 3]
-
     # Drop 3rd hour for (spring) DST-transition from df.
-    df = df[~df.index.isin(dst_transitions_spring)]
+    df = drop_transitions(df, 'Europe/Copenhagen', 3, hour=2)
 
     # Verify that daylight savings time transitions are handled as expected
     check_dst(df.index, autumn_expect=1)
 
-    # Conform index to UTC
-    dst_arr = np.ones(len(df.index), dtype=bool)
-    df.index = df.index.tz_localize('Europe/Copenhagen', ambiguous=dst_arr)
-    df.index = df.index.tz_convert(None)
+    # Conform index to UTC, the October dst-transition hour is in summertime
+    df.index = to_utc(df.index, 'Europe/Copenhagen', autumn='summer')
 
     return df
 
@@ -337,8 +357,7 @@ def read_entso_e_statistics(filepath,):
     df.index = pd.to_datetime(df.pop('date') + ' ' + df.pop('time').str[:5])
 
     # DST-handling
-    df.index = df.index.tz_localize('Europe/Brussels', ambiguous='infer')
-    df.index = df.index.tz_convert(None)
+    df.index = to_utc(df.index, 'Europe/Brussels', autumn='both')
 
     return df
 
@@ -388,10 +407,8 @@ def read_entso_e_portal(filepath):
 
     # Verify that daylight savings time transitions are handled as expected
     check_dst(df.index, autumn_expect=1)
-    # Conform index to UTC
-    dst_arr = np.ones(len(df.index), dtype=bool)
-    df.index = df.index.tz_localize('CET', ambiguous=dst_arr)
-    df.index = df.index.tz_convert(None)
+    # Conform index to UTC, the October dst-transition hour is in summertime
+    df.index = to_utc(df.index, 'CET', autumn='summer')
 
     # Rename regions to comply with naming conventions
     renamer = {'DK_W': 'DK_1', 'UA_W': 'UA_west', 'NI': 'GB_NIR', 'GB': 'GB_GBN'}
@@ -427,8 +444,7 @@ def read_hertz(filepath, dataset_name):
     # during the fall dst-transistion, only the
     # wintertime hour (marked by a B in the data) is reported, the summertime
     # hour, (marked by an A) is missing in the data.
-    # dst_arr is a boolean array consisting only of "False" entries, telling
-    # python to treat the hour from 2:00 to 2:59 as wintertime.
+    # autumn='winter' tells to treat the hour from 2:00 to 2:59 as wintertime.
 
     # Verify that daylight savings time transitions are handled as expected
     check_dst(df.index, autumn_expect=2)
@@ -437,13 +453,10 @@ def read_hertz(filepath, dataset_name):
             (dataset_name == 'wind generation_actual pre-offshore' and
              pd.to_datetime(df.index.values[0]).year == 2015)):
         check_dst(df.index, autumn_expect=2)
-        df.index = df.index.tz_localize('Europe/Berlin', ambiguous='infer')
+        df.index = to_utc(df.index, 'Europe/Berlin', autumn='both')
     else:
-        dst_arr = np.zeros(len(df.index), dtype=bool)
         check_dst(df.index, autumn_expect=1)
-        df.index = df.index.tz_localize('Europe/Berlin', ambiguous=dst_arr)
-
-    df.index = df.index.tz_convert(None)
+        df.index = to_utc(df.index, 'Europe/Berlin', autumn='winter')
 
     variable, attribute = dataset_name.split(' ')[:2]
 
@@ -479,19 +492,16 @@ def read_amprion(filepath, dataset_name):
     # DST-Handling:
     # In the years after 2009, during the fall dst-transistion, only the
     # summertime hour is reported, the wintertime hour is missing in the data.
-    # dst_arr is a boolean array consisting only of "True" entries, telling
-    # python to treat the hour from 2:00 to 2:59 as summertime.
+    # autumn='summer' tells to treat the hour from 2:00 to 2:59 as summertime.
 
     # Verify that daylight savings time transitions are handled as expected
     check_dst(df.index, autumn_expect=0)
 
-    index1 = df.index[df.index.year >= 2018]
-    index1 = index1.tz_localize('Europe/Berlin', ambiguous='infer')
-    index2 = df.index[df.index.year < 2018]
-    dst_arr = np.ones(len(index2), dtype=bool)
-    index2 = index2.tz_localize('Europe/Berlin', ambiguous=dst_arr)
+    index1 = to_utc(df.index[df.index.year >= 2018], 'Europe/Berlin',
+                    autumn='both')
+    index2 = to_utc(df.index[df.index.year < 2018], 'Europe/Berlin',
+                    autumn='summer')
     df.index = index2.append(index1)
-    df.index = df.index.tz_convert(None)
 
     return df
 
@@ -522,27 +532,13 @@ def read_tennet(filepath, dataset_name):
     df.rename(columns=renamer, inplace=True)
     df['date'].fillna(method='ffill', limit=100, inplace=True)
 
-    # Check the rows for irregularities
-    for i, row in df.iterrows():
-        # there must not be more than 100 quarter-hours in a day
-        if row['pos'] > 100:
-            logger.warning('%s th quarter-hour at %s, position %s',
-                           row['pos'], row['date'], i)
-
-        # On the day in March when summertime begins, shift the data forward by
-        # 1 hour, beginning with the 9th quarter-hour, so the index runs again
-        # up to 96
-        elif (row['pos'] == 92 and (
-                (i == len(df.index) - 1) or (df['pos'][i + 1] == 1))):
-            slicer = df[(df['date'] == row['date']) & (df['pos'] >= 9)].index
-            df.loc[slicer, 'pos'] = df['pos'] + 4
-
-        # Instead of having the quarter-hours' index run up to 100, we want
-        # to have it set back by 1 hour beginning from the 13th
-        # quarter-hour, ending at 96
-        elif row['pos'] == 100:  # True when summertime ends in October
-            slicer = df[(df['date'] == row['date']) & (df['pos'] >= 13)].index
-            df.loc[slicer, 'pos'] = df['pos'] - 4
+    # On the day in March when summertime begins, shift the data forward by
+    # 1 hour, beginning with the 9th quarter-hour, so the index runs again
+    # up to 96. Instead of having the quarter-hours' index run up to 100 when
+    # summertime ends in October, we want to have it set back by 1 hour
+    # beginning from the 13th quarter-hour, ending at 96
+    shift_dst_positions(df, 4, spring_from=9, autumn_from=13,
+                        unit='quarter-hour')
 
     # Compute timestamp from position and generate datetime-index
     df['hour'] = (np.trunc((df['pos'] - 1) / 4)).astype(int).astype(str)
@@ -551,8 +547,7 @@ def read_tennet(filepath, dataset_name):
         df['date'] + ' ' + df['hour'] + ':' + df['minute'], dayfirst=True)
 
     # DST-handling
-    df.index = df.index.tz_localize('Europe/Berlin', ambiguous='infer')
-    df.index = df.index.tz_convert(None)
+    df.index = to_utc(df.index, 'Europe/Berlin', autumn='both')
 
     return df
 
@@ -587,9 +582,7 @@ def read_transnetbw(filepath, dataset_name):
     df.loc[slicer, 'time'] = '01:45'
     df.index = pd.to_datetime(df['date'] + ' ' + df['time'], dayfirst=True)
 
-    dst_arr = np.zeros(len(df.index), dtype=bool)
-    df.index = df.index.tz_localize('Europe/Berlin', ambiguous='infer')
-    df.index = df.index.tz_convert(None)
+    df.index = to_utc(df.index, 'Europe/Berlin', autumn='both')
 
     return df
 
@@ -635,7 +628,7 @@ def read_opsd(filepath, param_dict, headers):
         ('CET', '60min', df.loc[:, ['CH', 'DK', 'SE']])]:
 
         # DST-handling
-        ddf.index = ddf.index.tz_localize(timezone).tz_convert(None)
+        ddf.index = to_utc(ddf.index, timezone, autumn='none')
         ddf = ddf.resample(res).ffill().round(0)
 
         # Create the MultiIndex
@@ -721,8 +714,7 @@ def read_apg(filepath):
     df.rename(columns=lambda x: x.replace('  ', ' '), inplace=True)
 
     # DST-handling
-    df.index = df.index.tz_localize('Europe/Vienna', ambiguous='infer')
-    df.index = df.index.tz_convert(None)
+    df.index = to_utc(df.index, 'Europe/Vienna', autumn='both')
 
     return df
 
@@ -750,18 +742,12 @@ def read_rte(filepath):
     # DST handling
     # drop 1 hour after spring dst as it contains inconsistent data (copy of
     # hour before). The 1 hour will later be interpolated
-    dst_transitions_spring = [
-        dd for d in pytz.timezone('Europe/Paris')._utc_transition_times
-        if 2000 <= d.year <= datetime.today().year and d.month == 3
-        for dd in (d.replace(hour=2, minute=0), d.replace(hour=2, minute=30))]
-    df = df.loc[~df.index.isin(dst_transitions_spring)]
+    df = drop_transitions(df, 'Europe/Paris', 3, hour=2, minutes=(0, 30))
 
     # Verify that daylight savings time transitions are handled as expected
     check_dst(df.index, autumn_expect=1)
-    # Conform index to UTC
-    dst_arr = np.zeros(len(df.index), dtype=bool)
-    df.index = df.index.tz_localize('Europe/Paris', ambiguous=dst_arr)
-    df.index = df.index.tz_convert(None)
+    # Conform index to UTC, the October dst-transition hour is in wintertime
+    df.index = to_utc(df.index, 'Europe/Paris', autumn='winter')
 
     return df
 
@@ -784,26 +770,13 @@ def read_GB(filepath):
 
     df.rename(columns=time_cols, inplace=True)
 
-    for i, row in df.iterrows():
-        # there must not be more than 50 half-hours in a day
-        if row['pos'] > 50:
-            logger.warning('%s th half-hour at %s, position %s',
-                           row['pos'], row['date'], i)
-
-        # On the day in March when summertime begins, shift the data forward by
-        # 1 hour, beginning with the 5th half-hour, so the index runs again
-        # up to 48
-        elif (row['pos'] == 46 and (
-                (i == len(df.index) - 1) or (df['pos'][i + 1] == 1))):
-            slicer = df[(df['date'] == row['date']) & (df['pos'] >= 3)].index
-            df.loc[slicer, 'pos'] = df['pos'] + 2
-
-        # Instead of having the half-hours' index run up to 50, we want
-        # to have it set back by 1 hour beginning from the 5th
-        # half-hour, ending at 48
-        elif row['pos'] == 50:  # True when summertime ends in October
-            slicer = df[(df['date'] == row['date']) & (df['pos'] >= 5)].index
-            df.loc[slicer, 'pos'] = df['pos'] - 2
+    # On the day in March when summertime begins, shift the data forward by
+    # 1 hour, beginning with the 3rd half-hour, so the index runs again
+    # up to 48. Instead of having the half-hours' index run up to 50 when
+    # summertime ends in October, we want to have it set back by 1 hour
+    # beginning from the 5th half-hour, ending at 48
+    shift_dst_positions(df, 2, spring_from=3, autumn_from=5,
+                        unit='half-hour')
 
     # Compute timestamp from position and generate datetime-index
     df['hour'] = (np.trunc((df['pos'] - 1) / 2)).astype(int).astype(str)
@@ -812,12 +785,61 @@ def read_GB(filepath):
         df['date'] + ' ' + df['hour'] + ':' + df['minute'], dayfirst=True)
 
     # DST-handling
-    df.index = df.index.tz_localize('Europe/London', ambiguous='infer')
-    df.index = df.index.tz_convert(None)
+    df.index = to_utc(df.index, 'Europe/London', autumn='both')
 
     return df
 
 
+def shift_dst_positions(df, per_hour, spring_from, autumn_from,
+                        unit='interval'):
+    '''
+    Correct the positions of the intervals in a day (column 'pos') on the
+    days summertime begins or ends, in place, so they run up to
+    24 * per_hour as on any other day.
+
+    A day with 23 hours of data that is followed by the first interval of the
+    next day (or ends the file) is taken to be the day summertime begins: its
+    positions from spring_from on are shifted forward by 1 hour. On a day
+    with 25 hours of data, positions from autumn_from on are set back by 1
+    hour. The days are found for all rows at once rather than row by row.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        With columns 'date' and 'pos'
+    per_hour : int
+        Number of intervals per hour, e.g. 4 for quarter-hours
+    spring_from : int
+        First position to shift when summertime begins
+    autumn_from : int
+        First position to shift when summertime ends
+    unit : str
+        Name of the interval, for log messages
+
+    Returns
+    ----------
+    None
+
+    '''
+    day = 24 * per_hour
+
+    # there must not be more than 25 hours in a day
+    for i, row in df.loc[df['pos'] > day + per_hour].iterrows():
+        logger.warning('%s th %s at %s, position %s',
+                       row['pos'], unit, row['date'], i)
+
+    followed_by_new_day = np.append(df['pos'].values[1:] == 1, True)
+    spring = (df['pos'].values == day - per_hour) & followed_by_new_day
+    spring_days = (df['date'].isin(df.loc[spring, 'date']) &
+                   df['date'].notna())
+    df.loc[spring_days & (df['pos'] >= spring_from), 'pos'] += per_hour
+
+    autumn = df['pos'].values == day + per_hour
+    autumn_days = (df['date'].isin(df.loc[autumn, 'date']) &
+                   df['date'].notna())
+    df.loc[autumn_days & (df['pos'] >= autumn_from), 'pos'] -= per_hour
+
+
 def terna_file_to_initial_dataframe(filepath):
     '''
     Parse the xml or read excel directly, 
@@ -935,15 +957,10 @@ def read_terna(filepath, filedate, param_dict, headers):
     # drop autumn dst hours as they contain inconsistent data
     # (apparently 2:00 and 3:00 are added up and reported as value for 2:00).
     # The 2 hours will later be interpolated
-    dst_transitions_autumn = [
-        d.replace(hour=2)
-        for d in pytz.timezone('Europe/Rome')._utc_transition_times
-        if 2000 <= d.year <= datetime.today().year and d.month == 10]
-    df = df.loc[~df.index.isin(dst_transitions_autumn)]
+    df = drop_transitions(df, 'Europe/Rome', 10, hour=2)
 
     # Covert to UTC
-    df.index = df.index.tz_localize('Europe/Rome')
-    df.index = df.index.tz_convert(None)
+    df.index = to_utc(df.index, 'Europe/Rome', autumn='none')
 
     # Create the MultiIndex
     cols = [tuple(param_dict['colmap'][level]
@@ -997,29 +1014,201 @@ def read(
         headers,
         start_from_user,
         end_from_user,
-        testmode=False):
+        testmode=False,
+        since=None,
+        delta_path=None,
+        max_workers=1,
+        parse_workers=1,
+        cache_path=None,
+        cache_size=MAX_BYTES):
+    '''
+    Read the downloaded files of all datasets in sources and save the parsed
+    data to parsed_path. See read_dataset() for info on parameters.
+
+    Parameters
+    ----------
+    max_workers : int or None, default 1
+        Number of datasets read at the same time, each in a process of its
+        own. None for one per CPU.
+    parse_workers : int or None, default 1
+        Number of processes parsing the files of one dataset at the same
+        time, if datasets are read one after another (max_workers=1).
+    cache_path : str, optional
+        Directory of a ParseCache, so only new or changed files are parsed
+        again.
+    cache_size : int, default parse_cache.MAX_BYTES
+        Size limit of the cache in bytes
+
+    '''
+    if delta_path is not None:
+        os.makedirs(delta_path, exist_ok=True)
+
+    # Look up the downloaded files in the manifest instead of scanning
+    # data_path, if there is one
+    manifest_path = os.path.join(data_path, 'manifest.sqlite')
+    if os.path.exists(manifest_path):
+        manifest = DownloadManifest(manifest_path)
+    else:
+        manifest = None
 
     # For each source in the source dictionary
+    jobs = []
     for source_name, source_dict in sources.items():
         # For each dataset from source_name
         for dataset_name, param_dict in source_dict.items():
             if source_name == 'Svenska Kraftnaet':
                 param_dict['colmap'] = source_dict['wind_solar_1']['colmap']
 
-            read_dataset(
-                source_name,
-                dataset_name,
-                param_dict,
-                data_path,
-                parsed_path,
-                areas,
-                headers,
+            jobs.append(dict(
+                source_name=source_name,
+                dataset_name=dataset_name,
+                param_dict=param_dict,
+                data_path=data_path,
+                parsed_path=parsed_path,
+                areas=areas,
+                headers=headers,
                 start_from_user=start_from_user,
                 end_from_user=end_from_user,
-                testmode=testmode)
+                testmode=testmode,
+                since=(since or {}).get((source_name, dataset_name)),
+                delta_path=delta_path))
+
+    if max_workers == 1:
+        cache = None
+        if cache_path is not None:
+            cache = ParseCache(cache_path, cache_size)
+        for job in jobs:
+            read_dataset(manifest=manifest, parse_workers=parse_workers,
+                         cache=cache, **job)
+        if cache is not None:
+            cache.close()
+    else:
+        read_parallel(jobs, manifest_path if manifest is not None else None,
+                      max_workers, manifest, cache_path, cache_size)
+
+    if manifest is not None:
+        manifest.close()
     return
 
 
+def read_parallel(jobs, manifest_path=None, max_workers=None,
+                  manifest=None, cache_path=None, cache_size=MAX_BYTES):
+    '''
+    Run read_dataset() for each job on a pool of processes, the datasets with
+    the most data first, so the large ones do not hold up the end.
+
+    Log messages of the workers are passed to the loggers of this process,
+    and a progress bar counts the datasets done.
+
+    Parameters
+    ----------
+    jobs : list
+        Keyword arguments to read_dataset(), without manifest
+    manifest_path : str, optional
+        DownloadManifest for the workers to open
+    manifest : DownloadManifest, optional
+        Open manifest to estimate the amount of data of each job
+    cache_path : str, optional
+        ParseCache for the workers to open
+    cache_size : int, default parse_cache.MAX_BYTES
+
+    Returns
+    ----------
+    failed : dict
+        Maps (source_name, dataset_name) of the jobs that raised to the
+        exception, which is logged as well.
+
+    '''
+    def weight(job):
+        files = dataset_files(job['data_path'], job['source_name'],
+                              job['dataset_name'], job['start_from_user'],
+                              job['end_from_user'], manifest)
+        return sum(size for container, filename, size in files)
+
+    jobs = sorted(jobs, key=weight, reverse=True)
+
+    log_manager = multiprocessing.Manager()
+    log_queue = log_manager.Queue()
+    forwarder = threading.Thread(target=forward_logs, args=(log_queue,),
+                                 daemon=True)
+    forwarder.start()
+
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             initializer=init_worker,
+                             initargs=(log_queue,)) as executor:
+        futures = {executor.submit(read_dataset_worker, manifest_path, job,
+                                   cache_path, cache_size):
+                   job for job in jobs}
+        done = 0
+        failed = {}
+        update_progress(done, len(jobs), '')
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(' {:20.20} | {:20.20} | failed: {!r}'.format(
+                    job['source_name'], job['dataset_name'], e))
+                failed[job['source_name'], job['dataset_name']] = e
+            done += 1
+            update_progress(done, len(jobs), '| {} | {}'.format(
+                job['source_name'], job['dataset_name']))
+
+    log_queue.put(None)
+    forwarder.join()
+    log_manager.shutdown()
+    return failed
+
+
+def init_worker(log_queue):
+    '''
+    Send the log records of a worker process to log_queue instead of the
+    handlers inherited from the parent, and turn off progress bars.
+
+    '''
+    global SHOW_PROGRESS
+    SHOW_PROGRESS = False
+    for name in list(logging.root.manager.loggerDict):
+        log = logging.getLogger(name)
+        if isinstance(log, logging.Logger):
+            log.handlers = []
+    logging.root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    logging.root.setLevel('DEBUG')
+
+
+def read_dataset_worker(manifest_path, job, cache_path=None,
+                        cache_size=MAX_BYTES):
+    '''
+    Run read_dataset() in a worker process, with its own manifest and
+    parse cache.
+
+    '''
+    manifest = None
+    if manifest_path is not None:
+        manifest = DownloadManifest(manifest_path)
+    cache = None
+    if cache_path is not None:
+        cache = ParseCache(cache_path, cache_size)
+    try:
+        read_dataset(manifest=manifest, cache=cache, **job)
+    finally:
+        if manifest is not None:
+            manifest.close()
+        if cache is not None:
+            cache.close()
+
+
+def forward_logs(log_queue):
+    '''Hand log records from worker processes to the loggers here.'''
+    while True:
+        record = log_queue.get()
+        if record is None:
+            break
+        log = logging.getLogger(record.name)
+        if log.isEnabledFor(record.levelno):
+            log.handle(record)
+
+
 def read_dataset(
         source_name,
         dataset_name,
@@ -1030,7 +1219,12 @@ def read_dataset(
         headers,
         start_from_user=None,
         end_from_user=None,
-        testmode=False):
+        testmode=False,
+        manifest=None,
+        since=None,
+        delta_path=None,
+        parse_workers=1,
+        cache=None):
     '''
     For the sources specified in the sources.yml file, pass each downloaded
     file to the correct read function.
@@ -1050,7 +1244,8 @@ def read_dataset(
     data_path : str, default: 'original_data'
         Base download directory in which to save all downloaded files
     parsed_path : str
-        Directory where to store parsed data as pickle files
+        Directory where to store parsed data, as Parquet files if pyarrow
+        is installed, as pickle files otherwise
     areas : pandas.DataFrame
         Contains mapping of available geographical areas showing how
         countries, bidding zones, control areas relate to each other
@@ -1060,6 +1255,22 @@ def read_dataset(
         End of period for which to read the data
     testmode : bool
         If True, only read one file per source. Use for testing purposes.
+    manifest : DownloadManifest, optional
+        Index of the downloaded files. If not given or if it has no files for
+        the dataset, data_path is scanned instead.
+    since : datetime.date, optional
+        Date of the last timestamp parsed before, see
+        incremental.last_parsed_dates(). If given, only the files from then
+        on are read, and the result replaces the rows from that date in the
+        data parsed before.
+    delta_path : str, optional
+        With since, directory to also save just the newly read data to.
+    parse_workers : int or None, default 1
+        Number of processes parsing the files of the dataset at the same
+        time, None for one per CPU.
+    cache : ParseCache, optional
+        Where to take the DataFrames of files parsed before from, and to
+        save those of the others to.
 
     Returns
     ----------
@@ -1069,16 +1280,21 @@ def read_dataset(
     '''
 
     # The cumulated dict will store parsed data from all files from one dataset
-    cumulated = {'15min': pd.DataFrame(),
-                 '30min': pd.DataFrame(),
-                 '60min': pd.DataFrame()}
-
-    dataset_dir = os.path.join(data_path, source_name, dataset_name)
+    cumulated = {'15min': [],
+                 '30min': [],
+                 '60min': []}
 
     logger.info(' {:20.20} | {:20.20} | reading...'
                 .format(source_name, dataset_name))
 
-    files_existing = sum([len(files) for r, d, files in os.walk(dataset_dir)])
+    if since is not None and (start_from_user is None or
+                              since > start_from_user):
+        start_from_user = since
+
+    # Files of the period covered, skipping those excluded by user
+    files = dataset_files(data_path, source_name, dataset_name,
+                          start_from_user, end_from_user, manifest)
+    files_existing = len(files)
     files_success = 0
 
     # Check if there are files for dataset_name
@@ -1086,106 +1302,245 @@ def read_dataset(
         logger.warning('no files found')
         return
 
-    # Check if there are folders for dataset_name
-    if not os.path.exists(dataset_dir):
-        logger.warning('folder not found')
-        return
-
-    # For each file downloaded for that dataset
-    for container in sorted(os.listdir(dataset_dir)):
-        files = os.listdir(os.path.join(dataset_dir, container))
-
-        # Skip this file if period covered excluded by user
-        if start_from_user:
-            # start lies after file end => filecontent is too old
-            if start_from_user > yaml.full_load(container.split('_')[1]):
-                continue  # go to next container
+    files_per_container = Counter(c for c, filename, size in files)
 
-        if end_from_user:
-            # end lies before file start => filecontent is too recent
-            if end_from_user < yaml.full_load(container.split('_')[0]) - timedelta(days=1):
-                continue  # go to next container
+    # Check the files of each container first, so they can be parsed in
+    # parallel
+    to_read = []
+    for container, filename, size in files:
+        filepath = os.path.join(container, filename)
 
         # Check if there is only one file per folder
-        if len(files) == 0:
-            logger.warning(container + 'no file found')
-            continue
-
-        elif len(files) > 1:
+        if files_per_container[container] > 1:
             logger.warning(container + '> 1 file found')
             continue
 
-        filepath = os.path.join(dataset_dir, container, files[0])
+        container = os.path.basename(container)
 
         # Check if file is not empty
-        if os.path.getsize(filepath) < 128:
+        if size < 128:
             logger.warning(container + 'file too small')
             continue
 
-        # First call to update_progress
-        update_progress(files_success, files_existing, container)
-
-        # Select read function for source
-        if source_name == 'OPSD':
-            parsed = read_opsd(filepath, param_dict, headers)
-        elif source_name == 'CEPS':
-            parsed = {'60min': read_ceps(filepath)}
-        elif source_name == 'ENTSO-E Transparency FTP':
-            parsed = read_entso_e_transparency(
-                areas, filepath, dataset_name, headers, **param_dict)
-        elif source_name == 'ENTSO-E Data Portal':
-            parsed = {'60min': read_entso_e_portal(filepath)}
-        elif source_name == 'ENTSO-E Power Statistics':
-            parsed = {'60min': read_entso_e_statistics(filepath)}
-        elif source_name == 'Energinet.dk':
-            parsed = {'60min': read_energinet_dk(filepath)}
-        elif source_name == 'Elia':
-            parsed = {'15min': read_elia(filepath)}
-        elif source_name == 'PSE':
-            parsed = {'60min': read_pse(filepath)}
-        elif source_name == 'RTE':
-            parsed = {'30min': read_rte(filepath)}
-        elif source_name == 'Svenska Kraftnaet':
-            parsed = {'60min': read_svenska_kraftnaet(filepath, dataset_name)}
-        elif source_name == '50Hertz':
-            parsed = {'15min': read_hertz(filepath, dataset_name)}
-        elif source_name == 'Amprion':
-            parsed = {'15min': read_amprion(filepath, dataset_name)}
-        elif source_name == 'TenneT':
-            parsed = {'15min': read_tennet(filepath, dataset_name)}
-        elif source_name == 'TransnetBW':
-            parsed = {'15min': read_transnetbw(filepath, dataset_name)}
-        elif source_name == 'APG':
-            parsed = {'15min': read_apg(filepath)}
-        elif source_name == 'Terna':
-            # Files from 2010-2011 are in tsv format, we ignore them
-            filedate = datetime.strptime(
-                filepath.split(os.sep)[-1].split('_')[0], '%Y-%m-%d').date()
-            if filedate < date(2011, 2, 1):
+        to_read.append((container, filename, filepath))
+
+    # Files parsed before with the same reader are taken from the cache
+    digest = None
+    if cache is not None:
+        digest = reader_digest(source_name, dataset_name, param_dict,
+                               headers, READER_VERSIONS.get(source_name, 1),
+                               areas)
+    keys = {}
+    hits = set()
+    cached = {}
+
+    def lookup(i):
+        if digest is not None and i not in keys:
+            # Hashes of downloaded files are kept in the manifest
+            filepath = to_read[i][2]
+            sha256 = (manifest.sha256(filepath) if manifest is not None
+                      else get_sha_hash(filepath))
+            keys[i] = file_key(sha256, digest)
+            cached[i] = cache.get(keys[i])
+            if cached[i] is not None:
+                hits.add(i)
+        return i in hits
+
+    # Parse the others, in worker processes if there are several. Results
+    # come back in the order of the containers either way. In testmode,
+    # files are parsed one by one until one has data.
+    executor = None
+    serial = testmode or parse_workers == 1 or len(to_read) < 2
+    if serial:
+        parsed_files = (read_file(source_name, dataset_name, param_dict,
+                                  to_read[i][2], areas, headers)
+                        for i in range(len(to_read)) if not lookup(i))
+    else:
+        filepaths = [to_read[i][2] for i in range(len(to_read))
+                     if not lookup(i)]
+        executor = ProcessPoolExecutor(max_workers=parse_workers)
+        chunksize = max(1, len(filepaths) // (
+            (parse_workers or os.cpu_count() or 1) * 4))
+        parsed_files = executor.map(
+            read_file, repeat(source_name), repeat(dataset_name),
+            repeat(param_dict), filepaths, repeat(areas), repeat(headers),
+            chunksize=chunksize)
+
+    def parse_all():
+        for i in range(len(to_read)):
+            if lookup(i):
+                yield cached.pop(i)
                 continue
-            else:
-                parsed = {'60min': read_terna(
-                    filepath, filedate, param_dict, headers)}
-        elif source_name in ['Elexon', 'National Grid']:
-            parsed = {'30min': read_GB(filepath)}
-
-        # combine with previously parsed DataFrames from same dataset and same
-        # resolution
-        for res_key, df in parsed.items():
-            if res_key in param_dict['resolution'] and df.empty:
-                logger.info('%s | %s | empty DataFrame: ', files[0], res_key)
+            cached.pop(i, None)
+            parsed = next(parsed_files)
+            if digest is not None and parsed is not None:
+                cache.put(keys[i], parsed)
+            yield parsed
+
+    # First call to update_progress
+    update_progress(files_success, files_existing, '')
+    try:
+        for (container, filename, filepath), parsed in zip(to_read,
+                                                           parse_all()):
+            if parsed is None:
                 continue
 
-            if cumulated[res_key].empty:
-                cumulated[res_key] = df
-            else:
-                cumulated[res_key] = cumulated[res_key].combine_first(df)
+            # combine with previously parsed DataFrames from same dataset and
+            # same resolution
+            add_parsed(cumulated, parsed, param_dict, filename)
+
+            files_success += 1
+            update_progress(files_success, files_existing, container)
+            if testmode:
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    save_dataset(cumulated, source_name, dataset_name, param_dict,
+                 parsed_path, headers, start_from_user, end_from_user,
+                 since, delta_path)
+
+    return
 
-        files_success += 1
-        update_progress(files_success, files_existing, container)
-        if testmode:
-            break
 
+def read_file(source_name, dataset_name, param_dict, filepath, areas,
+              headers):
+    '''
+    Pass a downloaded file to the read function of its source. See
+    read_dataset() for info on parameters.
+
+    Returns
+    ----------
+    parsed : dict or None
+        DataFrames by resolution, None if the file is not to be read
+
+    '''
+    if source_name == 'OPSD':
+        parsed = read_opsd(filepath, param_dict, headers)
+    elif source_name == 'CEPS':
+        parsed = {'60min': read_ceps(filepath)}
+    elif source_name == 'ENTSO-E Transparency FTP':
+        parsed = read_entso_e_transparency(
+            areas, filepath, dataset_name, headers, **param_dict)
+    elif source_name == 'ENTSO-E Data Portal':
+        parsed = {'60min': read_entso_e_portal(filepath)}
+    elif source_name == 'ENTSO-E Power Statistics':
+        parsed = {'60min': read_entso_e_statistics(filepath)}
+    elif source_name == 'Energinet.dk':
+        parsed = {'60min': read_energinet_dk(filepath)}
+    elif source_name == 'Elia':
+        parsed = {'15min': read_elia(filepath)}
+    elif source_name == 'PSE':
+        parsed = {'60min': read_pse(filepath)}
+    elif source_name == 'RTE':
+        parsed = {'30min': read_rte(filepath)}
+    elif source_name == 'Svenska Kraftnaet':
+        parsed = {'60min': read_svenska_kraftnaet(filepath, dataset_name)}
+    elif source_name == '50Hertz':
+        parsed = {'15min': read_hertz(filepath, dataset_name)}
+    elif source_name == 'Amprion':
+        parsed = {'15min': read_amprion(filepath, dataset_name)}
+    elif source_name == 'TenneT':
+        parsed = {'15min': read_tennet(filepath, dataset_name)}
+    elif source_name == 'TransnetBW':
+        parsed = {'15min': read_transnetbw(filepath, dataset_name)}
+    elif source_name == 'APG':
+        parsed = {'15min': read_apg(filepath)}
+    elif source_name == 'Terna':
+        # Files from 2010-2011 are in tsv format, we ignore them
+        filedate = datetime.strptime(
+            filepath.split(os.sep)[-1].split('_')[0], '%Y-%m-%d').date()
+        if filedate < date(2011, 2, 1):
+            parsed = None
+        else:
+            parsed = {'60min': read_terna(
+                filepath, filedate, param_dict, headers)}
+    elif source_name in ['Elexon', 'National Grid']:
+        parsed = {'30min': read_GB(filepath)}
+
+    return parsed
+
+
+def add_parsed(cumulated, parsed, param_dict, filename):
+    '''
+    Collect the DataFrames parsed from a file with those of the files of the
+    same dataset read before, by resolution. They are combined by
+    combine_pieces() once all files are read.
+
+    '''
+    for res_key, df in parsed.items():
+        if res_key in param_dict['resolution'] and df.empty:
+            logger.info('%s | %s | empty DataFrame: ', filename, res_key)
+            continue
+
+        # Like an empty result of combine_first(), an empty DataFrame before
+        # the first with data is dropped
+        if df.empty and not cumulated[res_key]:
+            continue
+        cumulated[res_key].append(df)
+
+
+def combine_pieces(pieces):
+    '''
+    Combine the DataFrames parsed from the files of a dataset in one step.
+
+    The result is the same as combining them one by one with
+    combine_first(): for each timestamp and column, the first value that is
+    not NaN is kept, so data from earlier files takes precedence. Doing it
+    in one concat and groupby takes time linear in the number of files
+    rather than quadratic.
+
+    Parameters
+    ----------
+    pieces : list
+        DataFrames in the order of their files
+
+    Returns
+    ----------
+    df : pandas.DataFrame
+
+    '''
+    if not pieces:
+        return pd.DataFrame()
+    if len(pieces) == 1:
+        return pieces[0]
+
+    # combine_first() returns the union of the columns. Index.union() keeps
+    # the order if the columns are the same and sorts them if possible
+    # otherwise.
+    columns = pieces[0].columns
+    for df in pieces[1:]:
+        columns = columns.union(df.columns)
+
+    df = pd.concat(pieces, sort=False)
+    if df.index.is_unique:
+        df = df.sort_index()
+    else:
+        df = df.groupby(level=0, sort=True).first()
+    return df.reindex(columns=columns)
+
+
+def save_dataset(
+        cumulated,
+        source_name,
+        dataset_name,
+        param_dict,
+        parsed_path,
+        headers,
+        start_from_user=None,
+        end_from_user=None,
+        since=None,
+        delta_path=None):
+    '''
+    Combine the DataFrames parsed from the files of a dataset, create the
+    MultiIndex, trim them and save them to parsed_path. cumulated maps each
+    resolution to a list of DataFrames as collected by add_parsed(). See
+    read_dataset() for info on the other parameters.
+
+    '''
+    cumulated = {res_key: combine_pieces(pieces)
+                 for res_key, pieces in cumulated.items()}
     if all([df.empty for df in cumulated.values()]):
         logger.warning(' {:20.20} | {:20.20} | All empty DataFrames'
                        .format(source_name, dataset_name))
@@ -1212,12 +1567,90 @@ def read_dataset(
             start_from_user,
             end_from_user)
 
-        filename = '_'.join([res_key, source_name, dataset_name]) + '.pickle'
-        df.to_pickle(os.path.join(parsed_path, filename))
+        if since is not None:
+            merge_parsed(parsed_path, res_key, source_name, dataset_name, df,
+                         delta_path)
+            continue
+
+        save_parsed(df, parsed_path, res_key, source_name, dataset_name)
+        if delta_path is not None:
+            save_parsed(df, delta_path, res_key, source_name, dataset_name)
 
     return
 
 
+def dataset_files(
+        data_path,
+        source_name,
+        dataset_name,
+        start_from_user=None,
+        end_from_user=None,
+        manifest=None):
+    '''
+    List the downloaded files of a dataset that cover part of the period
+    requested by the user.
+
+    Parameters
+    ----------
+    manifest : DownloadManifest, optional
+        Index to query for the files. Containers it does not know, e.g. of
+        files downloaded without it, are listed from data_path and added to
+        it, and rows of files deleted since are dropped from it.
+
+    See read_dataset() for info on the other parameters.
+
+    Returns
+    ----------
+    files : list
+        Tuples (container, filename, size), sorted by container.
+
+    '''
+    files = []
+    indexed = set()
+    if manifest is not None:
+        for container, filename, size in manifest.files(
+                source_name, dataset_name, start_from_user, end_from_user):
+            if not os.path.isfile(os.path.join(container, filename)):
+                logger.info('%s no longer in %s, dropped from the manifest',
+                            filename, container)
+                manifest.forget(container)
+                continue
+            indexed.add(os.path.normpath(container))
+            files.append((container, filename, size))
+
+    dataset_dir = os.path.join(data_path, source_name, dataset_name)
+    if not os.path.exists(dataset_dir):
+        return files
+
+    for name in sorted(os.listdir(dataset_dir)):
+        container = os.path.join(dataset_dir, name)
+        if os.path.normpath(container) in indexed:
+            continue
+        try:
+            start, end = [datetime.strptime(d, '%Y-%m-%d').date()
+                          for d in name.split('_')]
+        except ValueError:
+            continue
+
+        # start lies after file end => filecontent is too old
+        if start_from_user and start_from_user > end:
+            continue
+
+        # end lies before file start => filecontent is too recent
+        if end_from_user and end_from_user < start - timedelta(days=1):
+            continue
+
+        # Interrupted downloads are not listed
+        found = list_container(container)
+        for filename in found:
+            files.append((container, filename, os.path.getsize(
+                os.path.join(container, filename))))
+        if manifest is not None and len(found) == 1:
+            manifest.record(os.path.join(container, found[0]), hashed=False)
+
+    return sorted(files)
+
+
 def trim_df(
         df0,
         res_key,
@@ -1305,6 +1738,9 @@ def update_progress(count, total, container):
 
     '''
 
+    if not SHOW_PROGRESS:
+        return
+
     barLength = 50  # Modify this to change the length of the progress bar
     status = 'reading'
     progress = count / total
@@ -1387,7 +1823,7 @@ def check_dst(index, autumn_expect=2, timezone='CET'):
     expected number, informing when they deviate. In reality, the DST-hours
     appear 0 times in March and 2 times in October.
     Note: When the expected number for October is 2, we don't need this function
-    since df.index.tz_localize('Europe/Berlin', ambiguous='infer') throws an 
+    since to_utc(df.index, 'Europe/Berlin', autumn='both') throws an
     exception if the actual number is 1
 
     Parameters
@@ -1405,15 +1841,15 @@ def check_dst(index, autumn_expect=2, timezone='CET'):
 
     '''
     transition_hour = {'CET': 2, 'WET': 1}
-    dst_transitions_spring = [
-        d.replace(hour=transition_hour[timezone])
-        for d in pytz.timezone(timezone)._utc_transition_times
-        if 2000 <= d.year <= datetime.today().year and d.month == 3]
-
-    dst_transitions_autumn = [
-        d.replace(hour=transition_hour[timezone])
-        for d in pytz.timezone(timezone)._utc_transition_times
-        if 2000 <= d.year <= datetime.today().year and d.month == 10]
+    dst_transitions_spring = transitions(timezone, 3,
+                                         transition_hour[timezone])
+    dst_transitions_autumn = transitions(timezone, 10,
+                                         transition_hour[timezone])
+
+    # Only the timestamps on the days of the transitions are counted
+    index = index[index.isin(
+        dst_transitions_spring + dst_transitions_autumn +
+        tuple(d.replace(hour=0) for d in dst_transitions_autumn))]
 
     for d1, d2 in zip(dst_transitions_spring, dst_transitions_autumn):
         if d1 in index:
@@ -0,0 +1,141 @@
+'''
+Open Power System Data
+
+Time series Datapackage
+
+retry.py : per-source retry policies for downloads
+
+'''
+
+import logging
+import random
+import threading
+
+logger = logging.getLogger(__name__)
+logger.setLevel('DEBUG')
+
+
+class RetryLater(Exception):
+    '''
+    Raised by a download attempt that failed but may succeed later. The
+    scheduler runs the job again after ``delay`` seconds without blocking
+    other downloads in the meantime.
+
+    '''
+
+    def __init__(self, delay, reason=''):
+        super().__init__(reason)
+        self.delay = delay
+        self.reason = reason
+
+
+class RetryPolicy():
+    '''
+    When and how often to retry a failed download, configured per dataset
+    with a ``retry`` entry in sources.yml, e.g.::
+
+        retry:
+            attempts: 10
+            backoff: 30
+            factor: 2
+            max_backoff: 600
+            jitter: 0.2
+            timeout: 60
+            retry_on: [429, 500, 502, 503, 504]
+
+    Parameters
+    ----------
+    attempts : int, default 3
+        Total number of attempts, including the first one.
+    backoff : float, default 5
+        Seconds to wait before the first retry.
+    factor : float, default 2
+        Multiplier applied to the wait before each further retry.
+    max_backoff : float, default 300
+        Upper bound of the wait between two attempts.
+    jitter : float, default 0.2
+        Randomly lengthen each wait by up to this fraction, so retries of
+        many files do not hit the server at the same time.
+    timeout : float, default 120
+        Seconds to wait for the server to connect or send data.
+    retry_on : list, default [429, 500, 502, 503, 504]
+        HTTP status codes worth retrying. Timeouts and connection errors are
+        always retried.
+
+    '''
+
+    def __init__(self, attempts=3, backoff=5, factor=2, max_backoff=300,
+                 jitter=0.2, timeout=120,
+                 retry_on=(429, 500, 502, 503, 504)):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.factor = factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.timeout = timeout
+        self.retry_on = set(retry_on)
+
+    @classmethod
+    def from_params(cls, param_dict):
+        '''Create the policy from the ``retry`` entry of a dataset.'''
+        return cls(**(param_dict.get('retry') or {}))
+
+    def delay(self, attempt):
+        '''Return the seconds to wait after the given failed attempt.'''
+        delay = min(self.backoff * self.factor ** (attempt - 1),
+                    self.max_backoff)
+        return delay * (1 + random.uniform(0, self.jitter))
+
+    def check(self, attempt, status=None, error=None):
+        '''
+        Raise RetryLater if a failed attempt should be repeated, otherwise
+        return so the caller can give up.
+
+        Parameters
+        ----------
+        attempt : int
+            1-based number of the attempt that failed
+        status : int, optional
+            HTTP status code of the response
+        error : Exception, optional
+            Timeout or connection error raised by the attempt
+
+        '''
+        if attempt >= self.attempts:
+            return
+        if error is None and status not in self.retry_on:
+            return
+        reason = 'http status {}'.format(status) if error is None else error
+        raise RetryLater(self.delay(attempt), reason)
+
+
+class RetryStats():
+    '''
+    Thread-safe counters of attempts, retries, failures and time spent
+    waiting for retries, per source.
+
+    '''
+
+    fields = ['attempts', 'retries', 'failed', 'wait']
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sources = {}
+
+    def record(self, source_name, **counts):
+        '''Add counts to the counters of source_name.'''
+        with self._lock:
+            stats = self.sources.setdefault(
+                source_name, dict.fromkeys(self.fields, 0))
+            for key, value in counts.items():
+                stats[key] += value
+
+    def log(self):
+        '''Log the counters of all sources that needed retries.'''
+        for source_name, stats in sorted(self.sources.items()):
+            if stats['retries'] or stats['failed']:
+                logger.info('{:20.20} | {} attempts | {} retries | {} failed '
+                            '| {:.0f} s waited'.format(
+                                source_name, stats['attempts'],
+                                stats['retries'], stats['failed'],
+                                stats['wait']))
@@ -0,0 +1,255 @@
+'''
+Open Power System Data
+
+Time series Datapackage
+
+scheduler.py : run download jobs concurrently on a thread pool
+
+'''
+
+import itertools
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+import requests
+
+from .retry import RetryLater, RetryStats
+
+logger = logging.getLogger(__name__)
+logger.setLevel('DEBUG')
+
+# Result of a job that failed and was submitted again
+RESCHEDULED = 'rescheduled'
+
+
+def host_of(url):
+    '''
+    Return the host part of a URL, e.g. ``www.amprion.net``, or the URL
+    itself if it can not be parsed (e.g. an SFTP hostname).
+
+    '''
+    if not url:
+        return None
+    return urlparse(url).netloc or url
+
+
+class HostQueue():
+    '''Jobs waiting for a host and the number running against it.'''
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.running = 0
+        self.waiting = deque()
+
+    @property
+    def ready(self):
+        return bool(self.waiting) and self.running < self.limit
+
+
+class DownloadScheduler():
+    '''
+    Run download jobs on a thread pool with a global concurrency cap and
+    a cap per host.
+
+    Jobs wait in one queue per host and are only handed to the pool when
+    both a worker and a slot for their host are free, so jobs for a host at
+    its cap do not hold workers that could serve other hosts. Among the
+    hosts with a free slot, the job submitted first runs first.
+
+    Each worker thread keeps its own requests.session, so connections to a
+    host are reused between the jobs that worker runs. A job that raises
+    RetryLater gives up its worker and is queued again after the delay,
+    so a source in backoff does not hold up the other downloads.
+
+    Parameters
+    ----------
+    max_workers : int, default 8
+        Maximum number of downloads in flight at the same time.
+    default_host_limit : int, default 2
+        Maximum number of downloads in flight per host, for hosts without a
+        ``max_connections`` entry in sources.yml.
+
+    '''
+
+    def __init__(self, max_workers=8, default_host_limit=2):
+        self.max_workers = max_workers
+        self.default_host_limit = default_host_limit
+        self.stats = RetryStats()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._hosts = {}
+        self._running = 0
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._futures = []
+        self._cleanups = []
+        # Jobs submitted and not yet finished, including those waiting for a
+        # retry
+        self._outstanding = 0
+        self._finished = threading.Condition(self._lock)
+
+    def _queue(self, host, host_limit):
+        # One queue per host, created with the limit from the first job
+        # submitted for that host. Called with the lock held.
+        if host not in self._hosts:
+            limit = min(host_limit or self.default_host_limit,
+                        self.max_workers)
+            self._hosts[host] = HostQueue(limit)
+            logger.debug('%s: at most %s concurrent downloads', host, limit)
+        return self._hosts[host]
+
+    def _enqueue(self, host, func, args, kwargs, future):
+        with self._lock:
+            self._hosts[host].waiting.append(
+                (next(self._order), func, args, kwargs, future))
+            self._dispatch()
+
+    def _dispatch(self):
+        # Hand waiting jobs to the pool while workers are free. Called with
+        # the lock held.
+        while self._running < self.max_workers:
+            ready = [(queue.waiting[0][0], host)
+                     for host, queue in self._hosts.items() if queue.ready]
+            if not ready:
+                return
+            host = min(ready, key=lambda x: x[0])[1]
+            queue = self._hosts[host]
+            _, func, args, kwargs, future = queue.waiting.popleft()
+            queue.running += 1
+            self._running += 1
+            self._executor.submit(self._run, host, func, args, kwargs,
+                                  future)
+
+    def _release(self, host):
+        with self._lock:
+            self._hosts[host].running -= 1
+            self._running -= 1
+            self._dispatch()
+
+    def session(self):
+        '''Return the requests.session of the calling worker thread.'''
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.session()
+        return self._local.session
+
+    def _run(self, host, func, args, kwargs, future):
+        source_name = args[0] if args else kwargs.get('source_name')
+        self.stats.record(source_name, attempts=1)
+        try:
+            session = kwargs.get('session') or self.session()
+            downloaded, session = func(
+                *args, **dict(kwargs, session=session))
+        except RetryLater as e:
+            self._release(host)
+            attempt = kwargs.get('attempt', 1)
+            logger.warning('%s, attempt %s, trying again in %.0f s',
+                           e.reason, attempt, e.delay)
+            self.stats.record(source_name, retries=1, wait=e.delay)
+            retry = threading.Timer(
+                e.delay, self._enqueue,
+                (host, func, args, dict(kwargs, attempt=attempt + 1),
+                 self._future()))
+            retry.daemon = True
+            retry.start()
+            future.set_result(RESCHEDULED)
+            return
+        except Exception as e:
+            self._release(host)
+            future.set_exception(e)
+            self._finish()
+            return
+
+        self._release(host)
+        if not downloaded:
+            self.stats.record(source_name, failed=1)
+        future.set_result(downloaded)
+        self._finish()
+
+    def _finish(self):
+        with self._finished:
+            self._outstanding -= 1
+            self._finished.notify_all()
+
+    def _future(self):
+        future = Future()
+        with self._lock:
+            self._futures.append(future)
+        return future
+
+    def submit(self, func, *args, host=None, host_limit=None, **kwargs):
+        '''
+        Schedule func(*args, session=..., **kwargs) to run on the pool.
+
+        Parameters
+        ----------
+        func : callable
+            Usually download_file. Must accept a ``session`` keyword and
+            return a tuple ``(downloaded, session)``. The session of the
+            worker thread is passed unless kwargs bring their own. It may
+            raise RetryLater, in which case it is called again with
+            ``attempt`` increased by 1.
+        host : str
+            Host the job will connect to, used to apply the per-host cap.
+        host_limit : int, optional
+            Per-host cap, taken from ``max_connections`` in sources.yml.
+
+        Returns
+        ----------
+        future : concurrent.futures.Future
+            Resolves to the ``downloaded`` flag returned by func, or to
+            RESCHEDULED if the job will be retried.
+
+        '''
+        future = self._future()
+        with self._lock:
+            self._outstanding += 1
+            self._queue(host, host_limit)
+        self._enqueue(host, func, args, kwargs, future)
+        return future
+
+    @property
+    def busy(self):
+        '''True while jobs or their retries have not finished.'''
+        with self._finished:
+            return self._outstanding > 0
+
+    def on_close(self, cleanup):
+        '''Register a callable to run once all jobs have finished.'''
+        self._cleanups.append(cleanup)
+
+    def close(self):
+        '''
+        Wait for all scheduled jobs and their retries, then release
+        connections.
+
+        Returns
+        ----------
+        failed : int
+            Number of jobs that raised an exception or did not download
+            their file.
+
+        '''
+        with self._finished:
+            while self._outstanding > 0:
+                self._finished.wait()
+        wait(self._futures)
+        failed = 0
+        finished = 0
+        for future in self._futures:
+            if future.exception() is not None:
+                logger.error('download job raised: %r', future.exception())
+                failed += 1
+            elif future.result() is RESCHEDULED:
+                continue
+            elif not future.result():
+                failed += 1
+            finished += 1
+        self._executor.shutdown(wait=True)
+        for cleanup in self._cleanups:
+            cleanup()
+        logger.info('%s download jobs finished, %s failed', finished, failed)
+        self.stats.log()
+        return failed
@@ -0,0 +1,120 @@
+'''
+Open Power System Data
+
+Time series Datapackage
+
+sessions.py : cache of cookies from logins to websites
+
+'''
+
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+logger.setLevel('DEBUG')
+
+# Lifetime assumed for cookies the server sets without an expiry date
+SESSION_MAX_AGE = 8 * 3600
+
+
+class LoginSession():
+    '''
+    Cookies of a login, saved to disk so they can be reused by later runs
+    until they expire or the server rejects them.
+
+    Nothing is done until the cookies are first asked for, so the login (e.g.
+    starting a browser) only happens if a file is to be downloaded.
+
+    Parameters
+    ----------
+    name : str
+        Name of the site, e.g. ``Elexon``
+    login : callable
+        Logs in and returns a requests.cookies.RequestsCookieJar
+    path : str, optional
+        JSON file to save the cookies to. If not given, they are only kept
+        for this run.
+    max_age : int, default SESSION_MAX_AGE
+        Seconds to keep cookies without an expiry date
+
+    '''
+
+    def __init__(self, name, login, path=None, max_age=SESSION_MAX_AGE):
+        self.name = name
+        self.login = login
+        self.path = path
+        self.max_age = max_age
+        self._jar = None
+        self._lock = threading.Lock()
+
+    def cookies(self):
+        '''Return valid cookies, from the cache or from a new login.'''
+        with self._lock:
+            if self._jar is None:
+                self._jar = self._load()
+            if self._jar is None:
+                logger.info('Logging into %s', self.name)
+                self._jar = self.login()
+                self._save(self._jar)
+            return self._jar
+
+    def expire(self, jar):
+        '''
+        Forget jar after the server rejected it, so the next call to
+        cookies() logs in again. Downloads that ran with the same cookies at
+        the same time only cause one new login.
+
+        '''
+        with self._lock:
+            if jar is not self._jar:
+                return
+            logger.info('Cookies for %s were rejected', self.name)
+            self._jar = None
+            if self.path is not None and os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return None
+        with open(self.path) as f:
+            saved = json.load(f)
+        now = time.time()
+        if not saved or any(c['expires'] <= now for c in saved):
+            return None
+        jar = requests.cookies.RequestsCookieJar()
+        for c in saved:
+            jar.set(c['name'], c['value'], domain=c['domain'],
+                    path=c['path'], expires=c['expires'])
+        logger.debug('Reusing cookies for %s from %s', self.name, self.path)
+        return jar
+
+    def _save(self, jar):
+        if self.path is None:
+            return
+        default = int(time.time()) + self.max_age
+        saved = [{'name': c.name, 'value': c.value, 'domain': c.domain,
+                  'path': c.path, 'expires': c.expires or default}
+                 for c in jar]
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        # Readable only by the user, as the cookies give access to the
+        # account
+        fd = os.open(self.path + '.tmp',
+                     os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(saved, f)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def rejected(status, content_type):
+    '''
+    Return True if a response means the cookies sent were not accepted: the
+    server refused access or sent its login page instead of the file.
+
+    '''
+    return status in (401, 403) or (
+        status == 200 and (content_type or '').startswith('text/html'))
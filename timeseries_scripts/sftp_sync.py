@@ -0,0 +1,159 @@
+'''
+Open Power System Data
+
+Time series Datapackage
+
+sftp_sync.py : share authenticated SFTP connections between download jobs
+
+'''
+
+import logging
+import threading
+from contextlib import contextmanager
+
+import paramiko
+
+logger = logging.getLogger(__name__)
+logger.setLevel('DEBUG')
+
+
+class SFTPPool():
+    '''
+    A small pool of authenticated SFTP connections to one server.
+
+    Connections are opened lazily, up to ``size`` of them, and handed out to
+    one download job at a time. Directory listings are fetched once per
+    remote directory and shared by all jobs.
+
+    Parameters
+    ----------
+    host : str
+        SFTP server, e.g. ``sftp-transparency.entsoe.eu``
+    port : int
+        Port of the SFTP server
+    username : str
+    password : str
+    size : int, default 4
+        Maximum number of open connections.
+
+    '''
+
+    def __init__(self, host, port, username, password, size=4):
+        self.host = host
+        self.port = port
+        self.size = size
+        self._auth = {'username': username, 'password': password}
+        self._idle = []
+        self._opened = []
+        # Connections opened or being opened
+        self._slots = 0
+        self._listings = {}
+        self._listing_locks = {}
+        self._lock = threading.Lock()
+        self._available = threading.Condition()
+
+    def _connect(self):
+        transport = paramiko.Transport((self.host, self.port))
+        try:
+            transport.connect(**self._auth)
+            sftp = paramiko.SFTPClient.from_transport(transport)
+        except BaseException:
+            transport.close()
+            raise
+        logger.debug('opened SFTP connection to %s', self.host)
+        return sftp
+
+    @contextmanager
+    def client(self):
+        '''
+        Borrow a connected paramiko.SFTPClient from the pool.
+
+        A connection that raised or whose transport is no longer active is
+        closed instead of being returned, so the next job opens a new one.
+
+        '''
+        with self._available:
+            while not self._idle and self._slots >= self.size:
+                self._available.wait()
+            if self._idle:
+                sftp = self._idle.pop()
+            else:
+                # Connect outside the lock, so a slow handshake does not
+                # hold up jobs that find an idle connection meanwhile
+                sftp = None
+                self._slots += 1
+        if sftp is None:
+            try:
+                sftp = self._connect()
+            except BaseException:
+                with self._available:
+                    self._slots -= 1
+                    self._available.notify()
+                raise
+            with self._available:
+                self._opened.append(sftp)
+        try:
+            yield sftp
+        except BaseException:
+            self._discard(sftp)
+            raise
+        if not sftp.get_channel().get_transport().is_active():
+            self._discard(sftp)
+            return
+        with self._available:
+            self._idle.append(sftp)
+            self._available.notify()
+
+    def _discard(self, sftp):
+        with self._available:
+            self._opened.remove(sftp)
+            self._slots -= 1
+            self._available.notify()
+        logger.debug('dropped SFTP connection to %s', self.host)
+        close_client(sftp)
+
+    def listing(self, path):
+        '''
+        Return the attributes of the files in a remote directory, listing it
+        only on first use.
+
+        Returns
+        ----------
+        listing : dict
+            Maps filenames to paramiko.SFTPAttributes
+        '''
+        with self._lock:
+            if path in self._listings:
+                return self._listings[path]
+            # Jobs starting at the same time wait for the first one to list
+            # the directory
+            listing_lock = self._listing_locks.setdefault(
+                path, threading.Lock())
+        with listing_lock:
+            with self._lock:
+                if path in self._listings:
+                    return self._listings[path]
+            with self.client() as sftp:
+                listing = {a.filename: a for a in sftp.listdir_attr(path)}
+            logger.debug('%s files in %s', len(listing), path)
+            with self._lock:
+                self._listings[path] = listing
+        return listing
+
+    def close(self):
+        '''Close all connections.'''
+        with self._available:
+            opened, self._opened, self._idle = self._opened, [], []
+            self._slots -= len(opened)
+        for sftp in opened:
+            close_client(sftp)
+
+
+def close_client(sftp):
+    '''Close an SFTP client and its transport, ignoring errors.'''
+    try:
+        transport = sftp.get_channel().get_transport()
+        sftp.close()
+        transport.close()
+    except (OSError, EOFError, paramiko.SSHException) as e:
+        logger.debug('closing SFTP connection failed: %r', e)
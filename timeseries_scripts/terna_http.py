@@ -0,0 +1,265 @@
+"""
+Open Power System Data
+
+Timeseries Datapackage
+
+terna_http.py : extracts file links from the web page of Terna with plain
+HTTP form posts instead of a browser
+"""
+
+import datetime
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+import requests
+
+from . import terna
+
+logger = logging.getLogger(__name__)
+logger.setLevel('DEBUG')
+
+PAGE_URL = "https://www.terna.it/SistemaElettrico/TransparencyReport/Generation/Forecastandactualgeneration.aspx"
+PREFIX = "dnn_ctr5990_TernaViewDocumentView_"
+RESULTS_ID = PREFIX + "pnlAccordion"
+YEAR_ID = PREFIX + "cbAnno_Input"
+MONTH_ID = PREFIX + "cbMese_Input"
+SEARCH_CLASS = "dnnSecondaryAction"
+PAGER_CLASS = "rgNumPart"
+LINK_TITLE = "Actual generation of intermittent generation"
+MONTHS = ["January", "February", "March", "April", "May", "June", "July",
+          "August", "September", "October", "November", "December"]
+
+# Target and argument of an ASP.NET postback in a link or onclick handler
+POSTBACK = re.compile(
+    r"""(?:__doPostBack\(|WebForm_PostBackOptions\()\s*['"]([^'"]*)['"]"""
+    r"""\s*,\s*['"]([^'"]*)['"]""")
+
+
+class HTMLLink():
+    """
+    A link parsed from a result page, standing in for the Selenium
+    WebElement expected by terna.link_is_ok(), terna.date_of_link() and
+    terna.url_of_link(), so the same rules apply to both harvesters.
+
+    """
+
+    def __init__(self, attrs, base_url):
+        self.attrs = dict(attrs)
+        if self.attrs.get("href"):
+            self.attrs["href"] = urljoin(base_url, self.attrs["href"])
+
+    def get_attribute(self, name):
+        return self.attrs.get(name) or ""
+
+
+class TernaPage(HTMLParser):
+    """
+    Parse a page of the Terna search form, collecting what is needed to post
+    the form again: its fields, the search button and the links to further
+    result pages, as well as the document links in the results.
+
+    Parameters
+    ----------
+    html : str
+        Page source, e.g. from a saved file
+    url : str
+        Address the page was retrieved from, to resolve relative links
+
+    """
+
+    def __init__(self, html, url=PAGE_URL):
+        super().__init__(convert_charrefs=True)
+        self.url = url
+        self.action = url
+        self.fields = {}
+        self.names = {}
+        self.search = None
+        self.links = []
+        self.pager = []
+        self._depth = 0
+        self._results = None
+        self._pager = None
+        self._anchor = None
+        self.feed(html)
+        self.close()
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = (attrs.get("class") or "").split()
+        if tag == "div":
+            self._depth += 1
+            if attrs.get("id") == RESULTS_ID and self._results is None:
+                self._results = self._depth
+            if PAGER_CLASS in classes and self._pager is None:
+                self._pager = self._depth
+
+        elif tag == "form" and attrs.get("action"):
+            self.action = urljoin(self.url, attrs["action"])
+
+        elif tag == "input" and attrs.get("name"):
+            if attrs.get("id"):
+                self.names[attrs["id"]] = attrs["name"]
+            kind = (attrs.get("type") or "text").lower()
+            if SEARCH_CLASS in classes:
+                self.search = ("submit", attrs["name"],
+                               attrs.get("value") or "")
+            elif kind in ("hidden", "text") or (
+                    kind in ("checkbox", "radio") and "checked" in attrs):
+                self.fields[attrs["name"]] = attrs.get("value") or ""
+
+        elif tag == "a":
+            postback = POSTBACK.search(
+                (attrs.get("href") or "") + (attrs.get("onclick") or ""))
+            if SEARCH_CLASS in classes and postback:
+                self.search = ("postback",) + postback.groups()
+            elif self._pager is not None and postback:
+                self._anchor = [attrs.get("title") or "", "",
+                                postback.groups()]
+            elif self._results is not None:
+                self.links.append(HTMLLink(attrs, self.url))
+
+    def handle_data(self, data):
+        if self._anchor is not None:
+            self._anchor[1] += data
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self._anchor is not None:
+            title, text, postback = self._anchor
+            self.pager.append((title, text.strip(), postback))
+            self._anchor = None
+        elif tag == "div":
+            if self._depth == self._results:
+                self._results = None
+            if self._depth == self._pager:
+                self._pager = None
+            self._depth -= 1
+
+    def next_page(self, current_page_number):
+        """
+        Return the postback leading to the result page after
+        current_page_number, or None if it is the last one. Mirrors
+        terna.next_page().
+
+        """
+        for title, text, postback in self.pager:
+            if text == "...":
+                if title == "Next Pages":
+                    return postback
+            elif text.isdigit() and int(text) == current_page_number + 1:
+                return postback
+        return None
+
+    def filter_links(self, start_date, end_date):
+        """
+        Return the links to the files for dates in [start_date, end_date] on
+        this page. See terna.filter_links() for info on the return value.
+
+        """
+        return {terna.date_of_link(link): terna.url_of_link(link)
+                for link in self.links
+                if terna.link_is_ok(link, LINK_TITLE, start_date, end_date)}
+
+
+def post_back(session, page, target=None, argument="", fields=None,
+              submit=None, timeout=90):
+    """
+    Post the form of page back to the server, as a browser would after a
+    click on a link or button, and return the resulting page.
+
+    """
+    data = dict(page.fields)
+    data.update(fields or {})
+    data["__EVENTTARGET"] = target or ""
+    data["__EVENTARGUMENT"] = argument
+    if submit is not None:
+        data[submit[0]] = submit[1]
+    resp = session.post(page.action, data=data, timeout=timeout)
+    resp.raise_for_status()
+    return TernaPage(resp.text, resp.url)
+
+
+def search_subperiod(start_date, end_date, year, month=None, session=None):
+    """
+    Search the links for the dates between start_date and end_date in the
+    given year and month, going through all result pages. If month is None,
+    search only the given year. Mirrors terna.search_subperiod().
+
+    Returns
+    ----------
+    url_dictionary: dict
+        Dictionary of the form {(year, month, day) : url} of the links
+        satisfying search conditions.
+
+    """
+    if session is None:
+        session = requests.session()
+
+    resp = session.get(PAGE_URL, timeout=90)
+    resp.raise_for_status()
+    page = TernaPage(resp.text, resp.url)
+
+    # Fill in year and month, as typed into the combo boxes
+    fields = {page.names[YEAR_ID]: str(year)}
+    if month is not None:
+        fields[page.names[MONTH_ID]] = MONTHS[month - 1]
+
+    # Click the search button
+    if page.search is None:
+        raise ValueError("search button not found on {}".format(page.url))
+    kind, name, value = page.search
+    if kind == "postback":
+        page = post_back(session, page, name, value, fields=fields)
+    else:
+        page = post_back(session, page, fields=fields, submit=(name, value))
+
+    # Go through result pages and collect the links
+    page_number = 1
+    collected = {}
+    while True:
+        collected.update(page.filter_links(start_date, end_date))
+        postback = page.next_page(page_number)
+        if postback is None:
+            break
+        page = post_back(session, page, *postback)
+        page_number += 1
+
+    logger.debug("%s links in %s pages for (%s, %s)", len(collected),
+                 page_number, year, month or "1-12")
+    return collected
+
+
+def extract_urls(start_date, end_date, max_workers=8):
+    """
+    Extract all the available urls for dates between start_date and
+    end_date, searching up to max_workers subperiods at the same time.
+    Mirrors terna.extract_urls().
+
+    Returns
+    ----------
+    url_dictionary: dict
+        Dictionary of the form {(year, month, day) : url} of the links
+        satisfying search conditions.
+
+    """
+    subperiods = terna.get_subperiods(start_date, end_date)
+
+    def search(subperiod):
+        return search_subperiod(start_date, end_date, *subperiod)
+
+    collected = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for result in executor.map(search, subperiods):
+            collected.update(result)
+
+    # Checking if URLs are collected for all the dates in the period.
+    no_data_dates = terna.get_terna_no_data_dates()
+    for i in range((end_date - start_date).days + 1):
+        date = start_date + datetime.timedelta(days=i)
+        date_key = (date.year, date.month, date.day)
+        if date_key not in collected and date_key not in no_data_dates:
+            logger.info("No URL for %s", date)
+
+    return collected